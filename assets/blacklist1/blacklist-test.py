@@ -1,13 +1,12 @@
 import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
 from datetime import datetime
 import os
+import sys
 from urllib.parse import urlparse
-import socket  #check p3p源 rtp源
-import subprocess #check rtmp源
 
-import json
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.stream_checker import check_urls
+from utils.url import canonicalize_url, strip_url_info
 
 timestart = datetime.now()
 
@@ -23,173 +22,31 @@ def read_txt_file(file_path):
         ]
     return lines
 
-def get_video_resolution(video_path):
-    # 使用 ffprobe 命令来获取视频的流信息，以 JSON 格式输出
-    command = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
-        'stream=width,height', '-of', 'json', video_path
-    ]
-    
-    # 运行命令并捕获输出
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    
-    # 解析 JSON 输出
-    video_info = json.loads(result.stdout)
-    
-    # 提取宽度和高度
-    width = video_info['streams'][0]['width']
-    height = video_info['streams'][0]['height']
-    
-    return width, height
-
-# 检测URL是否可访问并记录响应时间
-def check_url(url, timeout=6):
-    start_time = time.time()
-    elapsed_time = None
-    success = False
-    
-    try:
-        if url.startswith("http"):
-            headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            }
-            req = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req, timeout=timeout) as response:
-                if response.status == 200:
-                    success = True
-        elif url.startswith("p3p"):
-            success = check_p3p_url(url, timeout)
-        elif url.startswith("p2p"):
-            success = check_p2p_url(url, timeout)
-        elif url.startswith("rtmp") or url.startswith("rtsp") :
-            success = check_rtmp_url(url, timeout)
-        elif url.startswith("rtp"):
-            success = check_rtp_url(url, timeout)
-
-        # 如果执行到这一步，没有异常，计算时间
-        elapsed_time = (time.time() - start_time) * 1000  # 转换为毫秒
-
-    except Exception as e:
-        print(f"Error checking {url}: {e}")
-        # 在发生异常的情况下，将 elapsed_time 设置为 None
-        elapsed_time = None
-
-    return elapsed_time, success
-
-def check_rtmp_url(url, timeout): 
-    try:
-        result = subprocess.run(['ffprobe', url], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
-        if result.returncode == 0:
-            return True
-    except subprocess.TimeoutExpired:
-        print(f"Timeout checking {url}")
-    except Exception as e:
-        print(f"Error checking {url}: {e}")
-    return False
-
-def check_rtp_url(url, timeout):
-    try:
-        # 解析URL
-        parsed_url = urlparse(url)
-        
-        # 提取主机名（IP地址）和端口号
-        host = parsed_url.hostname
-        port = parsed_url.port
-
-        # 创建一个 socket 连接
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.settimeout(timeout)  # 设置超时时间
-            s.connect((host, port))
-            s.sendto(b'', (host, port))  # 发送空的UDP数据包
-            s.recv(1)  # 尝试接收数据
-        return True
-    except (socket.timeout, socket.error):
-        return False
-
-def check_p3p_url(url, timeout):
-    try:
-        # 解析URL
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port
-        path = parsed_url.path
-        
-        # 检查解析是否成功
-        if not host or not port or not path:
-            raise ValueError("Invalid p3p URL")
-
-        # 创建一个 TCP 连接
-        with socket.create_connection((host, port), timeout=timeout) as s:
-            # 发送一个简单的请求（根据协议定义可能需要调整）
-            request = f"GET {path} P3P/1.0\r\nHost: {host}\r\n\r\n"
-            s.sendall(request.encode())
-            
-            # 读取响应
-            response = s.recv(1024)
-            
-            # 简单判断是否收到有效响应
-            if b"P3P" in response:
-                return True
-    except Exception as e:
-        print(f"Error checking {url}: {e}")
-    return False
-
-def check_p2p_url(url, timeout):
-    try:
-        # 解析URL
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port
-        path = parsed_url.path
-
-        # 检查解析是否成功
-        if not host or not port or not path:
-            raise ValueError("Invalid P2P URL")
-
-        # 创建一个 TCP 连接
-        with socket.create_connection((host, port), timeout=timeout) as s:
-            # 自定义请求，这里只是一个占位符，需根据具体协议定义
-            request = f"YOUR_CUSTOM_REQUEST {path}\r\nHost: {host}\r\n\r\n"
-            s.sendall(request.encode())
-            
-            # 读取响应
-            response = s.recv(1024)
-            
-            # 自定义响应解析，这里简单示例
-            if b"SOME_EXPECTED_RESPONSE" in response:
-                return True
-    except Exception as e:
-        print(f"Error checking {url}: {e}")
-    return False
-
-# 处理单行文本并检测URL
-def process_line(line):
+# 处理单行文本，拆出频道名和URL
+def parse_line(line):
     if "#genre#" in line or "://" not in line :
         return None, None  # 跳过包含“#genre#”的行
     parts = line.split(',')
     if len(parts) == 2:
         name, url = parts
-        elapsed_time, is_valid = check_url(url.strip())
-        if is_valid:
-            return elapsed_time, line.strip()
-        else:
-            return None, line.strip()
+        return line.strip(), url.strip()
     return None, None
 
-# 多线程处理文本并检测URL
-def process_urls_multithreaded(lines, max_workers=18):
+# 异步并发检测URL(共享连接池，ffprobe单独限流)
+def process_urls_multithreaded(lines, concurrency=200):
     blacklist =  [] 
     successlist = []
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_line, line): line for line in lines}
-        for future in as_completed(futures):
-            elapsed_time, result = future.result()
-            if result:
-                if elapsed_time is not None:
-                    successlist.append(f"{elapsed_time:.2f}ms,{result}")
-                else:
-                    blacklist.append(result)
+    pending = [parse_line(line) for line in lines]
+    pending = [(line, url) for line, url in pending if line]
+    results = check_urls([url for _, url in pending], concurrency=concurrency, resolution=False)
+    for (line, url), result in zip(pending, results):
+        if result["error"] and result["error"] != "CircuitOpen":
+            print(f"Error checking {url}: {result['error']}")
+        if result["success"] and result["delay"] is not None:
+            successlist.append(f"{result['delay']:.2f}ms,{line}")
+        else:
+            blacklist.append(line)
     return successlist, blacklist
 
 # 写入文件
@@ -267,14 +124,14 @@ def process_url(url):
 
 # 去重复源 2024-08-06 (检测前剔除重复url，提高检测效率)
 def remove_duplicates_url(lines):
-    urls =[]
+    urls =set()
     newlines=[]
     for line in lines:
         if "," in line and "://" in line:
             # channel_name=line.split(',')[0].strip()
-            channel_url=line.split(',')[1].strip()
+            channel_url=canonicalize_url(line.split(',')[1]) # 规范化URL(主机大小写、默认端口、结尾斜杠、参数顺序等)
             if channel_url not in urls: # 如果发现当前url不在清单中，则假如newlines
-                urls.append(channel_url)
+                urls.add(channel_url)
                 newlines.append(line)
     return newlines
 
@@ -285,14 +142,11 @@ def remove_duplicates_url(lines):
 #        return url[:last_dollar_index]
 #    return url
 def clean_url(lines):
-    urls =[]
     newlines=[]
     for line in lines:
         if "," in line and "://" in line:
-            last_dollar_index = line.rfind('$')
-            if last_dollar_index != -1:
-                line=line[:last_dollar_index]
-            newlines.append(line)
+            channel_name, channel_url = line.split(',', 1)
+            newlines.append(f"{channel_name},{strip_url_info(channel_url)}")
     return newlines
 
 # 处理带#的URL  【2024-08-09 23:53:26】
@@ -1,21 +1,28 @@
 import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
 from datetime import datetime
 import os
+import sys
 from urllib.parse import urlparse
-import socket
-import subprocess
-import random
-import json
-import shutil
+
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.stream_checker import check_urls
+from utils.url import canonicalize_url, strip_url_info
+from utils.file_writer import write_lines_if_changed, write_stats, TIME_LINE_PATTERN
+from utils.check_ledger import CheckLedger
 
 # ====== 全局配置 ======
 LOG_LEVEL = "INFO"  # DEBUG/INFO/WARN/ERROR
-MAX_WORKERS = 30
+CONCURRENCY = 300  # 同时检测的URL数量(异步，不占线程)
+FFPROBE_WORKERS = 8  # 同时运行的ffprobe进程数
 CHECK_TIMEOUT = 6
 FFPROBE_TIMEOUT = 8
 BLACK_HOSTS = ["127.0.0.1:8080", "live3.lalifeier.eu.org", "newcntv.qcloudcdn.com"]
+HOST_FAILURE_LIMIT = 5  # 同一主机连续连接失败次数达到后，其余URL直接判定失败(熔断)
+HOST_RETRY_AFTER = 30  # 熔断后多少秒放行一次试探检测(半开)，None表示不再试探
+LEDGER_FILE = "check_ledger.db"  # 检测记录，TTL内的URL不再重复检测
+LEDGER_HEALTHY_TTL = 6 * 3600  # 有效源复检间隔(秒)
+LEDGER_DEAD_TTL = 3600  # 失效源复检间隔(秒)，连续失败时指数退避
+LEDGER_MAX_DEAD_TTL = 7 * 24 * 3600  # 失效源最长复检间隔(秒)
 # =====================
 
 def log(level, msg):
@@ -23,105 +30,81 @@ def log(level, msg):
     if levels.index(level) >= levels.index(LOG_LEVEL):
         print(f"[{level}] {msg}")
 
-# 随机User-Agent
-def get_random_user_agent():
-    USER_AGENTS = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
-    ]
-    return random.choice(USER_AGENTS)
-
-def get_video_resolution(video_path, timeout=FFPROBE_TIMEOUT):
-    command = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
-        'stream=width,height', '-of', 'json', video_path
-    ]
-    try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                               text=True, timeout=timeout)
-        video_info = json.loads(result.stdout)
-        width = video_info['streams'][0]['width']
-        height = video_info['streams'][0]['height']
-        return width, height
-    except Exception as e:
-        log("WARN", f"获取分辨率失败: {e}")
+def parse_line(line):
+    if "#genre#" in line or "://" not in line:
+        return None, None
+        
+    parts = line.split(',', 1)
+    if len(parts) < 2:
         return None, None
+        
+    name, url = parts
+    return name.strip(), url.strip()
 
-def check_url(url, timeout=CHECK_TIMEOUT):
-    start_time = time.time()
-    success = False
-    width, height = 0, 0
-    encoded_url = urllib.parse.quote(url, safe=':/?&=')
-    
-    try:
+def log_result(result):
+    if result["error"] == "CircuitOpen":
+        log("DEBUG", f"主机已熔断，跳过检测: {result['url']}")
+    elif result["error"]:
+        log("WARN", f"检测URL异常 {result['url']}: {result['error']}")
+    else:
+        log("DEBUG", f"检测 {result['url']}: 成功={result['success']}, 时间={result['delay']:.1f}ms, "
+                     f"分辨率={result['width']}x{result['height']}")
+
+def process_urls(lines, ledger, concurrency=CONCURRENCY):
+    results = []
+    pending = []
+    for line in lines:
+        name, url = parse_line(line)
+        if name is None:
+            continue
         # 检查黑名单主机
         host = get_host_from_url(url)
         if any(black_host in host for black_host in BLACK_HOSTS):
             log("INFO", f"跳过黑名单主机: {host}")
-            return False, None, None, None
-            
-        if url.startswith("http"):
-            headers = {'User-Agent': get_random_user_agent()}
-            req = urllib.request.Request(encoded_url, headers=headers)
-            with urllib.request.urlopen(req, timeout=timeout) as response:
-                success = (response.status == 200)
-        elif url.startswith("p3p"):
-            success = check_p3p_url(url, timeout)
-        elif url.startswith("p2p"):
-            success = check_p2p_url(url, timeout)        
-        elif url.startswith("rtmp") or url.startswith("rtsp"):
-            success = check_rtmp_url(url, timeout)
-        elif url.startswith("rtp"):
-            success = check_rtp_url(url, timeout)
-        else:
-            log("WARN", f"不支持的协议: {url}")
-
-        elapsed_time = (time.time() - start_time) * 1000
-        if success:
-            width, height = get_video_resolution(url)
-        log("DEBUG", f"检测 {url}: 成功={success}, 时间={elapsed_time:.1f}ms, 分辨率={width}x{height}")
-    except Exception as e:
-        log("WARN", f"检测URL异常 {url}: {e}")
-        elapsed_time = None
-        record_host(host)
-        
-    return success, elapsed_time, width, height
+            results.append((name, url, False, None, "N/A"))
+            continue
+        pending.append((name, url))
 
-# 协议检测函数保持不变...
+    # 只检测TTL已过期的URL
+    fresh, stale = ledger.split(list(dict.fromkeys(url for _, url in pending)))
+    skipped_ok = sum(result["success"] for result in fresh.values())
+    log("INFO", f"检测记录有效，跳过检测: {len(fresh)} (有效 {skipped_ok}, 失效 {len(fresh) - skipped_ok})，"
+                f"需要检测: {len(stale)}")
 
-def process_line(line):
-    if "#genre#" in line or "://" not in line:
-        return None, None, None, None, None
-        
-    parts = line.split(',', 1)
-    if len(parts) < 2:
-        return None, None, None, None, None
-        
-    name, url = parts
-    url = url.strip()
-    success, elapsed, width, height = check_url(url)
-    return name.strip(), url, success, elapsed, f"{width}x{height}" if width and height else "N/A"
+    # 异步检测，共享连接池，ffprobe单独限流
+    checked = check_urls(
+        stale,
+        callback=log_result,
+        concurrency=concurrency,
+        timeout=CHECK_TIMEOUT,
+        ffprobe_concurrency=FFPROBE_WORKERS,
+        ffprobe_timeout=FFPROBE_TIMEOUT,
+        host_failure_limit=HOST_FAILURE_LIMIT,
+        half_open_after=HOST_RETRY_AFTER,
+    )
+    # 熔断跳过的URL不写入检测记录，下次运行重新检测
+    short_circuited = sum(result["error"] == "CircuitOpen" for result in checked)
+    log("INFO", f"主机熔断跳过检测: {short_circuited}")
+    ledger.update([result for result in checked if result["error"] != "CircuitOpen"])
+    for result in checked:
+        if result["error"]:
+            record_host(get_host_from_url(result["url"]))
+    checked = {**fresh, **{result["url"]: result for result in checked}}
 
-def process_urls_multithreaded(lines, max_workers=MAX_WORKERS):
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_line, line): line for line in lines}
-        for future in as_completed(futures):
-            try:
-                res = future.result()
-                if res[0] is not None:  # 有效结果
-                    results.append(res)
-            except Exception as e:
-                log("ERROR", f"线程执行异常: {e}")
+    for name, url in pending:
+        result = checked[url]
+        width, height = result["width"], result["height"]
+        results.append((name, url, result["success"], result["delay"],
+                        f"{width}x{height}" if width and height else "N/A"))
     return results
 
-def write_list(file_path, data_list):
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as file:
-        for item in data_list:
-            file.write(item + '\n')
+def write_list(file_path, data_list, compare_path=None):
+    # 内容(除更新时间外)未变化时不重写
+    write_lines_if_changed(file_path, data_list, ignore=TIME_LINE_PATTERN, compare_path=compare_path)
+
+def get_latest_file(dir_path, suffix):
+    files = sorted(name for name in os.listdir(dir_path) if name.endswith(suffix)) if os.path.isdir(dir_path) else []
+    return os.path.join(dir_path, files[-1]) if files else None
 
 def convert_m3u_to_txt(m3u_content):
     lines = m3u_content.split('\n')
@@ -164,9 +147,10 @@ def remove_duplicates_url(lines):
         if "," not in line or "://" not in line:
             continue
             
-        url = line.split(',', 1)[1].strip()
-        if url not in seen:
-            seen.add(url)
+        # 按规范化URL去重(主机大小写、默认端口、结尾斜杠、参数顺序等)
+        key = canonicalize_url(line.split(',', 1)[1])
+        if key not in seen:
+            seen.add(key)
             newlines.append(line)
     return newlines
 
@@ -176,10 +160,8 @@ def clean_url(lines):
         if "," not in line or "://" not in line:
             continue
             
-        last_dollar = line.rfind('$')
-        if last_dollar != -1:
-            line = line[:last_dollar]
-        newlines.append(line)
+        name, url = line.split(',', 1)
+        newlines.append(f"{name},{strip_url_info(url)}")
     return newlines
 
 def split_url(lines):
@@ -225,11 +207,10 @@ def save_blackhost_report(current_dir):
         f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_blackhost_count.txt"
     )
     
-    with open(filename, "w") as file:
-        for host, count in sorted(blacklist_dict.items(), key=lambda x: x[1], reverse=True):
-            file.write(f"{host}: {count}\n")
-    
-    log("INFO", f"黑名单统计保存到: {filename}")
+    # 与上一份统计相同时不再生成新文件
+    lines = [f"{host}: {count}" for host, count in sorted(blacklist_dict.items(), key=lambda x: x[1], reverse=True)]
+    if write_lines_if_changed(filename, lines, compare_path=get_latest_file(blackhost_dir, "_blackhost_count.txt")):
+        log("INFO", f"黑名单统计保存到: {filename}")
     return filename
 
 def create_tv_list(successlist):
@@ -293,8 +274,12 @@ if __name__ == "__main__":
         all_lines = remove_duplicates_url(all_lines)
         log("INFO", f"去重后数量: {len(all_lines)}")
         
-        # 多线程检测
-        results = process_urls_multithreaded(all_lines)
+        # 异步检测(增量)
+        with CheckLedger(os.path.join(current_dir, LEDGER_FILE), LEDGER_HEALTHY_TTL,
+                         LEDGER_DEAD_TTL, LEDGER_MAX_DEAD_TTL) as ledger:
+            results = process_urls(all_lines, ledger)
+            pruned = ledger.prune(2 * LEDGER_MAX_DEAD_TTL)
+            log("INFO", f"清理过期检测记录: {pruned}")
         log("INFO", f"检测完成，有效源: {len(results)}")
         
         # 生成结果
@@ -328,8 +313,11 @@ if __name__ == "__main__":
         os.makedirs(history_dir, exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        write_list(os.path.join(history_dir, f"{timestamp}_whitelist_auto.txt"), success_header)
-        write_list(os.path.join(history_dir, f"{timestamp}_blacklist_auto.txt"), black_header)
+        # 与最近一份历史记录相同时不再生成新文件
+        write_list(os.path.join(history_dir, f"{timestamp}_whitelist_auto.txt"), success_header,
+                   compare_path=get_latest_file(history_dir, "_whitelist_auto.txt"))
+        write_list(os.path.join(history_dir, f"{timestamp}_blacklist_auto.txt"), black_header,
+                   compare_path=get_latest_file(history_dir, "_blacklist_auto.txt"))
         
         # 保存黑名单统计
         save_blackhost_report(current_dir)
@@ -338,6 +326,7 @@ if __name__ == "__main__":
         timeend = datetime.now()
         elapsed = timeend - timestart
         log("INFO", f"执行时间: {elapsed.total_seconds():.1f}秒")
+        write_stats.report()
         
         for stat in url_stats:
             log("INFO", f"订阅统计: {stat}")
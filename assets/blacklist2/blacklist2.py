@@ -1,19 +1,22 @@
 import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
 from datetime import datetime
 import os
+import sys
 from urllib.parse import urlparse
-import socket
-import subprocess
-import json
-import random
+
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.stream_checker import check_urls
+from utils.url import canonicalize_url, strip_url_info
+from utils.file_writer import write_lines_if_changed, write_stats, TIME_LINE_PATTERN
 
 # ====== 全局配置 ======
 LOG_LEVEL = "INFO"  # DEBUG/INFO/WARN/ERROR
-MAX_WORKERS = 20
+CONCURRENCY = 200  # 同时检测的URL数量(异步，不占线程)
+FFPROBE_WORKERS = 8  # 同时运行的ffprobe进程数
 CHECK_TIMEOUT = 6
 FFPROBE_TIMEOUT = 8
+HOST_FAILURE_LIMIT = 5  # 同一主机连续连接失败次数达到后，其余URL直接判定失败(熔断)
+HOST_RETRY_AFTER = 30  # 熔断后多少秒放行一次试探检测(半开)，None表示不再试探
 # =====================
 
 def log(level, msg):
@@ -21,98 +24,48 @@ def log(level, msg):
     if levels.index(level) >= levels.index(LOG_LEVEL):
         print(f"[{level}] {msg}")
 
-def get_video_resolution(video_path, timeout=FFPROBE_TIMEOUT):
-    command = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
-        'stream=width,height', '-of', 'json', video_path
-    ]
-    try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                               text=True, timeout=timeout)
-        video_info = json.loads(result.stdout)
-        width = video_info['streams'][0]['width']
-        height = video_info['streams'][0]['height']
-        return width, height
-    except Exception as e:
-        log("WARN", f"获取分辨率失败: {e}")
-        return None, None
-
-# 随机User-Agent
-def get_random_user_agent():
-    USER_AGENTS = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
-    ]
-    return random.choice(USER_AGENTS)
-
-def check_url(url, timeout=CHECK_TIMEOUT):
-    start_time = time.time()
-    success = False
-    width, height = 0, 0
-    
-    try:
-        if url.startswith("http"):
-            headers = {'User-Agent': get_random_user_agent()}
-            req = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req, timeout=timeout) as response:
-                success = (response.status == 200)
-        elif url.startswith("p3p"):
-            success = check_p3p_url(url, timeout)
-        elif url.startswith("p2p"):
-            success = check_p2p_url(url, timeout)        
-        elif url.startswith("rtmp") or url.startswith("rtsp"):
-            success = check_rtmp_url(url, timeout)
-        elif url.startswith("rtp"):
-            success = check_rtp_url(url, timeout)
-        else:
-            log("WARN", f"不支持的协议: {url}")
-
-        elapsed_time = (time.time() - start_time) * 1000
-        if success:
-            width, height = get_video_resolution(url)
-        log("DEBUG", f"检测 {url}: 成功={success}, 时间={elapsed_time:.1f}ms, 分辨率={width}x{height}")
-    except Exception as e:
-        log("WARN", f"检测URL异常 {url}: {e}")
-        elapsed_time = None
-        
-    return success, elapsed_time, width, height
-
-# 协议检测函数保持不变...
-
-def process_line(line):
+def parse_line(line):
     if "#genre#" in line or "://" not in line:
-        return None, None, None, None
+        return None, None
         
     parts = line.split(',', 1)
     if len(parts) < 2:
-        return None, None, None, None
+        return None, None
         
     name, url = parts
-    url = url.strip()
-    return name.strip(), url, *check_url(url)
-
-# 高效多线程处理
-def process_urls_multithreaded(lines, max_workers=MAX_WORKERS):
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_line, line): line for line in lines}
-        for future in as_completed(futures):
-            try:
-                res = future.result()
-                if res[0] is not None:  # 有效结果
-                    results.append(res)
-            except Exception as e:
-                log("ERROR", f"线程执行异常: {e}")
-    return results
+    return name.strip(), url.strip()
+
+def log_result(result):
+    if result["error"] == "CircuitOpen":
+        log("DEBUG", f"主机已熔断，跳过检测: {result['url']}")
+    elif result["error"]:
+        log("WARN", f"检测URL异常 {result['url']}: {result['error']}")
+    else:
+        log("DEBUG", f"检测 {result['url']}: 成功={result['success']}, 时间={result['delay']:.1f}ms, "
+                     f"分辨率={result['width']}x{result['height']}")
+
+# 异步并发检测，共享连接池，ffprobe单独限流
+def process_urls(lines, concurrency=CONCURRENCY):
+    pending = [parse_line(line) for line in lines]
+    pending = [(name, url) for name, url in pending if name is not None]
+    checked = check_urls(
+        [url for _, url in pending],
+        callback=log_result,
+        concurrency=concurrency,
+        timeout=CHECK_TIMEOUT,
+        ffprobe_concurrency=FFPROBE_WORKERS,
+        ffprobe_timeout=FFPROBE_TIMEOUT,
+        host_failure_limit=HOST_FAILURE_LIMIT,
+        half_open_after=HOST_RETRY_AFTER,
+    )
+    log("INFO", f"主机熔断跳过检测: {sum(result['error'] == 'CircuitOpen' for result in checked)}")
+    return [(name, url, result["success"], result["delay"], result["width"], result["height"])
+            for (name, url), result in zip(pending, checked)]
 
 # 写入文件
 def write_list(file_path, data_list):
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as file:
-        for item in data_list:
-            file.write(item + '\n')
+    # 内容(除更新时间外)未变化时不重写
+    write_lines_if_changed(file_path, data_list, ignore=TIME_LINE_PATTERN)
 
 # 转换M3U格式
 def convert_m3u_to_txt(m3u_content):
@@ -158,9 +111,10 @@ def remove_duplicates_url(lines):
         if "," not in line or "://" not in line:
             continue
             
-        url = line.split(',', 1)[1].strip()
-        if url not in seen:
-            seen.add(url)
+        # 按规范化URL去重(主机大小写、默认端口、结尾斜杠、参数顺序等)
+        key = canonicalize_url(line.split(',', 1)[1])
+        if key not in seen:
+            seen.add(key)
             newlines.append(line)
     return newlines
 
@@ -171,10 +125,8 @@ def clean_url(lines):
         if "," not in line or "://" not in line:
             continue
             
-        last_dollar = line.rfind('$')
-        if last_dollar != -1:
-            line = line[:last_dollar]
-        newlines.append(line)
+        name, url = line.split(',', 1)
+        newlines.append(f"{name},{strip_url_info(url)}")
     return newlines
 
 # 修正URL拆分
@@ -227,8 +179,8 @@ if __name__ == "__main__":
         all_lines = remove_duplicates_url(all_lines)
         log("INFO", f"去重后数量: {len(all_lines)}")
         
-        # 多线程检测
-        results = process_urls_multithreaded(all_lines)
+        # 异步检测
+        results = process_urls(all_lines)
         log("INFO", f"检测完成，有效源: {len(results)}")
         
         # 生成结果
@@ -251,6 +203,7 @@ if __name__ == "__main__":
         timeend = datetime.now()
         elapsed = timeend - timestart
         log("INFO", f"执行时间: {elapsed.total_seconds():.1f}秒")
+        write_stats.report()
         
         for stat in url_stats:
             log("INFO", f"订阅统计: {stat}")
@@ -2,20 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
 from datetime import datetime
 import os
 from urllib.parse import urlparse
-import socket
-import subprocess
-import json
-import random
 import argparse
 import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.stream_checker import check_urls
+from utils.url import canonicalize_url, strip_url_info
+from utils.file_writer import write_lines_if_changed, write_stats, TIME_LINE_PATTERN
+
 # ========== 默认配置 ==========
-DEFAULT_MAX_WORKERS = 20
+DEFAULT_CONCURRENCY = 200  # 同时检测的URL数量(异步，不占线程)
+DEFAULT_FFPROBE_WORKERS = 8  # 同时运行的ffprobe进程数
 DEFAULT_CHECK_TIMEOUT = 6
 DEFAULT_FFPROBE_TIMEOUT = 8
 DEFAULT_KEEP_LINES = 100
@@ -24,13 +24,8 @@ DEFAULT_KEEP_PER_NAME = 1
 DEFAULT_LOG_LEVEL = "INFO"
 DEFAULT_SAVE_FAILED = False
 DEFAULT_PROTOCOLS = []  # 空代表全部协议
-
-USER_AGENTS = [
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36",
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
-]
+DEFAULT_HOST_FAILURE_LIMIT = 5  # 同一主机连续连接失败次数达到后熔断，0代表不熔断
+DEFAULT_HOST_RETRY_AFTER = 30  # 熔断后多少秒放行一次试探检测
 
 # ================================================
 
@@ -39,112 +34,7 @@ def log(level, msg, log_level):
     if levels.index(level) >= levels.index(log_level):
         print(f"[{level}] {msg}")
 
-def get_random_user_agent():
-    return random.choice(USER_AGENTS)
-
-def get_video_resolution(video_path, timeout=DEFAULT_FFPROBE_TIMEOUT):
-    command = [
-        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
-        'stream=width,height', '-of', 'json', video_path
-    ]
-    try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
-        video_info = json.loads(result.stdout)
-        width = video_info['streams'][0]['width']
-        height = video_info['streams'][0]['height']
-        return width, height
-    except Exception as e:
-        log("WARN", f"获取分辨率失败: {e}", "WARN")
-        return None, None
-
-def check_rtmp_url(url, timeout=DEFAULT_CHECK_TIMEOUT):
-    try:
-        result = subprocess.run(['ffprobe', url], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
-        return result.returncode == 0
-    except Exception as e:
-        log("WARN", f"RTMP检查失败: {e}", "WARN")
-        return False
-
-def check_rtp_url(url, timeout=DEFAULT_CHECK_TIMEOUT):
-    try:
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.settimeout(timeout)
-            s.connect((host, port))
-            s.sendto(b'', (host, port))
-            s.recv(1)
-        return True
-    except Exception as e:
-        log("WARN", f"RTP检查失败: {e}", "WARN")
-        return False
-
-def check_p3p_url(url, timeout=DEFAULT_CHECK_TIMEOUT):
-    try:
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port
-        path = parsed_url.path
-        if not host or not port or not path:
-            return False
-        with socket.create_connection((host, port), timeout=timeout) as s:
-            request = f"GET {path} P3P/1.0\r\nHost: {host}\r\n\r\n"
-            s.sendall(request.encode())
-            response = s.recv(1024)
-            return b"P3P" in response
-    except Exception as e:
-        log("WARN", f"P3P检查失败: {e}", "WARN")
-        return False
-
-def check_p2p_url(url, timeout=DEFAULT_CHECK_TIMEOUT):
-    try:
-        parsed_url = urlparse(url)
-        host = parsed_url.hostname
-        port = parsed_url.port
-        path = parsed_url.path
-        if not host or not port or not path:
-            return False
-        with socket.create_connection((host, port), timeout=timeout) as s:
-            request = f"YOUR_CUSTOM_REQUEST {path}\r\nHost: {host}\r\n\r\n"
-            s.sendall(request.encode())
-            response = s.recv(1024)
-            return b"SOME_EXPECTED_RESPONSE" in response
-    except Exception as e:
-        log("WARN", f"P2P检查失败: {e}", "WARN")
-        return False
-
-def check_url(url, timeout=DEFAULT_CHECK_TIMEOUT, log_level="INFO"):
-    start_time = time.time()
-    success = False
-    width, height = 0, 0
-    try:
-        if url.startswith("http"):
-            headers = {'User-Agent': get_random_user_agent()}
-            req = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req, timeout=timeout) as response:
-                success = (response.status == 200)
-        elif url.startswith("p3p"):
-            success = check_p3p_url(url, timeout)
-        elif url.startswith("p2p"):
-            success = check_p2p_url(url, timeout)
-        elif url.startswith("rtmp") or url.startswith("rtsp"):
-            success = check_rtmp_url(url, timeout)
-        elif url.startswith("rtp"):
-            success = check_rtp_url(url, timeout)
-        else:
-            log("WARN", f"不支持的协议: {url}", log_level)
-
-        elapsed_time = (time.time() - start_time) * 1000  # ms
-        if success:
-            width, height = get_video_resolution(url)
-        log("DEBUG", f"Checked {url}: success={success}, time={elapsed_time:.1f}ms, resolution={width}x{height}", log_level)
-    except Exception as e:
-        log("WARN", f"Exception checking URL {url}: {e}", log_level)
-        elapsed_time = None
-    return success, elapsed_time, width, height
-
-def process_line(line, timeout, allowed_protocols, log_level):
+def parse_line(line, allowed_protocols, log_level):
     if "#genre#" in line or "://" not in line:
         return None
     parts = line.split(',')
@@ -157,8 +47,7 @@ def process_line(line, timeout, allowed_protocols, log_level):
         if proto not in allowed_protocols:
             log("DEBUG", f"跳过协议不允许的URL：{url}", log_level)
             return None
-    is_valid, elapsed_time, width, height = check_url(url, timeout, log_level)
-    return name.strip(), url, is_valid, elapsed_time, width, height
+    return name.strip(), url
 
 def write_list(file_path, data_list):
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -214,9 +103,10 @@ def remove_duplicates(lines):
     new_lines = []
     for line in lines:
         if "," in line and "://" in line:
-            url = line.split(',', 1)[1].strip()
-            if url not in seen:
-                seen.add(url)
+            # 按规范化URL去重(主机大小写、默认端口、结尾斜杠、参数顺序等)
+            key = canonicalize_url(line.split(',', 1)[1])
+            if key not in seen:
+                seen.add(key)
                 new_lines.append(line)
     return new_lines
 
@@ -224,10 +114,8 @@ def clean_url(lines):
     new_lines = []
     for line in lines:
         if "," in line and "://" in line:
-            last_dollar = line.rfind('$')
-            if last_dollar != -1:
-                line = line[:last_dollar]
-            new_lines.append(line)
+            name, url = line.split(',', 1)
+            new_lines.append(f"{name},{strip_url_info(url)}")
     return new_lines
 
 def split_url(lines):
@@ -245,18 +133,32 @@ def split_url(lines):
                     new_lines.append(f"{channel_name},{url}")
     return new_lines
 
-def process_urls_multithreaded(lines, threads, timeout, allowed_protocols, log_level):
-    results = []
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = {executor.submit(process_line, line, timeout, allowed_protocols, log_level): line for line in lines}
-        for future in as_completed(futures):
-            try:
-                res = future.result()
-                if res:
-                    results.append(res)
-            except Exception as e:
-                log("WARN", f"线程执行异常: {e}", log_level)
-    return results
+def process_urls(lines, concurrency, timeout, allowed_protocols, log_level, host_failure_limit):
+    pending = [parse_line(line, allowed_protocols, log_level) for line in lines]
+    pending = [item for item in pending if item]
+
+    def log_result(result):
+        if result["error"] == "CircuitOpen":
+            log("DEBUG", f"Host circuit open, skipped {result['url']}", log_level)
+        elif result["error"]:
+            log("WARN", f"Exception checking URL {result['url']}: {result['error']}", log_level)
+        else:
+            log("DEBUG", f"Checked {result['url']}: success={result['success']}, time={result['delay']:.1f}ms, "
+                         f"resolution={result['width']}x{result['height']}", log_level)
+
+    checked = check_urls(
+        [url for _, url in pending],
+        callback=log_result,
+        concurrency=concurrency,
+        timeout=timeout,
+        ffprobe_concurrency=DEFAULT_FFPROBE_WORKERS,
+        ffprobe_timeout=DEFAULT_FFPROBE_TIMEOUT,
+        host_failure_limit=host_failure_limit,
+        half_open_after=DEFAULT_HOST_RETRY_AFTER,
+    )
+    log("INFO", f"主机熔断跳过检测: {sum(result['error'] == 'CircuitOpen' for result in checked)}", log_level)
+    return [(name, url, result["success"], result["delay"], result["width"], result["height"])
+            for (name, url), result in zip(pending, checked)]
 
 def filter_keep_per_name(results, keep_per_name):
     kept = []
@@ -275,12 +177,13 @@ def parse_args():
     parser.add_argument('--file', type=str, default="output/custom.txt", help="本地输入直播源文件路径")
     parser.add_argument('--urls', type=str, default="", help="远程订阅URL列表，逗号分隔，优先级高于--file")
     parser.add_argument('--output', type=str, default="assets/blacklist3/result.txt", help="检测结果输出文件路径")
-    parser.add_argument('--threads', type=int, default=DEFAULT_MAX_WORKERS, help="检测线程数")
+    parser.add_argument('--concurrency', '--threads', dest='concurrency', type=int, default=DEFAULT_CONCURRENCY, help="同时检测的URL数量")
     parser.add_argument('--timeout', type=int, default=DEFAULT_CHECK_TIMEOUT, help="请求超时时间（秒）")
     parser.add_argument('--retry', type=int, default=DEFAULT_RETRY_COUNT, help="最大重试次数")
     parser.add_argument('--protocol', type=str, default="", help="允许协议列表，逗号分隔，空代表全部")
     parser.add_argument('--save_failed', type=str, default=str(DEFAULT_SAVE_FAILED), help="是否保存失败源，true/false")
     parser.add_argument('--keep_per_name', type=int, default=DEFAULT_KEEP_PER_NAME, help="同名称直播源保留条数")
+    parser.add_argument('--host_failure_limit', type=int, default=DEFAULT_HOST_FAILURE_LIMIT, help="同一主机连续连接失败多少次后熔断，0代表不熔断")
     parser.add_argument('--log_level', type=str, default=DEFAULT_LOG_LEVEL, help="日志等级 DEBUG/INFO/WARN/ERROR")
     return parser.parse_args()
 
@@ -289,7 +192,7 @@ def main():
 
     input_file = args.file
     output_file = args.output
-    max_workers = args.threads
+    concurrency = args.concurrency
     timeout = args.timeout
     max_retry = args.retry
     allowed_protocols = [p.strip() for p in args.protocol.split(',')] if args.protocol.strip() else []
@@ -299,7 +202,7 @@ def main():
     remote_urls = [u.strip() for u in args.urls.split(',')] if args.urls.strip() else []
 
     log("INFO", f"参数：输入文件={input_file}, 远程订阅={remote_urls}, 输出文件={output_file}", log_level)
-    log("INFO", f"线程数={max_workers}, 超时={timeout}s, 重试={max_retry}, 协议过滤={allowed_protocols if allowed_protocols else '全部'}, 保存失败源={save_failed}, 同名保留={keep_per_name}, 日志等级={log_level}", log_level)
+    log("INFO", f"并发数={concurrency}, 超时={timeout}s, 重试={max_retry}, 协议过滤={allowed_protocols if allowed_protocols else '全部'}, 保存失败源={save_failed}, 同名保留={keep_per_name}, 日志等级={log_level}", log_level)
 
     urls_all_lines = []
     url_statistics = []
@@ -338,8 +241,8 @@ def main():
     urls_all_lines = remove_duplicates(urls_all_lines)
     log("INFO", f"去重后的直播源数: {len(urls_all_lines)}", log_level)
 
-    results = process_urls_multithreaded(urls_all_lines, max_workers, timeout, allowed_protocols, log_level)
-    log("INFO", f"多线程检测完成，总共检测: {len(results)} 条", log_level)
+    results = process_urls(urls_all_lines, concurrency, timeout, allowed_protocols, log_level, args.host_failure_limit)
+    log("INFO", f"异步检测完成，总共检测: {len(results)} 条", log_level)
 
     if not save_failed:
         results = [r for r in results if r[2] is True]
@@ -358,14 +261,15 @@ def main():
         resolution = f"{w}x{h}" if w and h else "N/A"
         output_lines.append(f"{name},{url},{valid},{elapsed_str}ms,{resolution}")
 
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for line in output_lines:
-            f.write(line + '\n')
-    log("INFO", f"检测结果写入文件：{output_file}", log_level)
+    # 内容(除检测时间外)未变化时不重写
+    if write_lines_if_changed(output_file, output_lines, ignore=TIME_LINE_PATTERN):
+        log("INFO", f"检测结果写入文件：{output_file}", log_level)
+    else:
+        log("INFO", f"检测结果未变化，跳过写入：{output_file}", log_level)
 
     for stat in url_statistics:
         log("INFO", f"订阅URL统计：{stat}", log_level)
+    write_stats.report()
 
 
 if __name__ == "__main__":
@@ -2,8 +2,12 @@ import urllib.request
 from urllib.parse import urlparse
 import re
 import os
+import sys
 from datetime import datetime, timedelta, timezone
 
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.file_writer import write_lines_if_changed, write_stats, TIME_LINE_PATTERN #内容未变的文件不重写
+
 # 定义
 freetv_lines = []
 
@@ -119,9 +123,7 @@ output_lines =  ["更新时间,#genre#"] +[version] + ['\n'] +\
 # 将合并后的文本写入文件：全集
 output_file = "assets/freetv/freetv_output.txt"
 try:
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for line in output_lines:
-            f.write(line + '\n')
+    write_lines_if_changed(output_file, output_lines, ignore=TIME_LINE_PATTERN)
     print(f"已保存到文件: {output_file}")
 
 except Exception as e:
@@ -163,20 +165,16 @@ output_file_cctv = "assets/freetv/freetv_output_cctv.txt"
 output_file_ws = "assets/freetv/freetv_output_ws.txt"
 output_file_other = "assets/freetv/freetv_output_other.txt"
 try:
-    with open(output_file_cctv, 'w', encoding='utf-8') as f:
-        for line in output_lines_cctv:
-            f.write(line + '\n')
+    write_lines_if_changed(output_file_cctv, output_lines_cctv, ignore=TIME_LINE_PATTERN)
     print(f"已保存到文件: {output_file_cctv}")
 
-    with open(output_file_ws, 'w', encoding='utf-8') as f:
-        for line in output_lines_ws:
-            f.write(line + '\n')
+    write_lines_if_changed(output_file_ws, output_lines_ws, ignore=TIME_LINE_PATTERN)
     print(f"已保存到文件: {output_file_ws}")
     
-    with open(output_file_other, 'w', encoding='utf-8') as f:
-        for line in output_lines_other:
-            f.write(line + '\n')
+    write_lines_if_changed(output_file_other, output_lines_other, ignore=TIME_LINE_PATTERN)
     print(f"已保存到文件: {output_file_other}")
 
 except Exception as e:
-    print(f"保存文件时发生错误：{e}")
\ No newline at end of file
+    print(f"保存文件时发生错误：{e}")
+
+write_stats.report()
@@ -14,8 +14,12 @@
 """
 
 import os
+import sys
 import urllib.request
 
+sys.path.append(os.path.dirname(os.path.dirname(sys.path[0])))
+from utils.file_writer import write_if_changed, write_stats
+
 
 # 读取文本文件内容（自动过滤空行和注释行）
 def read_txt_to_array(file_path):
@@ -146,15 +150,15 @@ def main():
             processed_lines.append(line)  # 纯链接直接保留
     
     # 4. 去重并保存结果
-    unique_lines = list(set(processed_lines))  # 自动去重
+    unique_lines = list(dict.fromkeys(processed_lines))  # 去重并保持顺序，内容未变时输出也不变
     output_file = os.path.join(output_dir, "live_special.txt")
     
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(unique_lines))
+        write_if_changed(output_file, '\n'.join(unique_lines))  # 内容未变时不重写
         print(f"\n=== 处理完成 ===")
         print(f"有效直播源数量：{len(unique_lines)}")
         print(f"结果已保存到：{output_file}")
+        write_stats.report()
     except Exception as e:
         print(f"保存文件失败：{e}")
         exit(1)
@@ -0,0 +1,56 @@
+"""
+Benchmark of the keyword matcher against the substring loop it replaced
+
+Usage: python benchmarks/bench_matcher.py [keywords] [probes]
+"""
+import os
+import random
+import resource
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.matcher import KeywordMatcher
+
+
+def read_blacklist_urls() -> list[str]:
+    with open("assets/blacklist1/blacklist_auto.txt", "r", encoding="utf-8") as f:
+        return [line.strip().split(",", 1)[1] for line in f if "," in line and "://" in line]
+
+
+def get_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    urls = read_blacklist_urls()
+    keyword_count = int(sys.argv[1]) if len(sys.argv) > 1 else len(urls)
+    probe_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2500
+    keywords = urls[:keyword_count]
+    rng = random.Random(0)
+    probes = [f"{url}&t={i}" if i % 2 else f"http://example.com/{i}" for i, url in
+              enumerate(rng.choices(urls, k=probe_count))]
+
+    rss = get_rss_mb()
+    start = perf_counter()
+    matcher = KeywordMatcher(keywords)
+    build = perf_counter() - start
+    print(f"Keywords: {len(keywords)}, probes: {len(probes)}")
+    print(f"Build: {build:.2f} s, max RSS +{get_rss_mb() - rss:.0f} MB")
+
+    start = perf_counter()
+    expected = [any(keyword in text for keyword in keywords) for text in probes]
+    loop = (perf_counter() - start) / len(probes)
+    start = perf_counter()
+    result = [matcher.match(text) for text in probes]
+    automaton = (perf_counter() - start) / len(probes)
+
+    assert result == expected, "The matcher results differ from the substring loop"
+    print(f"any(): {loop * 1e6:.1f} us per text")
+    print(f"KeywordMatcher: {automaton * 1e6:.1f} us per text ({loop / automaton:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,10 @@ import opencc #简繁转换
 import socket
 import time
 
+from utils.matcher import KeywordMatcher #多关键字匹配(Aho-Corasick)
+from utils.url import canonicalize_url, strip_url_info #URL规范化，所有去重统一用规范化后的URL
+from utils.file_writer import write_if_changed, write_lines_if_changed, write_stats, TIME_LINE_PATTERN #内容未变的文件不重写
+
 #创建输出目录（如果不存在）
 os.makedirs('output', exist_ok=True)
 
@@ -49,7 +53,7 @@ def read_blacklist_from_txt(file_path):
 blacklist_auto=read_blacklist_from_txt('assets/blacklist1/blacklist_auto.txt') 
 blacklist_manual=read_blacklist_from_txt('assets/blacklist1/blacklist_manual.txt') 
 # combined_blacklist = list(set(blacklist_auto + blacklist_manual))
-combined_blacklist = set(blacklist_auto + blacklist_manual)  #list是个列表，set是个集合，据说检索速度集合要快很多。2025-07-08
+combined_blacklist = {canonicalize_url(url) for url in blacklist_auto + blacklist_manual}  #list是个列表，set是个集合，据说检索速度集合要快很多。2025-07-08
 
 # 定义多个对象用于存储不同内容的行文本
 ys_lines = [] #CCTV
@@ -112,7 +116,7 @@ Olympics_2024_Paris_lines = [] #Paris_2024_Olympics  Olympics_2024_Paris ADD 202
 # favorite_lines = []
 
 other_lines = []
-other_lines_url = [] # 为降低other文件大小，剔除重复url添加
+other_lines_url = set() # 为降低other文件大小，剔除重复url添加
 
 def process_name_string(input_str):
     parts = input_str.split(',')
@@ -203,16 +207,23 @@ def check_url_existence(data_list, url):
     :param url: The URL to check for existence
     :return: True if the URL exists in the list, otherwise False
     """
-    # Extract URLs from the data list
-    urls = [item.split(',')[1] for item in data_list]
-    return url not in urls #如果不存在则返回true，需要
+    # 每个list缓存一份规范化URL集合，list只追加，每次只补上新增的部分
+    seen, count = url_existence_cache.get(id(data_list), (set(), 0))
+    for item in data_list[count:]:
+        seen.add(canonicalize_url(item.split(',')[1]))
+    url_existence_cache[id(data_list)] = (seen, len(data_list))
+    url_dedup_stats["before"] += 1
+    if canonicalize_url(url) in seen:
+        return False
+    url_dedup_stats["after"] += 1
+    return True #如果不存在则返回true，需要
+
+url_existence_cache = {}
+url_dedup_stats = {"before": 0, "after": 0} #去重统计
 
 # 处理带$的URL，把$之后的内容都去掉（包括$也去掉） 【2024-08-08 22:29:11】
 def clean_url(url):
-    last_dollar_index = url.rfind('$')  # 安全起见找最后一个$处理
-    if last_dollar_index != -1:
-        return url[:last_dollar_index]
-    return url
+    return strip_url_info(url)
 
 # 添加channel_name前剔除部分特定字符
 removal_list = ["_电信", "电信", "高清", "频道", "（HD）", "-HD","英陆","_ITV","(北美)","(HK)","AKtv","「IPV4」","「IPV6」",
@@ -241,7 +252,7 @@ def process_channel_line(line):
         channel_address=clean_url(line.split(',')[1].strip())  #把URL中$之后的内容都去掉
         line=channel_name+","+channel_address #重新组织line
 
-        if channel_address not in combined_blacklist: # 判断当前源是否在blacklist中
+        if canonicalize_url(channel_address) not in combined_blacklist: # 判断当前源是否在blacklist中
             # 根据行内容判断存入哪个对象，开始分发
             if "CCTV" in channel_name and check_url_existence(ys_lines, channel_address) : #央视频道
                 ys_lines.append(process_name_string(line.strip()))
@@ -253,7 +264,7 @@ def process_channel_line(line):
                 ws_lines.append(process_name_string(line.strip()))
             elif channel_name in ty_dictionary and check_url_existence(ty_lines, channel_address):  #体育频道
                 ty_lines.append(process_name_string(line.strip()))
-            elif any(tyss_dictionary in channel_name for tyss_dictionary in tyss_dictionary) and check_url_existence(tyss_lines, channel_address):  #体育赛事（2025新增）
+            elif tyss_matcher.match(channel_name) and check_url_existence(tyss_lines, channel_address):  #体育赛事（2025新增）
                 tyss_lines.append(process_name_string(line.strip()))
             elif channel_name in dy_dictionary and check_url_existence(dy_lines, channel_address):  #电影频道
                 dy_lines.append(process_name_string(line.strip()))
@@ -350,8 +361,8 @@ def process_channel_line(line):
             elif channel_name in mtv_dictionary and check_url_existence(mtv_lines, channel_address):  #MTV
                 mtv_lines.append(process_name_string(line.strip()))
             else:
-                if channel_address not in other_lines_url:
-                    other_lines_url.append(channel_address)   #记录已加url
+                if canonicalize_url(channel_address) not in other_lines_url:
+                    other_lines_url.add(canonicalize_url(channel_address))   #记录已加url
                     other_lines.append(line.strip())
 
 
@@ -424,6 +435,7 @@ sh_dictionary=read_txt_to_array('主频道/shanghai.txt') #过滤+排序
 ws_dictionary=read_txt_to_array('主频道/卫视频道.txt') #过滤+排序
 ty_dictionary=read_txt_to_array('主频道/体育频道.txt') #过滤
 tyss_dictionary=read_txt_to_array('主频道/体育赛事.txt') #过滤
+tyss_matcher=KeywordMatcher(tyss_dictionary) #体育赛事关键字，只构建一次
 dy_dictionary=read_txt_to_array('主频道/电影.txt') #过滤
 dsj_dictionary=read_txt_to_array('主频道/电视剧.txt') #过滤
 gat_dictionary=read_txt_to_array('主频道/港澳台.txt') #过滤
@@ -743,8 +755,7 @@ def generate_playlist_html(data_list, output_file='playlist.html'):
     </html>
     '''
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_head + html_body + html_tail)
+    write_if_changed(output_file, html_head + html_body + html_tail)
     print(f"✅ 网页已生成：{output_file}")
 
 
@@ -758,8 +769,8 @@ def get_random_url(file_path):
             # 查找逗号后面的部分，即URL
             url = line.strip().split(',')[-1]
             urls.append(url)    
-    # 随机返回一个URL
-    return random.choice(urls) if urls else None
+    # 随机返回一个URL，同一天内固定，避免仅因随机结果不同而重写输出文件
+    return random.Random(datetime.now().strftime("%Y%m%d")).choice(urls) if urls else None
 
 daily_mtv="每日一首,"+get_random_url('assets/今日推荐.txt')
 
@@ -929,9 +940,7 @@ try:
     #         f.write(line + '\n')
     # print(f"合并后的文本已保存到文件: {output_file_simple}")
 
-    with open(new_output_file_simple, 'w', encoding='utf-8') as f:
-        for line in all_lines_simple:
-            f.write(line + '\n')
+    write_lines_if_changed(new_output_file_simple, all_lines_simple, ignore=TIME_LINE_PATTERN)
     print(f"合并后的文本已保存到文件: {new_output_file_simple}")
 
     # 全集版
@@ -940,9 +949,7 @@ try:
     #         f.write(line + '\n')
     # print(f"合并后的文本已保存到文件: {output_file}")
 
-    with open(new_output_file, 'w', encoding='utf-8') as f:
-        for line in all_lines:
-            f.write(line + '\n')
+    write_lines_if_changed(new_output_file, all_lines, ignore=TIME_LINE_PATTERN)
     print(f"合并后的文本已保存到文件: {new_output_file}")
 
 #    # 其他
@@ -952,9 +959,7 @@ try:
 #    print(f"Others已保存到文件: {others_file}")
 
     # 其他
-    with open(others_file, 'w', encoding='utf-8') as f:
-        for line in other_lines:
-            f.write(line + '\n')
+    write_lines_if_changed(others_file, other_lines, ignore=TIME_LINE_PATTERN)
     print(f"Others已保存到文件: {others_file}")
 
 #    # 定制
@@ -965,9 +970,7 @@ try:
 
 
     # 定制
-    with open(new_output_file_custom, 'w', encoding='utf-8') as f:
-        for line in all_lines_custom:
-            f.write(line + '\n')
+    write_lines_if_changed(new_output_file_custom, all_lines_custom, ignore=TIME_LINE_PATTERN)
     print(f"合并后的文本已保存到文件: {new_output_file_custom}")
 
 except Exception as e:
@@ -1058,8 +1061,7 @@ def make_m3u(txt_file, m3u_file):
                     output_text += f"#EXTINF:-1  tvg-name=\"{channel_name}\" tvg-logo=\"{logo_url}\"  group-title=\"{group_name}\",{channel_name}\n"
                     output_text += f"{channel_url}\n"
 
-        with open(f"{m3u_file}", "w", encoding='utf-8') as file:
-            file.write(output_text)
+        write_if_changed(m3u_file, output_text, ignore=TIME_LINE_PATTERN)
         # with open(f"{m3u_file_copy}", "w", encoding='utf-8') as file:
         #     file.write(output_text)
 
@@ -1095,9 +1097,11 @@ all_lines_hj = len(all_lines)
 other_lines_hj = len(other_lines)
 all_lines_custom_hj = len(all_lines_custom)  
 print(f"黑名单行数: {combined_blacklist_hj} ")
+print(f"分类去重前: {url_dedup_stats['before']} 去重后: {url_dedup_stats['after']} ")
 print(f"txt行数: {all_lines_hj} ")
 print(f"other行数: {other_lines_hj} ")
 print(f"all_lines_custom行数: {all_lines_custom_hj} ")
+write_stats.report()
 
 #备用1：http://tonkiang.us
 #备用2：https://www.zoomeye.hk,https://www.shodan.io,https://tv.cctv.com/live/
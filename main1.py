@@ -4,6 +4,7 @@ import datetime
 import gzip
 import os
 import pickle
+import threading
 from time import time
 
 import pytz
@@ -16,13 +17,16 @@ from updates.hotel import get_channels_by_hotel
 from updates.multicast import get_channels_by_multicast
 from updates.online_search import get_channels_by_online_search
 from updates.subscribe import get_channels_by_subscribe_urls
+from updates.subscribe.score import SubscribeScore
 from utils.channel import (
     get_channel_items,
     append_total_data,
-    test_speed,
+    SpeedTester,
     write_channel_to_file, sort_channel_result,
 )
 from utils.config import config
+from utils.file_writer import write_if_changed, write_stats
+from utils.metrics import registry, update_stage_seconds, update_urls, update_timestamp, count_urls
 from utils.tools import (
     get_pbar_remaining,
     get_ip_address,
@@ -49,9 +53,11 @@ class UpdateSource:
         self.hotel_foodie_result = {}
         self.multicast_result = {}
         self.subscribe_result = {}
+        self.subscribe_score = None
         self.online_search_result = {}
         self.epg_result = {}
         self.channel_data: CategoryChannelData = {}
+        self.speed_tester = None
         self.pbar = None
         self.total = 0
         self.start_time = None
@@ -85,21 +91,46 @@ class UpdateSource:
                     if not os.getenv("GITHUB_ACTIONS") and config.cdn_url:
                         subscribe_urls = [join_url(config.cdn_url, url) if "raw.githubusercontent.com" in url else url
                                           for url in subscribe_urls]
-                    task = asyncio.create_task(
-                        task_func(subscribe_urls,
-                                  names=channel_names,
-                                  whitelist=whitelist_urls,
-                                  callback=self.update_progress
-                                  )
+                    self.subscribe_score = SubscribeScore(
+                        skip_runs=config.subscribe_skip_runs,
+                        low_yield_limit=config.subscribe_low_yield_limit,
+                        whitelist=whitelist_urls
                     )
+                    coro = task_func(subscribe_urls,
+                                     names=channel_names,
+                                     whitelist=whitelist_urls,
+                                     callback=self.update_progress,
+                                     score=self.subscribe_score
+                                     )
                 elif setting == "hotel_foodie" or setting == "hotel_fofa":
-                    task = asyncio.create_task(task_func(callback=self.update_progress))
+                    coro = task_func(callback=self.update_progress)
                 else:
-                    task = asyncio.create_task(
-                        task_func(channel_names, callback=self.update_progress)
-                    )
-                self.tasks.append(task)
-                setattr(self, result_attr, await task)
+                    coro = task_func(channel_names, callback=self.update_progress)
+                self.tasks.append(asyncio.create_task(self.run_task(setting, result_attr, coro)))
+        if self.speed_tester and (config.open_history or config.open_local or config.open_rtmp):
+            self.tasks.append(asyncio.create_task(self.speed_tester.add_source(self.channel_items.items())))
+        await asyncio.gather(*self.tasks)
+
+    async def run_task(self, setting, result_attr, coro):
+        """
+        Run the fetcher, the candidates of its result go to the speed test as soon as it is done
+        """
+        result = await coro
+        setattr(self, result_attr, result)
+        if self.speed_tester and setting != "epg":
+            await self.speed_tester.add_source(self.channel_items.items(), setting, result)
+
+    def update_subscribe_score(self, test_result):
+        score = self.subscribe_score
+        score.record_passed(test_result)
+        score.record_final(self.channel_data, urls_limit=config.urls_limit)
+        score.update()
+        try:
+            score.save()
+        except Exception as e:
+            print(f"Error on saving subscribe score: {e}")
+        score.write_log()
+        self.subscribe_score = None
 
     def pbar_update(self, name: str = "", item_name: str = ""):
         if self.pbar.n < self.total:
@@ -112,7 +143,10 @@ class UpdateSource:
     async def main(self):
         try:
             main_start_time = time()
+            write_stats.reset()
             if config.open_update:
+                update_stage_seconds.clear()
+                update_urls.clear()
                 self.channel_items = get_channel_items()
                 channel_names = [
                     name
@@ -122,6 +156,13 @@ class UpdateSource:
                 if not channel_names:
                     print(f"❌ No channel names found! Please check the {config.source_file}!")
                     return
+                if config.open_speed_test:
+                    self.speed_tester = SpeedTester(
+                        ipv6=self.ipv6_support,
+                        filter_host=config.speed_test_filter_host,
+                        ipv6_support=self.ipv6_support
+                    )
+                stage_start = time()
                 await self.visit_page(channel_names)
                 self.tasks = []
                 append_total_data(
@@ -133,6 +174,8 @@ class UpdateSource:
                     self.subscribe_result,
                     self.online_search_result,
                 )
+                update_stage_seconds.set(time() - stage_start, stage="fetch")
+                count_urls(self.channel_data, "fetched")
                 cache_result = self.channel_data
                 test_result = {}
                 if config.open_speed_test:
@@ -145,33 +188,43 @@ class UpdateSource:
                         ipv6_support=self.ipv6_support
                     )
                     self.total = get_urls_len(test_data)
-                    print(f"Total urls: {urls_total}, need to test speed: {self.total}")
+                    print(
+                        f"Total urls: {urls_total}, need to test speed: {self.total}, started while fetching: {self.speed_tester.started}")
                     self.update_progress(
                         f"正在进行测速, 共{urls_total}个接口, {self.total}个接口需要进行测速",
                         0,
                     )
+                    count_urls(test_data, "tested")
                     self.start_time = time()
                     self.pbar = tqdm(total=self.total, desc="Speed test")
-                    test_result = await test_speed(
+                    test_result = await self.speed_tester.test(
                         test_data,
-                        ipv6=self.ipv6_support,
                         callback=lambda: self.pbar_update(name="测速", item_name="接口"),
                     )
+                    self.speed_tester = None
                     cache_result = merge_objects(cache_result, test_result, match_key="url")
                     self.pbar.close()
+                    update_stage_seconds.set(time() - self.start_time, stage="speed_test")
+                stage_start = time()
                 self.channel_data = sort_channel_result(
                     self.channel_data,
                     result=test_result,
                     filter_host=config.speed_test_filter_host,
                     ipv6_support=self.ipv6_support
                 )
+                update_stage_seconds.set(time() - stage_start, stage="sort")
+                count_urls(self.channel_data, "kept")
+                if self.subscribe_score:
+                    self.update_subscribe_score(test_result)
                 self.update_progress(f"正在生成结果文件", 0)
+                stage_start = time()
                 write_channel_to_file(
                     self.channel_data,
                     epg=self.epg_result,
                     ipv6=self.ipv6_support,
                     first_channel_name=channel_names[0],
                 )
+                update_stage_seconds.set(time() - stage_start, stage="write")
                 if config.open_history:
                     if os.path.exists(constants.cache_path):
                         with gzip.open(constants.cache_path, "rb") as file:
@@ -180,8 +233,12 @@ class UpdateSource:
                             except EOFError:
                                 cache = {}
                             cache_result = merge_objects(cache, cache_result, match_key="url")
-                    with gzip.open(constants.cache_path, "wb") as file:
-                        pickle.dump(cache_result, file)
+                    write_if_changed(constants.cache_path, gzip.compress(pickle.dumps(cache_result), mtime=0))
+                write_stats.report()
+                update_stage_seconds.set(time() - main_start_time, stage="total")
+                update_timestamp.set(time())
+                registry.dump("update")
+                write_if_changed(constants.update_done_path, str(time()))
                 print(
                     f"🥳 Update completed! Total time spent: {format_interval(time() - main_start_time)}."
                 )
@@ -208,6 +265,7 @@ class UpdateSource:
             pass
 
         self.update_progress = callback or default_callback
+        threading.Thread(target=registry.run_dump, args=("update",), daemon=True).start()
         self.run_ui = True if callback else False
         if self.run_ui:
             self.update_progress(f"正在检查网络是否支持IPv6", 0)
@@ -221,6 +279,8 @@ class UpdateSource:
         for task in self.tasks:
             task.cancel()
         self.tasks = []
+        if self.speed_tester:
+            self.speed_tester.cancel()
         if self.pbar:
             self.pbar.close()
         if self.stop_event:
@@ -2,16 +2,30 @@ import os
 import sys
 
 sys.path.append(os.path.dirname(sys.path[0]))
-from flask import Flask, send_from_directory, make_response, jsonify, redirect
-from utils.tools import get_result_file_content, get_ip_address, resource_path
+from flask import Flask, send_from_directory, make_response, jsonify, redirect, request, Response, g
+from utils.tools import get_result_file_content, get_ip_address, resource_path, get_resolution_value, \
+    preload_result_files, get_secret_key
 from utils.config import config
 import utils.constants as constants
-from utils.db import get_db_connection, return_db_connection
+from utils.channel_lookup import ChannelLookup
+from utils.epg_index import EpgIndex, parse_query_time
+from utils.file_cache import make_file_response
+from utils.log_stream import make_log_response
+from utils.metrics import registry as metrics_registry, stream_relays, stream_viewers, http_requests, \
+    http_request_seconds
+from utils.result_index import ResultIndex
+from utils.stream_manager import StreamManager, StreamLimitError
+from utils.hls_proxy import HlsProxy, is_hls_url
+from utils.play_health import PlayHealth
+from utils.revalidate import Revalidator
 import subprocess
 import atexit
-from collections import OrderedDict
+import hashlib
+import hmac
 import threading
-import json
+import signal
+from time import time, sleep
+import requests
 
 app = Flask(__name__)
 nginx_dir = resource_path(os.path.join('utils', 'nginx-rtmp-win32'))
@@ -19,9 +33,47 @@ nginx_path = resource_path(os.path.join(nginx_dir, 'nginx.exe'))
 stop_path = resource_path(os.path.join(nginx_dir, 'stop.bat'))
 hls_temp_path = resource_path(os.path.join(nginx_dir, 'temp/hls')) if sys.platform == "win32" else '/tmp/hls'
 
-live_running_streams = OrderedDict()
-hls_running_streams = OrderedDict()
-MAX_STREAMS = 10
+stream_manager = StreamManager(constants.streams_path)
+secret_key = get_secret_key(constants.secret_key_path)
+
+epg_index = EpgIndex(constants.epg_result_path)
+result_index = ResultIndex(constants.result_data_path)
+channel_lookup = ChannelLookup(constants.rtmp_data_path)
+play_health = PlayHealth(result_index, constants.play_reports_path)
+
+
+def collect_streams():
+    for kind, registry in stream_manager.registries.items():
+        rows = registry.rows()
+        stream_relays.set(len(rows), kind=kind)
+        stream_viewers.set(sum(row["viewers"] or 0 for row in rows), kind=kind)
+
+
+metrics_registry.add_collector(collect_streams)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "other"
+    http_requests.inc(route=route, method=request.method, status=response.status_code)
+    if "request_start" in g:
+        http_request_seconds.observe(time() - g.request_start, route=route)
+    return response
+
+
+@app.route("/metrics")
+def show_metrics():
+    """
+    Metrics of the update and the service in the Prometheus text format
+    """
+    response = make_response(metrics_registry.render())
+    response.mimetype = "text/plain; version=0.0.4"
+    return response
 
 
 @app.route("/")
@@ -165,6 +217,145 @@ def show_content():
     )
 
 
+@app.route("/playlist")
+def show_playlist():
+    """
+    Render the result filtered by the query: ipv_type, category, origin, limit, min_resolution, format and rtmp
+    """
+    ipv_type = [item.lower() for item in get_query_list("ipv_type")] or None
+    if ipv_type and any(item not in ["ipv4", "ipv6", "all", "auto"] for item in ipv_type):
+        return jsonify({'Error': 'Invalid ipv_type'}), 400
+    origins = [item.lower() for item in get_query_list("origin")] or None
+    if origins and any(item not in constants.origin_map for item in origins):
+        return jsonify({'Error': 'Invalid origin'}), 400
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'Error': 'Invalid limit'}), 400
+    min_resolution = None
+    if request.args.get("min_resolution"):
+        min_resolution = get_resolution_value(request.args["min_resolution"])
+        if not min_resolution:
+            return jsonify({'Error': 'Invalid min_resolution'}), 400
+    file_type = request.args.get("format", "m3u" if config.open_m3u_result else "txt").lower()
+    if file_type not in ["txt", "m3u"]:
+        return jsonify({'Error': 'Invalid format'}), 400
+    rtmp = request.args.get("rtmp", "").lower() or None
+    if rtmp and (rtmp not in ["live", "hls"] or not config.open_rtmp):
+        return jsonify({'Error': 'Invalid rtmp'}), 400
+    entry = result_index.render(
+        ipv_type=ipv_type,
+        categories=get_query_list("category"),
+        origins=origins,
+        limit=limit,
+        min_resolution=min_resolution,
+        file_type=file_type,
+        rtmp=rtmp
+    )
+    if not entry:
+        response = make_response(constants.waiting_tip)
+        response.mimetype = "text/plain"
+        return response
+    return make_file_response(entry, as_attachment=config.open_m3u_result and file_type == "m3u")
+
+
+def get_play_url(item):
+    """
+    Get the url to redirect the player to, through the hls proxy if enabled
+    """
+    if config.open_hls_proxy and is_hls_url(item["url"]):
+        return f"/proxy/{item['id']}/index.m3u8"
+    return item["url"].partition("$")[0]
+
+
+def get_play_channel(channel):
+    """
+    Get the channel name in the health table, loaded in the background once the first request came
+    """
+    if play_health.key is None:
+        play_health.refresh()
+    return play_health.get_name(channel)
+
+
+# Seconds a report token stays valid after the redirect it came with
+REPORT_TOKEN_TTL = 3600
+
+
+def get_report_token(name, url, expires=None):
+    """
+    Get the token allowing to report the url of the channel until it expires, handed out with the redirect
+    to that url only, signed with the secret key of the service
+    """
+    expires = int(expires if expires is not None else time() + REPORT_TOKEN_TTL)
+    digest = hmac.new(secret_key, f"report:{name}:{url}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{expires}.{digest[:16]}"
+
+
+def verify_report_token(name, url, token):
+    """
+    Check the token was handed out for the url of the channel and has not expired
+    """
+    expires, _, _ = token.partition(".")
+    if not expires.isdigit() or int(expires) < time():
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), get_report_token(name, url, expires).encode("utf-8"))
+
+
+@app.route("/play/<channel>")
+def run_play(channel):
+    """
+    Redirect to the healthiest url of the channel, with the token to report that url
+    """
+    name = get_play_channel(channel)
+    item = play_health.get_best(name) if name else None
+    if not item:
+        return jsonify({'Error': 'Channel not found'}), 404
+    response = redirect(get_play_url(item), 302)
+    response.headers["X-Report-Token"] = get_report_token(name, item["url"])
+    return response
+
+
+@app.route("/play/<channel>/report", methods=["POST"])
+def report_play(channel):
+    """
+    Report the url of the channel bad, the one the token was handed out for, return the next url with its token
+    """
+    name = get_play_channel(channel)
+    if not name:
+        return jsonify({'Error': 'Channel not found'}), 404
+    token = request.values.get("token") or request.headers.get("X-Report-Token", "")
+    url = request.values.get("url")
+    candidates = [
+        info for info in play_health.channels[name]
+        if not url or url in (info["url"], info["url"].partition("$")[0], get_play_url(info))
+    ]
+    item = next((info for info in candidates if verify_report_token(name, info["url"], token)), None)
+    if not item:
+        return jsonify({'Error': 'Invalid token'}), 403
+    play_health.report(item["url"])
+    best = play_health.get_best(name)
+    response = jsonify({'reported': get_play_url(item), 'next': get_play_url(best)})
+    response.headers["X-Report-Token"] = get_report_token(name, best["url"])
+    return response
+
+
+@app.route("/play/<channel>/status")
+def show_play_status(channel):
+    name = get_play_channel(channel)
+    if not name:
+        return jsonify({'Error': 'Channel not found'}), 404
+    now = time()
+    result = []
+    for info in play_health.get_candidates(name):
+        health = play_health.get_health(info["url"])
+        result.append({
+            'url': get_play_url(info),
+            'score': round(health['score'], 3),
+            'bad': health['bad_until'] > now,
+            'checked_at': health['checked_at'],
+        })
+    return jsonify(result)
+
+
 @app.route("/epg/epg.xml")
 def show_epg():
     return get_result_file_content(path=constants.epg_result_path, show_content=False)
@@ -175,153 +366,181 @@ def show_epg_gz():
     return get_result_file_content(path=constants.epg_gz_result_path, show_content=False)
 
 
+def get_query_list(key):
+    """
+    Get the values of the query: ?key=A&key=B or ?key=A,B
+    """
+    return [item.strip() for value in request.args.getlist(key) for item in value.split(",") if item.strip()]
+
+
+def get_query_channels():
+    """
+    Get the channel names of the query, all channels if empty
+    """
+    return get_query_list("channel") or list(epg_index.channels)
+
+
+def get_query_time(key, default):
+    """
+    Get the time of the query as a timestamp, the time without offset is in the configured time zone
+    """
+    value = request.args.get(key, "").strip()
+    if not value:
+        return default
+    return parse_query_time(value, config.time_zone)
+
+
+@app.route("/epg/now")
+def show_epg_now():
+    try:
+        at = get_query_time("time", time())
+    except ValueError:
+        return jsonify({'Error': 'Invalid time'}), 400
+    epg_index.refresh()
+    return jsonify(epg_index.now_next(get_query_channels(), at))
+
+
+@app.route("/epg/programmes")
+def show_epg_programmes():
+    try:
+        start = get_query_time("start", time())
+        end = get_query_time("end", start + 86400)
+    except ValueError:
+        return jsonify({'Error': 'Invalid time'}), 400
+    epg_index.refresh()
+    return jsonify(epg_index.between(get_query_channels(), start, end))
+
+
 @app.route("/log")
 def show_log():
-    if os.path.exists(constants.result_log_path):
-        with open(constants.result_log_path, "r", encoding="utf-8") as file:
-            content = file.read()
-    else:
-        content = constants.waiting_tip
-    response = make_response(content)
-    response.mimetype = "text/plain"
-    return response
+    """
+    Stream the speed test log, the last lines with tail, a part of it with the Range header
+    """
+    tail = request.args.get("tail", type=int)
+    if "tail" in request.args and (tail is None or tail < 0):
+        return jsonify({'Error': 'Invalid tail'}), 400
+    return make_log_response(constants.result_log_path, tail)
 
 
 def get_channel_data(channel_id):
-    conn = get_db_connection(constants.rtmp_data_path)
-    channel_data = {}
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT url, headers FROM result_data WHERE id=?", (channel_id,))
-        data = cursor.fetchone()
-        if data:
-            channel_data = {
-                'url': data[0],
-                'headers': json.loads(data[1]) if data[1] else None
-            }
-    except Exception as e:
-        print(f"❌ Error retrieving channel data: {e}")
-    finally:
-        return_db_connection(constants.rtmp_data_path, conn)
-    return channel_data
+    return channel_lookup.get(channel_id)
 
 
-def monitor_stream_process(streams, process, channel_id):
-    process.wait()
-    if channel_id in streams:
-        del streams[channel_id]
+hls_proxy = HlsProxy(get_channel_data, config.hls_proxy_cache_size * 1024 * 1024, key=secret_key)
 
 
-def cleanup_streams(streams):
-    to_delete = []
-    for channel_id, process in streams.items():
-        if process.poll() is not None:
-            to_delete.append(channel_id)
-    for channel_id in to_delete:
-        del streams[channel_id]
-    while len(streams) > MAX_STREAMS:
-        streams.popitem(last=False)
+@app.route('/proxy/<channel_id>/<file_name>', methods=['GET'])
+def run_hls_proxy(channel_id, file_name):
+    """
+    Relay the hls playlist and segments of the channel through the proxy cache
+    """
+    if not config.open_hls_proxy:
+        return jsonify({'Error': 'HLS proxy is disabled'}), 404
+    token, ext = os.path.splitext(file_name)
+    try:
+        if ext == ".m3u8":
+            content = hls_proxy.get_playlist(channel_id, None if token == "index" else token)
+            if content is None:
+                return jsonify({'Error': 'Url not found'}), 404
+            response = Response(content, mimetype="application/vnd.apple.mpegurl")
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        segment = hls_proxy.get_segment(channel_id, token)
+    except requests.RequestException as e:
+        return jsonify({'Error': str(e)}), 502
+    if segment is None:
+        return jsonify({'Error': 'Url not found'}), 404
+    response = Response(segment[0], mimetype=segment[1])
+    response.headers["Cache-Control"] = "max-age=60"
+    return response
 
 
-@app.route('/live/<channel_id>', methods=['GET'])
-def run_live(channel_id):
-    if not channel_id:
-        return jsonify({'Error': 'Channel ID is required'}), 400
+def start_stream(kind, channel_id):
+    """
+    Start the relay of the channel unless it is running, return whether it was started and the error response
+    """
     data = get_channel_data(channel_id)
     url = data.get("url", "")
     if not url:
-        return jsonify({'Error': 'Url not found'}), 400
-    headers = data.get("headers", None)
-    if channel_id in live_running_streams:
-        process = live_running_streams[channel_id]
-        if process.poll() is None:
-            return redirect(f'rtmp://localhost:1935/live/{channel_id}')
-        else:
-            del live_running_streams[channel_id]
-    cleanup_streams(live_running_streams)
-    cmd = [
-        'ffmpeg',
-        '-loglevel', 'error',
-        '-re',
-        '-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) if headers else '',
-        '-i', url.partition('$')[0],
-        '-c:v', 'copy',
-        '-c:a', 'copy',
-        '-f', 'flv',
-        '-flvflags', 'no_duration_filesize',
-        f'rtmp://localhost:1935/live/{channel_id}'
-    ]
+        return False, (jsonify({'Error': 'Url not found'}), 400)
+    stream_manager[kind].record_request(channel_id)
     try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE
-        )
-        threading.Thread(
-            target=monitor_stream_process,
-            args=(live_running_streams, process, channel_id),
-            daemon=True
-        ).start()
-        live_running_streams[channel_id] = process
-        return redirect(f'rtmp://localhost:1935/live/{channel_id}')
+        started = stream_manager.start(kind, channel_id, url, data.get("headers", None))
+    except StreamLimitError as e:
+        return False, (jsonify({'Error': str(e)}), 503)
     except Exception as e:
-        return jsonify({'Error': str(e)}), 500
+        return False, (jsonify({'Error': str(e)}), 500)
+    if not started:
+        stream_manager.touch(kind, channel_id, interval=0)
+    return started, None
+
+
+@app.route('/live/<channel_id>', methods=['GET'])
+def run_live(channel_id):
+    if not channel_id:
+        return jsonify({'Error': 'Channel ID is required'}), 400
+    _, error = start_stream("live", channel_id)
+    if error:
+        return error
+    return redirect(f'rtmp://localhost:1935/live/{channel_id}')
 
 
 @app.route('/hls/<channel_id>', methods=['GET'])
 def run_hls(channel_id):
     if not channel_id:
         return jsonify({'Error': 'Channel ID is required'}), 400
-    data = get_channel_data(channel_id)
-    url = data.get("url", "")
-    if not url:
-        return jsonify({'Error': 'Url not found'}), 400
-    headers = data.get("headers", None)
-    channel_file = f'{channel_id}.m3u8'
-    m3u8_path = os.path.join(hls_temp_path, channel_file)
-    if channel_id in hls_running_streams:
-        process = hls_running_streams[channel_id]
-        if process.poll() is None:
-            if os.path.exists(m3u8_path):
-                return redirect(f'http://localhost:8080/hls/{channel_file}')
-            else:
-                return jsonify({'status': 'pending', 'message': 'Stream is starting'}), 202
-        else:
-            del hls_running_streams[channel_id]
-    cleanup_streams(hls_running_streams)
-    cmd = [
-        'ffmpeg',
-        '-loglevel', 'error',
-        '-re',
-        '-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) if headers else '',
-        '-stream_loop', '-1',
-        '-i', url.partition('$')[0],
-        '-c:v', 'copy',
-        '-c:a', 'copy',
-        '-f', 'flv',
-        '-flvflags', 'no_duration_filesize',
-        f'rtmp://localhost:1935/hls/{channel_id}'
-    ]
-    try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE
-        )
-        threading.Thread(
-            target=monitor_stream_process,
-            args=(hls_running_streams, process, channel_id),
-            daemon=True
-        ).start()
-        hls_running_streams[channel_id] = process
+    started, error = start_stream("hls", channel_id)
+    if error:
+        return error
+    if started:
         return jsonify({
             'status': 'starting',
             'message': 'Stream is being prepared'
         }), 202
-    except Exception as e:
-        return jsonify({'Error': str(e)}), 500
+    channel_file = f'{channel_id}.m3u8'
+    if os.path.exists(os.path.join(hls_temp_path, channel_file)):
+        return redirect(f'/hls/{channel_id}/{channel_file}')
+    return jsonify({'status': 'pending', 'message': 'Stream is starting'}), 202
+
+
+@app.route('/hls/<channel_id>/<path:file_name>', methods=['GET'])
+def show_hls_file(channel_id, file_name):
+    """
+    Serve the hls playlist and segments of the relay, the playlist requests keep the relay alive
+    """
+    if file_name.endswith(".m3u8"):
+        if channel_id not in stream_manager["hls"]:
+            return jsonify({'Error': 'Stream not running'}), 404
+        stream_manager.touch("hls", channel_id)
+        return send_from_directory(hls_temp_path, file_name, mimetype="application/vnd.apple.mpegurl", max_age=0)
+    return send_from_directory(hls_temp_path, file_name)
+
+
+@app.route('/stream/on_play', methods=['GET', 'POST'])
+def on_stream_play():
+    """
+    nginx-rtmp on_play hook: a viewer joins the stream
+    """
+    kind, channel_id = request.values.get("app", "live"), request.values.get("name", "")
+    if kind in ("live", "hls") and channel_id:
+        stream_manager[kind].add_viewer(channel_id, 1)
+    return "", 200
+
+
+@app.route('/stream/on_play_done', methods=['GET', 'POST'])
+def on_stream_play_done():
+    """
+    nginx-rtmp on_play_done hook: a viewer leaves the stream
+    """
+    kind, channel_id = request.values.get("app", "live"), request.values.get("name", "")
+    if kind in ("live", "hls") and channel_id:
+        stream_manager[kind].add_viewer(channel_id, -1)
+    return "", 200
+
+
+@app.route('/streams', methods=['GET'])
+def show_streams():
+    return jsonify(stream_manager.get_streams())
 
 
 def stop_rtmp_service():
@@ -333,9 +552,119 @@ def stop_rtmp_service():
             print(f"❌ Rtmp service stop failed: {e}")
 
 
+def watch_update(interval=10):
+    """
+    Reload the gunicorn workers gracefully once an update has completed, the republishes of the revalidator
+    between the updates are picked up by the caches of the workers without a reload
+    """
+    def get_mtime():
+        try:
+            return os.path.getmtime(constants.update_done_path)
+        except OSError:
+            return None
+
+    last_mtime = get_mtime()
+    while True:
+        sleep(interval)
+        mtime = get_mtime()
+        if mtime != last_mtime:
+            last_mtime = mtime
+            print("🔄 Update completed, reloading the service workers")
+            os.kill(os.getpid(), signal.SIGHUP)
+
+
+def run_stream_manager():
+    if config.open_rtmp:
+        threading.Thread(target=stream_manager.run, args=(get_channel_data,), daemon=True).start()
+
+
+def run_revalidator():
+    if config.open_revalidate:
+        threading.Thread(target=Revalidator(constants.result_data_path).run, daemon=True).start()
+
+
+def run_singleton_tasks():
+    """
+    Run the stream manager and the revalidator in the one worker holding the service lock,
+    another worker takes them over once it exits
+    """
+    import fcntl
+
+    with open(constants.service_lock_path, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        run_stream_manager()
+        run_revalidator()
+        # The lock is released with the worker process
+        threading.Event().wait()
+
+
+def when_ready(server):
+    threading.Thread(target=watch_update, daemon=True).start()
+
+
+def post_worker_init(worker):
+    threading.Thread(target=preload_result_files, daemon=True).start()
+    if config.open_epg:
+        threading.Thread(target=epg_index.refresh, daemon=True).start()
+    threading.Thread(target=play_health.run, daemon=True).start()
+    threading.Thread(target=channel_lookup.refresh, daemon=True).start()
+    threading.Thread(target=metrics_registry.run_dump, args=(f"worker-{worker.pid}",), daemon=True).start()
+    threading.Thread(target=run_singleton_tasks, daemon=True).start()
+
+
+def worker_exit(server, worker):
+    metrics_registry.remove_dump(f"worker-{worker.pid}")
+
+
+def run_production_service():
+    """
+    Run the service with gunicorn worker processes
+    """
+    from gunicorn.app.base import BaseApplication
+
+    options = {
+        "bind": f"0.0.0.0:{config.app_port}",
+        "workers": config.app_workers,
+        "worker_class": "gthread",
+        "threads": 4,
+        "keepalive": config.app_keepalive,
+        "timeout": 1000,
+        "graceful_timeout": 30,
+        "when_ready": when_ready,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+    }
+
+    class ServiceApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    ServiceApplication().run()
+
+
+def can_run_production_service():
+    """
+    Gunicorn needs a POSIX system and the main thread for its signals, the GUI runs the service in a thread
+    """
+    if sys.platform == "win32" or config.app_workers <= 0 or threading.current_thread() is not threading.main_thread():
+        return False
+    try:
+        import gunicorn
+        return True
+    except ImportError:
+        return False
+
+
 def run_service():
     try:
         if not os.getenv("GITHUB_ACTIONS"):
+            if config.open_rtmp:
+                # The pids of the previous run are not ours anymore once they exited and got reused
+                stream_manager.clear()
             if config.open_rtmp and sys.platform == "win32":
                 original_dir = os.getcwd()
                 try:
@@ -352,8 +681,21 @@ def run_service():
                 print(f"🚀 HLS api: {ip_address}/hls")
             print(f"🚀 IPv4 api: {ip_address}/ipv4")
             print(f"🚀 IPv6 api: {ip_address}/ipv6")
+            print(f"🚀 Playlist api: {ip_address}/playlist?ipv_type=ipv4&format=m3u")
+            print(f"🚀 Play api: {ip_address}/play/CCTV-1")
+            if config.open_epg:
+                print(f"📅 EPG now/next api: {ip_address}/epg/now?channel=CCTV-1")
             print(f"✅ You can use this url to watch IPTV 📺: {ip_address}")
-            app.run(host="0.0.0.0", port=config.app_port)
+            if can_run_production_service():
+                run_production_service()
+            else:
+                threading.Thread(target=preload_result_files, daemon=True).start()
+                if config.open_epg:
+                    threading.Thread(target=epg_index.refresh, daemon=True).start()
+                run_stream_manager()
+                run_revalidator()
+                threading.Thread(target=play_health.run, daemon=True).start()
+                app.run(host="0.0.0.0", port=config.app_port)
     except Exception as e:
         print(f"❌ Service start failed: {e}")
 
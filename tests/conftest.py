@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules read the config and the assets relative to the working directory
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
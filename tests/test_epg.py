@@ -0,0 +1,118 @@
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+if not os.path.exists("utils/ip_checker/data/qqwry.ipdb"):
+    # utils.channel opens the IP database on import
+    pytest.skip("The IP database utils/ip_checker/data/qqwry.ipdb is not installed", allow_module_level=True)
+
+from updates.epg.request import (
+    get_epg_window,
+    in_epg_window,
+    is_epg_cache_valid,
+    merge_epg,
+    parse_epg,
+    parse_epg_time,
+)
+
+TZ = timezone(timedelta(hours=8))
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<tv>
+  <programme channel="a" start="20261019080000 +0800" stop="20261019090000 +0800"><title>早間節目</title></programme>
+  <channel id="a"><display-name>测试频道甲</display-name></channel>
+  <channel id="b"><display-name>测试频道乙</display-name></channel>
+  <channel id="1"><display-name>测试频道丙</display-name></channel>
+  <programme channel="a" start="20261019090000 +0800" stop="20261019100000 +0800"><title>午间节目</title></programme>
+  <programme channel="a" start="20261020090000 +0800" stop="20261020100000 +0800"><title>明天节目</title></programme>
+  <programme channel="b" start="20261019090000 +0800" stop="20261019100000 +0800"><title>乙节目</title></programme>
+  <programme channel="b" start="bad" stop="20261019100000 +0800"><title>坏时间</title></programme>
+  <programme channel="1" start="20261019090000 +0800" stop="20261019100000 +0800"><title>丙节目</title></programme>
+  <programme channel="x" start="20261019090000 +0800" stop="20261019100000 +0800"><title>未定义</title></programme>
+</tv>
+"""
+
+
+def at(day: int, hour: int) -> datetime:
+    return datetime(2026, 10, day, hour, tzinfo=TZ)
+
+
+def titles(programmes: list) -> list[str]:
+    return [title for _, _, title in programmes]
+
+
+def test_parse_time():
+    assert parse_epg_time("20261019080000 +0800") == at(19, 8)
+    assert parse_epg_time("20261019080000+0800") == at(19, 8)
+
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_parse(gzipped):
+    source = gzip.compress(XML.encode("utf-8")) if gzipped else XML
+    channels, programmes = parse_epg(source)
+    assert channels == {"a": "测试频道甲", "b": "测试频道乙", "1": "测试频道丙"}
+    assert titles(programmes["a"]) == ["早间节目", "午间节目", "明天节目"]
+    assert titles(programmes["b"]) == ["乙节目"]
+    assert "x" not in programmes
+    assert programmes["a"][1][:2] == (at(19, 9), at(19, 10))
+
+
+def test_parse_names_window():
+    channels, programmes = parse_epg(XML, names={"测试频道甲"}, window=(at(19, 8) + timedelta(minutes=30), at(20, 0)))
+    assert channels == {"a": "测试频道甲"}
+    assert titles(programmes["a"]) == ["早间节目", "午间节目"]
+    assert not programmes["b"]
+
+
+def test_parse_invalid():
+    channels, programmes = parse_epg("<tv><channel")
+    assert channels == {} and not programmes
+
+
+def test_window():
+    assert in_epg_window(at(19, 8), at(19, 9), (None, None))
+    assert in_epg_window(at(19, 8), at(19, 9), (at(19, 8), at(19, 9)))
+    assert not in_epg_window(at(19, 8), at(19, 9), (at(19, 9), None))
+    assert not in_epg_window(at(19, 8), at(19, 9), (None, at(19, 8)))
+    assert in_epg_window(at(25, 8), at(25, 9), (at(19, 0), None))
+
+
+def test_cache_valid():
+    cached = {"names": "key", "window": (at(18, 0), at(21, 0))}
+    assert is_epg_cache_valid(cached, "key", (at(19, 0), at(20, 0)))
+    assert is_epg_cache_valid(cached, "key", (at(18, 0), at(21, 0)))
+    assert not is_epg_cache_valid(cached, "other", (at(19, 0), at(20, 0)))
+    assert not is_epg_cache_valid(cached, "key", (at(17, 0), at(20, 0)))
+    assert not is_epg_cache_valid(cached, "key", (at(19, 0), at(22, 0)))
+    assert not is_epg_cache_valid(cached, "key", (None, at(20, 0)))
+    assert not is_epg_cache_valid(cached, "key", (at(19, 0), None))
+    assert is_epg_cache_valid({"names": "", "window": (None, None)}, "", (at(19, 0), None))
+    assert not is_epg_cache_valid(None, "", (None, None))
+
+
+def test_merge():
+    first = ({"a": "测试频道甲", "1": "测试频道丙"}, {"a": [(at(19, 8), at(19, 9), "甲1")], "1": [(at(19, 8), at(19, 9), "丙1")]})
+    second = ({"a": "测试频道甲二", "b": "测试频道甲", "1": "测试频道丁"},
+              {"a": [(at(19, 8), at(19, 9), "甲2")], "b": [(at(19, 8), at(19, 9), "乙2")],
+               "1": [(at(19, 8), at(19, 9), "丁2")]})
+    result = merge_epg(["second-missing", "first", "second"], {"first": first, "second": second})
+    # The first source wins by id ("a") and by name ("测试频道甲" of "b"), numeric ids are per source
+    assert set(result) == {"测试频道甲", "测试频道丙", "测试频道丁"}
+    assert titles(result["测试频道甲"]) == ["甲1"]
+    assert titles(result["测试频道丁"]) == ["丁2"]
+    assert titles(merge_epg(["second", "first"], {"first": first, "second": second})["测试频道甲"]) == ["乙2"]
+    assert set(merge_epg(["first", "second"], {"first": first, "second": second}, names={"测试频道丁"})) == {"测试频道丁"}
+
+
+def test_epg_window_keeps_upcoming():
+    start, end = get_epg_window()
+    now = datetime.now(TZ)
+    # Running at the window start, upcoming today, upcoming on the last day, starting at the window end
+    if start is not None:
+        assert in_epg_window(start - timedelta(hours=1), start + timedelta(hours=1), (start, end))
+    assert in_epg_window(now + timedelta(hours=1), now + timedelta(hours=2), (start, end))
+    if end is not None:
+        assert in_epg_window(end - timedelta(hours=1), end, (start, end))
+        assert not in_epg_window(end, end + timedelta(hours=1), (start, end))
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from utils.epg_index import parse_query_time, parse_xmltv_time
+
+UTC_0800 = datetime(2026, 10, 19, 0, 0, tzinfo=timezone.utc).timestamp()
+
+
+def test_parse_xmltv_time():
+    assert parse_xmltv_time("20261019080000 +0800") == UTC_0800
+    assert parse_xmltv_time("20261019080000+0800") == UTC_0800
+
+
+@pytest.mark.parametrize("value", [
+    str(int(UTC_0800)),
+    "20261019080000 +0800",
+    "20261019080000 0800",
+    "20261019080000",
+    "2026-10-19T08:00:00+08:00",
+    "2026-10-19T08:00:00 08:00",
+    "2026-10-19T08:00:00 0800",
+    "2026-10-19T08:00 08:00",
+    "2026-10-19 08:00:00 08:00",
+    "2026-10-19T08:00:00.000 08:00",
+    "2026-10-19T00:00:00Z",
+    "2026-10-19T02:00:00+02:00",
+    "2026-10-19T08:00:00",
+    "2026-10-19 08:00",
+    "2026-10-19 08:00:00",
+    "2026-10-19T08:00",
+])
+def test_parse_query_time(value):
+    assert parse_query_time(value, "Asia/Shanghai") == UTC_0800
+
+
+def test_parse_query_time_negative_offset():
+    assert parse_query_time("2026-10-18T16:00:00-08:00", "Asia/Shanghai") == UTC_0800
+
+
+def test_parse_query_time_date():
+    assert parse_query_time("2026-10-19", "UTC") == UTC_0800
+
+
+@pytest.mark.parametrize("value", ["now", "2026-10-19 8", "2026-13-01T00:00:00", "20261019080000 08"])
+def test_parse_query_time_invalid(value):
+    with pytest.raises(ValueError):
+        parse_query_time(value, "Asia/Shanghai")
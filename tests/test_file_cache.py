@@ -0,0 +1,41 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from utils.file_cache import COMPRESS_MIN_SIZE, CachedFile, FileCache
+
+CONTENT = b"".join(f"CCTV-{i},http://example.com/{i}\n".encode() for i in range(COMPRESS_MIN_SIZE))
+
+
+def test_get(tmp_path):
+    path = tmp_path / "result.txt"
+    path.write_bytes(CONTENT)
+    cache = FileCache()
+    entry = cache.get(str(path))
+    assert entry.data == CONTENT and gzip.decompress(entry.variants["gzip"]) == CONTENT
+    assert cache.get(str(path)) is entry
+    path.write_bytes(b"changed")
+    assert cache.get(str(path)).data == b"changed"
+    os.remove(path)
+    assert cache.get(str(path)) is None and not cache.entries
+
+
+def test_source(tmp_path):
+    source = tmp_path / "generation.txt"
+    source.write_bytes(b"published")
+    cache = FileCache()
+    assert cache.get(str(tmp_path / "result.txt"), str(source)).data == b"published"
+    assert str(tmp_path / "result.txt") in cache.entries
+
+
+def test_load_once(tmp_path):
+    path = tmp_path / "result.txt"
+    path.write_bytes(CONTENT)
+    cache = FileCache()
+    with mock.patch("utils.file_cache.CachedFile", wraps=CachedFile) as cached_file:
+        with ThreadPoolExecutor(8) as executor:
+            entries = list(executor.map(lambda _: cache.get(str(path)), range(32)))
+    assert cached_file.call_count == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert not cache.pending
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from utils.file_writer import (
+    TIME_LINE_PATTERN,
+    get_content_hash,
+    get_file_hash,
+    write_if_changed,
+    write_lines_if_changed,
+    write_stats,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    write_stats.reset()
+    yield
+    write_stats.reset()
+
+
+def read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_write_new_file(tmp_path):
+    path = tmp_path / "dir" / "result.txt"
+    assert write_if_changed(str(path), "CCTV-1,http://example.com/1\n")
+    assert read(path) == "CCTV-1,http://example.com/1\n".encode("utf-8")
+    assert not os.path.exists(f"{path}.tmp")
+    assert (write_stats.written, write_stats.skipped) == (1, 0)
+
+
+def test_skip_unchanged(tmp_path):
+    path = str(tmp_path / "result.txt")
+    write_if_changed(path, b"data")
+    mtime = os.stat(path).st_mtime_ns
+    os.utime(path, ns=(mtime - 10 ** 9, mtime - 10 ** 9))
+    assert not write_if_changed(path, "data")
+    assert os.stat(path).st_mtime_ns == mtime - 10 ** 9
+    assert (write_stats.written, write_stats.skipped) == (1, 1)
+    assert (write_stats.written_bytes, write_stats.skipped_bytes) == (4, 4)
+
+
+def test_rewrite_changed(tmp_path):
+    path = str(tmp_path / "result.txt")
+    write_if_changed(path, "data")
+    assert write_if_changed(path, "datb")
+    assert read(path) == b"datb"
+    assert write_if_changed(path, "data longer")
+    assert read(path) == b"data longer"
+
+
+def test_ignore_time_lines(tmp_path):
+    path = str(tmp_path / "result.txt")
+    write_lines_if_changed(path, ["更新时间,#genre#", "20250724-132808", "CCTV-1,http://example.com/1"],
+                           ignore=TIME_LINE_PATTERN)
+    assert not write_lines_if_changed(path, ["更新时间,#genre#", "20250725-080000", "CCTV-1,http://example.com/1"],
+                                      ignore=TIME_LINE_PATTERN)
+    assert b"20250724-132808" in read(path)
+    assert write_lines_if_changed(path, ["更新时间,#genre#", "20250725-080000", "CCTV-1,http://example.com/2"],
+                                  ignore=TIME_LINE_PATTERN)
+    assert b"20250725-080000" in read(path)
+
+
+def test_compare_path(tmp_path):
+    latest = str(tmp_path / "latest.txt")
+    history = str(tmp_path / "history.txt")
+    write_if_changed(latest, "data")
+    assert not write_if_changed(history, "data", compare_path=latest)
+    assert not os.path.exists(history)
+    assert write_if_changed(history, "other", compare_path=latest)
+    assert read(history) == b"other"
+
+
+def test_hashes(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"line 1\n20250724 13:28:08\nline 2")
+    assert get_file_hash(str(path)) == get_content_hash(b"line 1\n20250724 13:28:08\nline 2")
+    assert get_file_hash(str(path), TIME_LINE_PATTERN) == get_content_hash(b"line 1\nline 2")
+    assert get_content_hash(b"a\r\nCheckTime\xef\xbc\x9a1\r\nb", TIME_LINE_PATTERN) == get_content_hash(b"a\r\nb")
+    assert get_file_hash(str(tmp_path / "missing")) is None
@@ -0,0 +1,56 @@
+import pytest
+
+from utils.hls_proxy import HlsProxy, is_hls_url
+
+URL = "http://example.com/live/频道/index.m3u8?token=abc&x=1"
+
+
+@pytest.fixture
+def proxy():
+    return HlsProxy(lambda channel_id: {}, 1024)
+
+
+def test_sign_verify(proxy):
+    token = proxy.sign(URL)
+    assert "=" not in token and "/" not in token and "+" not in token
+    assert proxy.verify(token) == URL
+
+
+def test_verify_tampered(proxy):
+    token = proxy.sign(URL)
+    other = proxy.sign("http://example.com/other.ts")
+    assert proxy.verify(token[:16] + other[16:]) is None
+    assert proxy.verify(("0" if token[0] != "0" else "1") + token[1:]) is None
+    assert proxy.verify(token[:-1]) is None
+    assert proxy.verify("") is None
+    assert proxy.verify("0" * 16 + "!!!") is None
+
+
+def test_verify_other_key(proxy):
+    assert HlsProxy(lambda channel_id: {}, 1024).verify(proxy.sign(URL)) is None
+
+
+def test_rewrite(proxy):
+    content = "\n".join([
+        "#EXTM3U",
+        '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"',
+        '#EXT-X-MEDIA:TYPE=AUDIO,URI="audio/index.m3u8"',
+        "#EXT-X-STREAM-INF:BANDWIDTH=1000",
+        "low/index",
+        "",
+        "segment-1.ts",
+    ])
+    lines = proxy.rewrite(content, "http://example.com/live/index.m3u8").splitlines()
+    assert lines[0] == "#EXTM3U"
+    key_token = lines[1].split('URI="')[1].rstrip('"')
+    assert key_token.endswith(".bin") and proxy.verify(key_token[:-4]) == "http://example.com/live/key.bin"
+    media_token = lines[2].split('URI="')[1].rstrip('"')
+    assert proxy.verify(media_token[:-5]) == "http://example.com/live/audio/index.m3u8"
+    assert lines[4].endswith(".m3u8") and proxy.verify(lines[4][:-5]) == "http://example.com/live/low/index"
+    assert lines[5] == ""
+    assert lines[6].endswith(".ts") and proxy.verify(lines[6][:-3]) == "http://example.com/live/segment-1.ts"
+
+
+def test_is_hls_url():
+    assert is_hls_url("http://example.com/live/index.M3U8?x=1$线路")
+    assert not is_hls_url("http://example.com/live.flv?x=index.m3u8")
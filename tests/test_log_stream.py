@@ -0,0 +1,110 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+from utils.file_cache import COMPRESS_MIN_SIZE
+from utils.log_stream import LogView, get_log_files, make_log_response
+
+app = Flask(__name__)
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    """
+    A log rotated twice: result.log.2 is the oldest chunk, result.log the live file
+    """
+    path = tmp_path / "result.log"
+    (tmp_path / "result.log.2").write_bytes(b"line 1\nline 2\n")
+    (tmp_path / "result.log.1").write_bytes(b"line 3\nline 4\n")
+    path.write_bytes(b"line 5\nline 6\n")
+    return str(path)
+
+
+CONTENT = b"line 1\nline 2\nline 3\nline 4\nline 5\nline 6\n"
+
+
+def get_response(path: str, headers: dict = None, tail: int = None):
+    with app.test_request_context("/log", headers=headers or {}):
+        response = make_log_response(path, tail)
+        data = b"".join(response.response)
+        response.close()
+        return response, data
+
+
+def test_log_files(log_path):
+    assert get_log_files(log_path) == [f"{log_path}.2", f"{log_path}.1", log_path]
+
+
+def test_view(log_path):
+    view = LogView(log_path)
+    try:
+        assert view.size == len(CONTENT)
+        assert b"".join(view.iter_range()) == CONTENT
+        assert b"".join(view.iter_range(10, 30)) == CONTENT[10:30]
+        assert b"".join(view.iter_range(14, 14)) == b""
+        assert b"".join(view.iter_range(40, 1000)) == CONTENT[40:]
+    finally:
+        view.close()
+
+
+@pytest.mark.parametrize("lines", [0, 1, 3, 6, 100])
+def test_tail(log_path, lines):
+    view = LogView(log_path)
+    try:
+        expected = b"".join(CONTENT.splitlines(keepends=True)[-lines:]) if lines else b""
+        assert view.tail(lines) == expected
+    finally:
+        view.close()
+
+
+def test_full_response(log_path):
+    response, data = get_response(log_path)
+    assert response.status_code == 200
+    assert data == CONTENT
+    assert response.headers["Content-Length"] == str(len(CONTENT))
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+@pytest.mark.parametrize("range_header, start, end", [
+    ("bytes=0-9", 0, 10),
+    ("bytes=10-29", 10, 30),
+    ("bytes=35-", 35, len(CONTENT)),
+    ("bytes=-8", len(CONTENT) - 8, len(CONTENT)),
+    ("bytes=30-1000", 30, len(CONTENT)),
+])
+def test_range_response(log_path, range_header, start, end):
+    response, data = get_response(log_path, {"Range": range_header, "Accept-Encoding": "gzip"})
+    assert response.status_code == 206
+    assert data == CONTENT[start:end]
+    assert response.headers["Content-Range"] == f"bytes {start}-{end - 1}/{len(CONTENT)}"
+    assert response.headers["Content-Length"] == str(end - start)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_range_not_satisfiable(log_path):
+    response, data = get_response(log_path, {"Range": "bytes=1000-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_tail_response(log_path):
+    response, data = get_response(log_path, tail=2)
+    assert response.status_code == 200
+    assert data == b"line 5\nline 6\n"
+
+
+def test_gzip_response(tmp_path):
+    path = tmp_path / "result.log"
+    content = b"".join(f"line {i}\n".encode() for i in range(COMPRESS_MIN_SIZE))
+    path.write_bytes(content)
+    response, data = get_response(str(path), {"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(data) == content
+
+
+def test_missing_log(tmp_path):
+    response, data = get_response(str(tmp_path / "result.log"))
+    assert response.status_code == 200
+    assert "Content-Range" not in response.headers
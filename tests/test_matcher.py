@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from utils.matcher import KeywordMatcher
+
+# Every nth url of the blacklist is used as a keyword, the full list takes seconds to build
+BLACKLIST_STEP = 20
+
+
+def read_lines(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_keywords(path: str) -> list[str]:
+    return [line for line in read_lines(path) if not line.startswith("#")]
+
+
+def read_blacklist_urls() -> list[str]:
+    return [line.split(",", 1)[1] for line in read_lines("assets/blacklist1/blacklist_auto.txt") if
+            "," in line and "://" in line]
+
+
+def get_probes(texts: list[str], seed: int = 0) -> list[str]:
+    """
+    Get the texts with their parts and altered copies, so both matches and misses are checked
+    """
+    rng = random.Random(seed)
+    probes = ["", " "]
+    for text in texts:
+        probes.append(text)
+        if len(text) > 1:
+            start = rng.randrange(len(text))
+            probes.append(text[start:])
+            probes.append(text[:start])
+            probes.append(text[:start] + "~" + text[start + 1:])
+        probes.append(f"prefix-{text}-suffix")
+    return probes
+
+
+def assert_parity(keywords: list[str], probes: list[str]):
+    matcher = KeywordMatcher(keywords)
+    for text in probes:
+        assert matcher.match(text) == any(keyword in text for keyword in keywords), text
+
+
+def test_sports_keywords():
+    keywords = read_lines("主频道/体育赛事.txt")
+    names = [line.split(",", 1)[0] for line in read_lines("assets/blacklist1/blacklist_auto.txt")[::50]]
+    assert_parity(keywords, get_probes(keywords + names))
+
+
+@pytest.mark.parametrize("path", ["config/whitelist.txt", "config/blacklist.txt"])
+def test_config_keywords(path):
+    keywords = read_keywords(path)
+    assert_parity(keywords, get_probes(keywords + read_blacklist_urls()[::50]))
+
+
+def test_blacklist_urls():
+    urls = read_blacklist_urls()
+    keywords = urls[::BLACKLIST_STEP]
+    assert_parity(keywords, get_probes(urls[::BLACKLIST_STEP // 2]))
+
+
+def test_overlapping_keywords():
+    keywords = ["he", "she", "his", "hers", "ushe", "a", "ab", "abc", "bcd", "体育", "育赛"]
+    probes = ["ushers", "h", "hi", "sh", "abd", "xbcdx", "b", "体", "赛事", "体育赛事", "足球"]
+    assert_parity(keywords, probes)
+
+
+def test_empty():
+    assert not KeywordMatcher([]).match("text")
+    assert not KeywordMatcher(None)
+    assert KeywordMatcher([""]).match("")
+    assert len(KeywordMatcher(["a", "b", None])) == 2
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+if not os.path.exists("utils/ip_checker/data/qqwry.ipdb"):
+    # utils.channel opens the IP database on import
+    pytest.skip("The IP database utils/ip_checker/data/qqwry.ipdb is not installed", allow_module_level=True)
+
+import updates.epg  # noqa: F401, imported before utils.channel which it imports back
+import service.app as service
+from utils.tools import get_secret_key
+
+ITEMS = [{"id": str(i), "url": f"http://example.com/{i}.flv", "origin": "subscribe"} for i in range(3)]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    reported = []
+    monkeypatch.setattr(service, "get_play_channel", lambda channel: "CCTV-1" if channel == "CCTV-1" else None)
+    monkeypatch.setattr(service.play_health, "channels", {"CCTV-1": ITEMS})
+    monkeypatch.setattr(service.play_health, "get_best",
+                        lambda name: next(item for item in ITEMS if item["url"] not in reported))
+    monkeypatch.setattr(service.play_health, "report", reported.append)
+    client = service.app.test_client()
+    client.reported = reported
+    return client
+
+
+def test_report_token(client):
+    token = client.get("/play/CCTV-1").headers["X-Report-Token"]
+    assert client.get(f"/play/CCTV-1/report?token={token}").status_code == 405
+    assert client.post("/play/CCTV-1/report").status_code == 403
+    assert client.post("/play/CCTV-1/report", data={"token": "0.0" * 8}).status_code == 403
+    assert client.post("/play/CCTV-1/report", data={"token": "频道"}).status_code == 403
+    assert client.post("/play/CCTV-1/report", data={"token": token, "url": ITEMS[1]["url"]}).status_code == 403
+    assert not client.reported
+    response = client.post("/play/CCTV-1/report", headers={"X-Report-Token": token})
+    assert response.status_code == 200 and client.reported == [ITEMS[0]["url"]]
+    assert response.json["next"] == ITEMS[1]["url"]
+    next_token = response.headers["X-Report-Token"]
+    assert client.post("/play/CCTV-1/report", data={"token": next_token, "url": ITEMS[1]["url"]}).status_code == 200
+    assert client.reported == [ITEMS[0]["url"], ITEMS[1]["url"]]
+
+
+def test_report_token_scope(client):
+    assert "X-Report-Token" not in client.get("/play/CCTV-1/status").headers
+    expired = service.get_report_token("CCTV-1", ITEMS[0]["url"], expires=1)
+    assert client.post("/play/CCTV-1/report", data={"token": expired}).status_code == 403
+    other = service.get_report_token("CCTV-2", ITEMS[0]["url"])
+    assert client.post("/play/CCTV-1/report", data={"token": other}).status_code == 403
+    assert not client.reported
+
+
+def test_secret_key(tmp_path):
+    path = str(tmp_path / "data" / "secret.key")
+    key = get_secret_key(path)
+    assert len(key) == 32 and get_secret_key(path) == key
+    assert os.listdir(tmp_path / "data") == ["secret.key"]
@@ -0,0 +1,51 @@
+import io
+import os
+
+import pytest
+
+import utils.constants as constants
+from utils.playlist import parse_playlist
+from utils.tools import get_name_url
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def get_expected(content: str, m3u_type: bool, open_headers: bool) -> list[dict]:
+    pattern = constants.multiline_m3u_pattern if m3u_type else constants.multiline_txt_pattern
+    return get_name_url(content, pattern=pattern, open_headers=open_headers)
+
+
+@pytest.mark.parametrize("name, m3u_type", [("playlist.m3u", True), ("playlist.txt", False)])
+@pytest.mark.parametrize("open_headers", [False, True])
+def test_parity(name, m3u_type, open_headers):
+    content = read_fixture(name)
+    expected = get_expected(content, m3u_type, open_headers)
+    assert expected
+    assert list(parse_playlist(io.StringIO(content), m3u_type, open_headers)) == expected
+    assert list(parse_playlist(io.BytesIO(content.encode("utf-8")), m3u_type, open_headers)) == expected
+
+
+@pytest.mark.parametrize("name, m3u_type", [("playlist.m3u", True), ("playlist.txt", False)])
+def test_parity_truncated(name, m3u_type):
+    content = read_fixture(name)
+    for end in range(0, len(content), 7):
+        part = content[:end]
+        assert list(parse_playlist(io.StringIO(part), m3u_type, True)) == get_expected(part, m3u_type, True), end
+
+
+def test_headers():
+    data = {item["name"]: item for item in parse_playlist(io.StringIO(read_fixture("playlist.m3u")), True, True)}
+    assert data["带请求头"]["headers"] == {"Referer": "http://ref.example.com/"}
+    assert data["带播放参数"]["headers"] == {"User-Agent": "okhttp/3.12", "Referer": "http://vlc.example.com/"}
+    assert data["回看频道"]["catchup"] == {"catchup": "append"}
+
+
+def test_headers_closed():
+    names = [item["name"] for item in parse_playlist(io.StringIO(read_fixture("playlist.m3u")), True)]
+    assert "带请求头" not in names
+    assert "CCTV-1 综合" in names
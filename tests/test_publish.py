@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+import pytest
+
+import utils.constants as constants
+from utils import publish
+from utils.publish import Generation, get_generations, publish_lock, read_manifest, rollback
+
+
+@pytest.fixture(autouse=True)
+def output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(constants, "generations_path", str(tmp_path / "data" / "generations"))
+    monkeypatch.setattr(constants, "manifest_path", str(tmp_path / "data" / "manifest.json"))
+
+
+def write(generation: Generation, path: str, content: str):
+    with open(generation.stage(path), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_publish():
+    generation = Generation()
+    write(generation, "output/result.txt", "first")
+    write(generation, "output/epg/epg.xml", "epg")
+    generation.publish()
+    generation = Generation()
+    write(generation, "output/result.txt", "second")
+    generation.publish()
+    assert read("output/result.txt") == "second" and read("output/epg/epg.xml") == "epg"
+    assert read_manifest()["generation"] == 2 and get_generations() == [1, 2]
+    assert rollback() == 1 and read("output/result.txt") == "first"
+
+
+def test_concurrent_updates():
+    first, second = Generation(), Generation()
+    assert first.staging_dir != second.staging_dir
+    write(first, "output/result.txt", "first")
+    write(second, "output/result.txt", "second")
+    second.publish()
+    first.publish()
+    assert (second.number, first.number) == (1, 2)
+    assert read("output/result.txt") == "first"
+    manifest = read_manifest()
+    assert manifest["generation"] == 2
+    with open(os.path.join(constants.generations_path, "1", publish.MANIFEST_NAME), encoding="utf-8") as f:
+        assert json.load(f)["generation"] == 1
+
+
+def test_publish_waits_for_lock():
+    generation = Generation()
+    write(generation, "output/result.txt", "data")
+    thread = threading.Thread(target=generation.publish)
+    with publish_lock():
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive() and read_manifest() is None
+    thread.join(5)
+    assert read_manifest()["generation"] == 1
+
+
+def test_prune_keeps_concurrent_staging(monkeypatch):
+    monkeypatch.setattr(publish, "STAGING_MAX_AGE", 3600)
+    pending = Generation()
+    for i in range(5):
+        generation = Generation()
+        write(generation, "output/result.txt", str(i))
+        generation.publish()
+    assert os.path.isdir(pending.staging_dir)
+    assert len(get_generations()) == 3
+    os.utime(pending.staging_dir, (0, 0))
+    generation = Generation()
+    write(generation, "output/result.txt", "last")
+    generation.publish()
+    assert not os.path.exists(pending.staging_dir)
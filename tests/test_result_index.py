@@ -0,0 +1,61 @@
+import gzip
+import os
+import pickle
+import re
+
+import pytest
+
+if not os.path.exists("utils/ip_checker/data/qqwry.ipdb"):
+    # utils.channel opens the IP database on import
+    pytest.skip("The IP database utils/ip_checker/data/qqwry.ipdb is not installed", allow_module_level=True)
+
+import updates.epg  # noqa: F401, imported before utils.channel which it imports back
+import utils.constants as constants
+from utils.channel import write_rtmp_data
+from utils.channel_lookup import ChannelLookup
+from utils.result_index import ResultIndex
+
+
+def make_item(channel_id: str, url: str, ipv_type: str = "ipv4") -> dict:
+    return {
+        "id": channel_id, "url": url, "host": "example.com", "date": None, "delay": 10, "speed": 1,
+        "resolution": "1920x1080", "origin": "subscribe", "ipv_type": ipv_type, "location": None, "isp": None,
+        "headers": {"Referer": "http://example.com"} if channel_id == "a2" else None, "catchup": None,
+        "extra_info": "",
+    }
+
+
+DATA = {
+    "央视频道": {
+        "CCTV-1": [make_item(f"a{i}", f"http://example.com/a{i}.m3u8") for i in range(1, 4)]
+                  + [make_item("a6", "http://[2409::1]/a6.m3u8", "ipv6")],
+        "CCTV-2": [make_item(f"b{i}", f"http://example.com/b{i}.flv") for i in range(1, 3)],
+    },
+}
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    data_path = tmp_path / "result.pkl.gz"
+    data_path.write_bytes(gzip.compress(pickle.dumps({"data": DATA, "ipv6": False}), mtime=0))
+    rtmp_path = str(tmp_path / "rtmp.db")
+    monkeypatch.setattr(constants, "rtmp_data_path", rtmp_path)
+    return str(data_path), rtmp_path
+
+
+@pytest.mark.parametrize("query", [
+    {"rtmp": "live"},
+    {"rtmp": "hls", "ipv_type": ["ipv6"]},
+    {"rtmp": "live", "limit": 1},
+    {"rtmp": "hls", "categories": ["央视频道"], "origins": ["subscribe"]},
+])
+def test_rendered_ids_exist(paths, query):
+    data_path, rtmp_path = paths
+    write_rtmp_data(DATA)
+    entry = ResultIndex(data_path).render(**query)
+    ids = re.findall(r"/(?:live|hls)/(\w+)$", entry.data.decode(), re.M)
+    assert ids
+    lookup = ChannelLookup(rtmp_path)
+    for channel_id in ids:
+        assert lookup.get(channel_id)["url"]
+    assert lookup.get("a2")["headers"] == {"Referer": "http://example.com"}
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+from contextlib import closing
+
+import pytest
+
+from utils.stream_manager import StreamManager
+from utils.stream_registry import StreamRegistry, get_process_start, is_pid_alive
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="The start time is read from /proc")
+
+
+@pytest.fixture
+def process():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return StreamRegistry(str(tmp_path / "streams.db"), "live")
+
+
+def test_process_start(process):
+    start = get_process_start(process.pid)
+    assert start and start == get_process_start(process.pid)
+    assert is_pid_alive(process.pid, start)
+    assert not is_pid_alive(process.pid, str(int(start) + 1))
+
+
+def test_claim(registry, process):
+    assert registry.claim("1", lambda: process.pid) == (process.pid, True)
+    assert registry.claim("1", lambda: pytest.fail("started twice")) == (process.pid, False)
+    assert registry.rows()[0]["process_start"] == get_process_start(process.pid)
+
+
+def test_reused_pid(registry, process):
+    registry.claim("1", lambda: process.pid)
+    with closing(registry.connect()) as conn:
+        conn.execute("UPDATE streams SET process_start = '0'")
+    assert registry.get("1") is None and not registry.rows()
+
+
+def test_stop_reused_pid(registry, process):
+    registry.claim("1", lambda: process.pid)
+    StreamManager.stop(registry, "1", process.pid, "0")
+    assert process.poll() is None
+    assert not registry.rows()
+
+
+def test_clear(tmp_path, process):
+    manager = StreamManager(str(tmp_path / "streams.db"))
+    manager["hls"].claim("1", lambda: process.pid)
+    manager.clear()
+    assert process.wait(5) is not None
+    assert not manager["hls"].rows() and not manager["live"].rows()
@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+import pytest
+
+if not os.path.exists("utils/ip_checker/data/qqwry.ipdb"):
+    # utils.channel opens the IP database on import
+    pytest.skip("The IP database utils/ip_checker/data/qqwry.ipdb is not installed", allow_module_level=True)
+
+import updates.epg  # noqa: F401, imported before utils.channel which it imports back
+import updates.subscribe.request as request
+import utils.constants as constants
+from updates.subscribe.score import SubscribeScore
+
+FEEDS = {
+    "http://example.com/a.txt": [{"name": "CCTV-1", "url": "http://example.com/1"},
+                                 {"name": "CCTV-2", "url": "http://example.com/2"}],
+    "http://example.com/b.txt": [{"name": "CCTV-1", "url": "http://example.com/1"}],
+}
+
+
+@pytest.fixture(autouse=True)
+def feeds(tmp_path, monkeypatch):
+    async def fetch_subscribe_data(session, url, cache, retry):
+        return FEEDS[url]
+
+    monkeypatch.setattr(request, "fetch_subscribe_data", fetch_subscribe_data)
+    monkeypatch.setattr(request, "load_subscribe_cache", dict)
+    monkeypatch.setattr(request, "save_subscribe_cache", lambda cache: None)
+    monkeypatch.setattr(constants, "subscribe_score_path", str(tmp_path / "subscribe_score.pkl.gz"))
+
+
+@pytest.mark.parametrize("infos", [
+    list(FEEDS),
+    [{"url": url, "region": "广东", "type": "电信"} for url in FEEDS],
+])
+def test_score_keyed_by_url(infos):
+    score = SubscribeScore()
+    result = asyncio.run(request.get_channels_by_subscribe_urls(
+        infos, hotel=isinstance(infos[0], dict), error_print=False, score=score
+    ))
+    assert set(result) == {"CCTV-1", "CCTV-2"}
+    assert score.stats == {
+        "http://example.com/a.txt": {"total": 2, "new": 2, "passed": None, "final": 0},
+        "http://example.com/b.txt": {"total": 1, "new": 0, "passed": None, "final": 0},
+    }
@@ -1,2 +1,2 @@
 from .request import get_epg
-from .tools import write_to_xml, compress_to_gz
+from .tools import write_to_xml
@@ -1,11 +1,18 @@
+import asyncio
+import gzip
+import hashlib
+import io
 import os
+import pickle
 import re
+import tempfile
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime, timedelta
 from time import time
 
+import pytz
 from requests import Session, exceptions
 from tqdm.asyncio import tqdm_asyncio
 
@@ -16,39 +23,186 @@ from utils.retry import retry_func
 from utils.tools import get_pbar_remaining, get_urls_from_file, opencc_t2s, join_url
 
 
-def parse_epg(epg_content):
+class PeekReader:
+    """
+    Binary stream with the first bytes read ahead, the response stream can not be wrapped in a BufferedReader
+    since it is closed once exhausted
+    """
+
+    def __init__(self, source, size=2):
+        self.source = source
+        self.head = source.read(size)
+
+    def read(self, size=-1):
+        head, self.head = self.head, b""
+        if size is None or size < 0:
+            return head + self.source.read()
+        if len(head) >= size:
+            self.head = head[size:]
+            return head[:size]
+        return head + self.source.read(size - len(head))
+
+
+def open_epg_source(source):
+    """
+    Open the epg source as a binary stream, the gzipped source is decompressed on the fly
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    elif isinstance(source, str):
+        source = io.BytesIO(source.encode("utf-8"))
+    stream = PeekReader(source)
+    if stream.head[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def parse_epg_time(value):
+    """
+    Parse the xmltv time, e.g. 20240101120000 +0800
+    """
+    return datetime.strptime(re.sub(r'\s+', '', value), "%Y%m%d%H%M%S%z")
+
+
+def get_epg_window():
+    """
+    Get the time window of the programmes to keep: from the start of epg_past_days days before today
+    to the end of epg_future_days days after today, a negative value means no limit on that side.
+    A programme is kept when it overlaps the window (see in_epg_window): the upcoming programmes
+    are kept up to the last one starting before the end, the ones starting at the end or later are dropped
+    """
+    today = datetime.now(pytz.timezone(config.time_zone)).replace(hour=0, minute=0, second=0, microsecond=0)
+    past_days, future_days = config.epg_past_days, config.epg_future_days
+    start = today - timedelta(days=past_days) if past_days >= 0 else None
+    end = today + timedelta(days=future_days + 1) if future_days >= 0 else None
+    return start, end
+
+
+def in_epg_window(start, stop, window):
+    """
+    Check if the programme overlaps the window: it stops after the window start
+    and starts before the window end, the bounds are None when not limited
+    """
+    window_start, window_end = window
+    return (window_start is None or stop > window_start) and (window_end is None or start < window_end)
+
+
+def parse_epg(source, names=None, window=(None, None)):
+    """
+    Parse the epg source (xml text, bytes or a binary stream, optionally gzipped) with iterparse,
+    only the channels in names and their programmes within the window are kept,
+    the rest is discarded as it is read; programmes are (start, stop, title)
+    """
+    channels = {}
+    programmes = defaultdict(list)
+    skipped = set()
+    # Programmes of the channels not defined yet, resolved at the end
+    pending = defaultdict(list)
     try:
-        parser = ET.XMLParser(encoding='UTF-8')
-        root = ET.fromstring(epg_content, parser=parser)
-    except ET.ParseError as e:
+        context = ET.iterparse(open_epg_source(source), events=("start", "end"),
+                               parser=ET.XMLParser(encoding='UTF-8'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end":
+                continue
+            if elem.tag == 'channel':
+                channel_id = elem.get('id')
+                display_name = elem.findtext('display-name')
+                if display_name and (not names or format_channel_name(display_name) in names):
+                    channels[channel_id] = display_name
+                    for start, stop, title in pending.pop(channel_id, []):
+                        programmes[channel_id].append((start, stop, opencc_t2s.convert(title)))
+                else:
+                    skipped.add(channel_id)
+                    pending.pop(channel_id, None)
+                root.clear()
+            elif elem.tag == 'programme':
+                channel_id = elem.get('channel')
+                if channel_id not in skipped:
+                    try:
+                        start, stop = parse_epg_time(elem.get('start')), parse_epg_time(elem.get('stop'))
+                    except (TypeError, ValueError):
+                        start = None
+                    if start and in_epg_window(start, stop, window):
+                        title = elem.findtext('title') or ""
+                        if channel_id in channels:
+                            programmes[channel_id].append((start, stop, opencc_t2s.convert(title)))
+                        else:
+                            pending[channel_id].append((start, stop, title))
+                root.clear()
+    except (ET.ParseError, StopIteration, OSError, EOFError) as e:
         print(f"Error parsing XML: {e}")
-        print(f"Problematic content: {epg_content[:500]}")
         return {}, defaultdict(list)
 
-    channels = {}
+    return channels, programmes
+
+
+def load_epg_cache() -> dict:
+    """
+    Load the epg source cache: url -> etag, last_modified, hash, names, window, channels, programmes
+    """
+    if os.path.exists(constants.epg_cache_path):
+        try:
+            with gzip.open(constants.epg_cache_path, "rb") as file:
+                return pickle.load(file)
+        except Exception:
+            pass
+    return {}
+
+
+def save_epg_cache(cache: dict):
+    """
+    Save the epg source cache
+    """
+    os.makedirs(os.path.dirname(constants.epg_cache_path), exist_ok=True)
+    with gzip.open(constants.epg_cache_path, "wb") as file:
+        pickle.dump(cache, file)
+
+
+def get_cached_epg(cached, window):
+    """
+    Get the cached channels and programmes pruned to the window
+    """
     programmes = defaultdict(list)
+    for channel_id, data in cached["programmes"].items():
+        programmes[channel_id] = [item for item in data if in_epg_window(item[0], item[1], window)]
+    return cached["channels"], programmes
 
-    for channel in root.findall('channel'):
-        channel_id = channel.get('id')
-        display_name = channel.find('display-name').text
-        channels[channel_id] = display_name
-
-    for programme in root.findall('programme'):
-        channel_id = programme.get('channel')
-        channel_start = datetime.strptime(
-            re.sub(r'\s+', '', programme.get('start')), "%Y%m%d%H%M%S%z")
-        channel_stop = datetime.strptime(
-            re.sub(r'\s+', '', programme.get('stop')), "%Y%m%d%H%M%S%z")
-        channel_text = opencc_t2s.convert(programme.find('title').text)
-        channel_elem = ET.SubElement(
-            root, 'programme', attrib={"channel": channel_id, "start": channel_start.strftime("%Y%m%d%H%M%S +0800"),
-                                       "stop": channel_stop.strftime("%Y%m%d%H%M%S +0800")})
-        channel_elem_s = ET.SubElement(
-            channel_elem, 'title', attrib={"lang": "zh"})
-        channel_elem_s.text = channel_text
-        programmes[channel_id].append(channel_elem)
 
-    return channels, programmes
+def is_epg_cache_valid(cached, names_key, window):
+    """
+    Check if the cache can be used: parsed with the same names and a window covering the current one
+    """
+    if not cached or cached["names"] != names_key:
+        return False
+    cached_start, cached_end = cached["window"]
+    window_start, window_end = window
+    if cached_start is not None and (window_start is None or window_start < cached_start):
+        return False
+    return cached_end is None if window_end is None else (cached_end is None or cached_end >= window_end)
+
+
+def merge_epg(urls, source_results, names=None):
+    """
+    Merge the channels and programmes of the sources in the order of the urls, the first source
+    of a channel (by id, or by name since the numeric ids differ between the sources) wins
+    """
+    result = defaultdict(list)
+    all_result_verify = set()
+    for url in urls:
+        if url not in source_results:
+            continue
+        channels, programmes = source_results[url]
+        for channel_id, display_name in channels.items():
+            display_name = format_channel_name(display_name)
+            if names and display_name not in names:
+                continue
+            if channel_id not in all_result_verify and display_name not in all_result_verify:
+                if not channel_id.isdigit():
+                    all_result_verify.add(channel_id)
+                all_result_verify.add(display_name)
+                result[display_name] = programmes[channel_id]
+    return result
 
 
 async def get_epg(names=None, callback=None):
@@ -62,39 +216,67 @@ async def get_epg(names=None, callback=None):
         desc=f"Processing epg",
     )
     start_time = time()
-    result = defaultdict(list)
-    all_result_verify = set()
     session = Session()
+    window = get_epg_window()
+    names_key = hashlib.md5("\n".join(sorted(names)).encode("utf-8")).hexdigest() if names else ""
+    cache = load_epg_cache()
+    new_cache = {}
+    source_results = {}
+    unchanged = 0
 
     def process_run(url):
-        nonlocal all_result_verify, result
+        nonlocal unchanged
         try:
+            cached = cache.get(url)
+            if not is_epg_cache_valid(cached, names_key, window):
+                cached = None
+            headers = {}
+            if cached:
+                if cached["etag"]:
+                    headers["If-None-Match"] = cached["etag"]
+                if cached["last_modified"]:
+                    headers["If-Modified-Since"] = cached["last_modified"]
             response = None
             try:
                 response = (
                     retry_func(
                         lambda: session.get(
-                            url, timeout=config.request_timeout
+                            url, headers=headers, timeout=config.request_timeout, stream=True
                         ),
                         name=url,
                     )
                 )
             except exceptions.Timeout:
                 print(f"Timeout on epg: {url}")
-            if response:
-                response.encoding = "utf-8"
-                content = response.text
-                if content:
-                    channels, programmes = parse_epg(content)
-                    for channel_id, display_name in channels.items():
-                        display_name = format_channel_name(display_name)
-                        if names and display_name not in names:
-                            continue
-                        if channel_id not in all_result_verify and display_name not in all_result_verify:
-                            if not channel_id.isdigit():
-                                all_result_verify.add(channel_id)
-                            all_result_verify.add(display_name)
-                            result[display_name] = programmes[channel_id]
+            if response is not None and response.status_code == 304 and cached:
+                response.close()
+                source_results[url] = get_cached_epg(cached, window)
+                new_cache[url] = cached
+                unchanged += 1
+            elif response:
+                with response, tempfile.TemporaryFile() as file:
+                    # Spool the body to check the content hash before parsing, keeping the memory bounded
+                    body_hash = hashlib.md5()
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        body_hash.update(chunk)
+                        file.write(chunk)
+                    body_hash = body_hash.hexdigest()
+                    if cached and cached["hash"] == body_hash:
+                        channels, programmes = get_cached_epg(cached, window)
+                        unchanged += 1
+                    else:
+                        file.seek(0)
+                        channels, programmes = parse_epg(file, names, window)
+                    source_results[url] = (channels, programmes)
+                    new_cache[url] = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "hash": body_hash,
+                        "names": names_key,
+                        "window": window,
+                        "channels": channels,
+                        "programmes": programmes,
+                    }
         except Exception as e:
             print(f"Error on {url}: {e}")
         finally:
@@ -106,9 +288,17 @@ async def get_epg(names=None, callback=None):
                     int((pbar.n / urls_len) * 100),
                 )
 
+    # The requests block, run them in the threads and keep the event loop free for the other fetchers
+    loop = asyncio.get_running_loop()
     with ThreadPoolExecutor(max_workers=10) as executor:
-        for epg_url in urls:
-            executor.submit(process_run, epg_url)
+        await asyncio.gather(*(loop.run_in_executor(executor, process_run, epg_url) for epg_url in urls))
     session.close()
     pbar.close()
+    result = merge_epg(urls, source_results, names)
+    if unchanged:
+        print(f"EPG sources unchanged: {unchanged}/{urls_len}")
+    try:
+        save_epg_cache(new_cache)
+    except Exception as e:
+        print(f"Error on saving epg cache: {e}")
     return result
@@ -1,25 +1,60 @@
 import gzip
-import shutil
+import os
 import xml.etree.ElementTree as ET
+from contextlib import ExitStack
 from datetime import datetime
-from xml.dom import minidom
+from xml.sax.saxutils import escape
 
+attr_entities = {'"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#9;"}
 
-def write_to_xml(programmes, path):
-    root = ET.Element('tv', attrib={'date': datetime.now().strftime("%Y%m%d%H%M%S +0800")})
-    for channel_id, data in programmes.items():
-        channel_elem = ET.SubElement(root, 'channel', attrib={"id": channel_id})
-        display_name_elem = ET.SubElement(channel_elem, 'display-name', attrib={"lang": "zh"})
-        display_name_elem.text = channel_id
-        for prog in data:
-            prog.set('channel', channel_id)
-            root.append(prog)
 
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write(minidom.parseString(ET.tostring(root, 'utf-8')).toprettyxml(indent='\t', newl='\n'))
+def format_element(elem: ET.Element, level: int = 1, attrib: dict = None) -> str:
+    """
+    Format the element as pretty xml, same as minidom toprettyxml with tab indent
+    """
+    indent = "\t" * level
+    attrs = "".join(f' {key}="{escape(str(value), attr_entities)}"' for key, value in (attrib or elem.attrib).items())
+    children = list(elem)
+    if children:
+        content = "".join(format_element(child, level + 1) for child in children)
+        return f"{indent}<{elem.tag}{attrs}>\n{content}{indent}</{elem.tag}>\n"
+    if elem.text:
+        return f"{indent}<{elem.tag}{attrs}>{escape(elem.text)}</{elem.tag}>\n"
+    return f"{indent}<{elem.tag}{attrs}/>\n"
 
 
-def compress_to_gz(input_path, output_path):
-    with open(input_path, 'rb') as f_in:
-        with gzip.open(output_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
+def write_to_xml(programmes, path, gz_path=None):
+    """
+    Write the programmes (start, stop, title) to the xmltv file channel by channel,
+    and to the gzipped file in the same pass if gz_path, the files are swapped in once complete
+    """
+    paths = [path, gz_path] if gz_path else [path]
+    with ExitStack() as stack:
+        outputs = [stack.enter_context(open(f"{path}.tmp", 'wb'))]
+        if gz_path:
+            outputs.append(stack.enter_context(gzip.open(f"{gz_path}.tmp", 'wb')))
+
+        def write(text):
+            data = text.encode('utf-8')
+            for output in outputs:
+                output.write(data)
+
+        write(f'<?xml version="1.0" ?>\n<tv date="{datetime.now().strftime("%Y%m%d%H%M%S +0800")}">\n')
+        for channel_id, data in programmes.items():
+            channel_elem = ET.Element('channel', attrib={"id": channel_id})
+            display_name_elem = ET.SubElement(channel_elem, 'display-name', attrib={"lang": "zh"})
+            display_name_elem.text = channel_id
+            chunk = [format_element(channel_elem)]
+            for start, stop, title in data:
+                prog = ET.Element('programme', attrib={
+                    "channel": channel_id,
+                    "start": start.strftime("%Y%m%d%H%M%S +0800"),
+                    "stop": stop.strftime("%Y%m%d%H%M%S +0800")
+                })
+                title_elem = ET.SubElement(prog, 'title', attrib={"lang": "zh"})
+                title_elem.text = title
+                chunk.append(format_element(prog))
+            write("".join(chunk))
+        write('</tv>\n')
+    for output_path in paths:
+        os.replace(f"{output_path}.tmp", output_path)
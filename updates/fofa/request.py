@@ -1,3 +1,4 @@
+import asyncio
 import pickle
 import re
 import threading
@@ -156,20 +157,25 @@ async def get_channels_by_fofa(urls=None, multicast=False, callback=None):
                         int((pbar.n / fofa_urls_len) * 100),
                     )
 
-        max_workers = 3 if open_driver else 10
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(process_fofa_channels, fofa_url) for fofa_url in fofa_urls
-            ]
-            try:
-                for future in as_completed(futures):
-                    result = future.result()
-                    if result:
-                        fofa_results = merge_objects(fofa_results, result)
-            except ValueError as e:
-                if "Limited access to fofa page" in str(e):
-                    for future in futures:
-                        future.cancel()
+        def process_fofa_urls(results):
+            max_workers = 3 if open_driver else 10
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(process_fofa_channels, fofa_url) for fofa_url in fofa_urls
+                ]
+                try:
+                    for future in as_completed(futures):
+                        result = future.result()
+                        if result:
+                            results = merge_objects(results, result)
+                except ValueError as e:
+                    if "Limited access to fofa page" in str(e):
+                        for future in futures:
+                            future.cancel()
+            return results
+
+        # The pool waits for the blocking requests, keep the event loop free for the other fetchers
+        fofa_results = await asyncio.to_thread(process_fofa_urls, fofa_results)
         if fofa_results:
             update_fofa_region_result_tmp(fofa_results, multicast=multicast)
         pbar.n = fofa_urls_len
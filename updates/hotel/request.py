@@ -1,7 +1,8 @@
+import asyncio
 import pickle
 import urllib.parse as urlparse
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from urllib.parse import parse_qs
 
@@ -163,22 +164,18 @@ async def get_channels_by_hotel(callback=None):
         if callback:
             callback(f"正在获取Foodie酒店源, 共{region_list_len}个地区", 0)
         search_region_result = defaultdict(list)
+        loop = asyncio.get_running_loop()
         with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {
-                executor.submit(process_region_by_hotel, region): region
-                for region in region_list
-            }
-
-            for future in as_completed(futures):
-                region = futures[future]
-                result = future.result()
-
-                if result:
-                    for item in result:
-                        url = item.get("url")
-                        date = item.get("date")
-                        if url:
-                            search_region_result[region].append({"url": url, "date": date})
+            results = await asyncio.gather(
+                *(loop.run_in_executor(executor, process_region_by_hotel, region) for region in region_list)
+            )
+        for region, result in zip(region_list, results):
+            if result:
+                for item in result:
+                    url = item.get("url")
+                    date = item.get("date")
+                    if url:
+                        search_region_result[region].append({"url": url, "date": date})
         urls = [
             {"region": region, "url": f"http://{item["url"]}/ZHGXTV/Public/json/live_interface.txt"}
             for region, result in search_region_result.items()
@@ -1,7 +1,8 @@
+import asyncio
 import pickle
 import urllib.parse as urlparse
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from urllib.parse import parse_qs
 
@@ -175,28 +176,23 @@ async def get_channels_by_multicast(names, callback=None):
                     0,
                 )
             start_time = time()
+            loop = asyncio.get_running_loop()
             with ThreadPoolExecutor(max_workers=3) as executor:
-                futures = {
-                    executor.submit(process_channel_by_multicast, region, type): (
-                        region,
-                        type,
-                    )
-                    for region, type in region_type_list
-                }
-
-                for future in as_completed(futures):
-                    region, type = futures[future]
-                    result = future.result()
-                    data = result.get("data")
+                results = await asyncio.gather(
+                    *(loop.run_in_executor(executor, process_channel_by_multicast, region, type)
+                      for region, type in region_type_list)
+                )
+            for (region, type), result in zip(region_type_list, results):
+                data = result.get("data")
 
-                    if data:
-                        for item in data:
-                            url = item.get("url")
-                            date = item.get("date")
-                            if url:
-                                search_region_type_result[region][type].append(
-                                    {"url": url, "date": date}
-                                )
+                if data:
+                    for item in data:
+                        url = item.get("url")
+                        date = item.get("date")
+                        if url:
+                            search_region_type_result[region][type].append(
+                                {"url": url, "date": date}
+                            )
             pbar.close()
         request_channels = get_channel_multicast_result(
             name_region_type_result, search_region_type_result
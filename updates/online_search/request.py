@@ -1,3 +1,4 @@
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from time import time
 
@@ -176,16 +177,16 @@ async def get_channels_by_online_search(names, callback=None):
     pbar = tqdm_asyncio(total=names_len, desc="Online search")
     if callback:
         callback(f"正在进行线上查询, 共{names_len}个频道", 0)
+    loop = asyncio.get_running_loop()
     with ThreadPoolExecutor(max_workers=3) as executor:
-        futures = [
-            executor.submit(process_channel_by_online_search, name) for name in names
-        ]
-        for future in futures:
-            result = future.result()
-            name = result.get("name")
-            data = result.get("data", [])
-            if name:
-                channels[name] = data
+        results = await asyncio.gather(
+            *(loop.run_in_executor(executor, process_channel_by_online_search, name) for name in names)
+        )
+    for result in results:
+        name = result.get("name")
+        data = result.get("data", [])
+        if name:
+            channels[name] = data
     if not open_driver:
         close_session()
     pbar.close()
@@ -1,20 +1,111 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import os
+import pickle
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
 from time import time
 
-from requests import Session, exceptions
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, ClientError
 from tqdm.asyncio import tqdm_asyncio
 
 import utils.constants as constants
+from updates.subscribe.score import SubscribeScore, get_info_url
 from utils.channel import format_channel_name
 from utils.config import config
-from utils.retry import retry_func
+from utils.retry import max_retries
+from utils.playlist import parse_playlist
 from utils.tools import (
     merge_objects,
-    get_pbar_remaining,
-    get_name_url
+    get_pbar_remaining
 )
 
+try:
+    # aiohttp only decodes brotli responses when the brotli package is installed
+    import brotli
+
+    accept_encoding = "gzip, deflate, br"
+except ImportError:
+    accept_encoding = "gzip, deflate"
+
+
+def load_subscribe_cache() -> dict:
+    """
+    Load the subscribe response cache: url -> etag, last_modified, hash, open_headers, data
+    """
+    if os.path.exists(constants.subscribe_cache_path):
+        try:
+            with gzip.open(constants.subscribe_cache_path, "rb") as file:
+                return pickle.load(file)
+        except Exception:
+            pass
+    return {}
+
+
+def save_subscribe_cache(cache: dict):
+    """
+    Save the subscribe response cache
+    """
+    os.makedirs(os.path.dirname(constants.subscribe_cache_path), exist_ok=True)
+    with gzip.open(constants.subscribe_cache_path, "wb") as file:
+        pickle.dump(cache, file)
+
+
+async def fetch_subscribe_data(session: ClientSession, url: str, cache: dict, retry: bool = True) -> list:
+    """
+    Fetch the subscribe url with a conditional request, reuse the parsed data if unchanged
+    """
+    cached = cache.get(url)
+    open_headers = config.open_headers
+    if cached and cached["open_headers"] != open_headers:
+        cached = None
+    headers = {"Accept-Encoding": accept_encoding}
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    retries = max_retries if retry else 1
+    for i in range(retries):
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and cached:
+                    return cached["data"]
+                response.raise_for_status()
+                body = await response.read()
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+            break
+        except (ClientError, asyncio.TimeoutError) as e:
+            if i < retries - 1:
+                print(f"Failed to connect to the {url}. Retrying {i + 1}...")
+                await asyncio.sleep(1)
+            elif isinstance(e, asyncio.TimeoutError):
+                print(f"Timeout on subscribe: {url}")
+                return []
+            else:
+                raise
+    body_hash = hashlib.md5(body).hexdigest()
+    if cached and cached["hash"] == body_hash:
+        data = cached["data"]
+    else:
+        m3u_type = True if b"#EXTM3U" in body else False
+        # A big feed takes a while to parse, keep the event loop free for the other fetches and the speed test
+        data = await asyncio.to_thread(lambda: list(parse_playlist(
+            io.BytesIO(body),
+            m3u_type=m3u_type,
+            open_headers=open_headers if m3u_type else False
+        )))
+    cache[url] = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "hash": body_hash,
+        "open_headers": open_headers,
+        "data": data,
+    }
+    return data
+
 
 async def get_channels_by_subscribe_urls(
         urls,
@@ -25,10 +116,13 @@ async def get_channels_by_subscribe_urls(
         error_print=True,
         whitelist=None,
         callback=None,
+        score: SubscribeScore = None,
 ):
     """
-    Get the channels by subscribe urls
+    Get the channels by subscribe urls, the score orders the urls, skips the useless ones and limits the low yield ones
     """
+    if score:
+        urls = score.sort(urls)
     if whitelist:
         urls.sort(key=lambda url: whitelist.index(url) if url in whitelist else len(whitelist))
     subscribe_results = {}
@@ -46,81 +140,64 @@ async def get_channels_by_subscribe_urls(
         )
     hotel_name = constants.origin_map["hotel"]
 
-    def process_subscribe_channels(subscribe_info: str | dict) -> defaultdict:
+    cache = load_subscribe_cache()
+    totals = {}
+
+    async def process_subscribe_channels(
+            session: ClientSession, subscribe_info: str | dict
+    ) -> tuple[str, defaultdict]:
+        """
+        Get the channels of the subscribe info, with its url as the key of the totals and the score
+        """
         region = ""
         url_type = ""
         if (multicast or hotel) and isinstance(subscribe_info, dict):
             region = subscribe_info.get("region")
             url_type = subscribe_info.get("type", "")
-            subscribe_url = subscribe_info.get("url")
-        else:
-            subscribe_url = subscribe_info
+        subscribe_url = get_info_url(subscribe_info)
         channels = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
         in_whitelist = whitelist and (subscribe_url in whitelist)
-        session = Session()
         try:
-            response = None
-            try:
-                response = (
-                    retry_func(
-                        lambda: session.get(
-                            subscribe_url, timeout=config.request_timeout
-                        ),
-                        name=subscribe_url,
-                    )
-                    if retry
-                    else session.get(subscribe_url, timeout=config.request_timeout)
-                )
-            except exceptions.Timeout:
-                print(f"Timeout on subscribe: {subscribe_url}")
-            if response:
-                response.encoding = "utf-8"
-                content = response.text
-                m3u_type = True if "#EXTM3U" in content else False
-                data = get_name_url(
-                    content,
-                    pattern=(
-                        constants.multiline_m3u_pattern
-                        if m3u_type
-                        else constants.multiline_txt_pattern
-                    ),
-                    open_headers=config.open_headers if m3u_type else False
-                )
-                for item in data:
-                    name = item["name"]
-                    url = item["url"]
-                    if name and url:
-                        name = format_channel_name(name)
-                        if names and name not in names:
-                            continue
-                        url_partition = url.partition("$")
-                        url = url_partition[0]
-                        info = url_partition[2]
-                        value = url if multicast else {
-                            "url": url,
-                            "headers": item.get("headers", None),
-                            "extra_info": info
-                        }
-                        if in_whitelist:
-                            value["origin"] = "whitelist"
-                        if hotel:
-                            value["extra_info"] = f"{region}{hotel_name}"
-                        if name in channels:
-                            if multicast:
-                                if value not in channels[name][region][url_type]:
-                                    channels[name][region][url_type].append(value)
-                            elif value not in channels[name]:
-                                channels[name].append(value)
+            data = await fetch_subscribe_data(session, subscribe_url, cache, retry)
+            totals[subscribe_url] = len(data)
+            for item in data:
+                name = item["name"]
+                url = item["url"]
+                if name and url:
+                    name = format_channel_name(name)
+                    if names and name not in names:
+                        continue
+                    url_partition = url.partition("$")
+                    url = url_partition[0]
+                    info = url_partition[2]
+                    value = url if multicast else {
+                        "url": url,
+                        "headers": item.get("headers", None),
+                        "extra_info": info
+                    }
+                    if in_whitelist:
+                        value["origin"] = "whitelist"
+                    if hotel:
+                        value["extra_info"] = f"{region}{hotel_name}"
+                    if name in channels:
+                        if multicast:
+                            if value not in channels[name][region][url_type]:
+                                channels[name][region][url_type].append(value)
+                        elif value not in channels[name]:
+                            channels[name].append(value)
+                    else:
+                        if multicast:
+                            channels[name][region][url_type] = [value]
                         else:
-                            if multicast:
-                                channels[name][region][url_type] = [value]
-                            else:
-                                channels[name] = [value]
+                            channels[name] = [value]
         except Exception as e:
             if error_print:
                 print(f"Error on {subscribe_url}: {e}")
         finally:
-            session.close()
+            limit = score.get_limit(subscribe_url) if score else 0
+            if limit:
+                for name in channels:
+                    channels[name] = channels[name][:limit]
             pbar.update()
             remain = subscribe_urls_len - pbar.n
             if callback:
@@ -128,14 +205,23 @@ async def get_channels_by_subscribe_urls(
                     f"正在获取{mode_name}源, 剩余{remain}个{mode_name}源待获取, 预计剩余时间: {get_pbar_remaining(n=pbar.n, total=pbar.total, start_time=start_time)}",
                     int((pbar.n / subscribe_urls_len) * 100),
                 )
-            return channels
+            return subscribe_url, channels
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [
-            executor.submit(process_subscribe_channels, subscribe_url)
-            for subscribe_url in urls
-        ]
-        for future in futures:
-            subscribe_results = merge_objects(subscribe_results, future.result())
+    async with ClientSession(
+            connector=TCPConnector(ssl=config.subscribe_ssl_verify, limit=config.subscribe_limit),
+            timeout=ClientTimeout(sock_connect=config.request_timeout, sock_read=config.request_timeout),
+            trust_env=True,
+    ) as session:
+        results = await asyncio.gather(
+            *(process_subscribe_channels(session, subscribe_url) for subscribe_url in urls)
+        )
+    for subscribe_url, result in results:
+        if score:
+            score.record_fetch(subscribe_url, total=totals.get(subscribe_url, 0), data=result)
+        subscribe_results = merge_objects(subscribe_results, result)
+    try:
+        save_subscribe_cache(cache)
+    except Exception as e:
+        print(f"Error on saving subscribe cache: {e}")
     pbar.close()
     return subscribe_results
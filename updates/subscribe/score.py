@@ -0,0 +1,177 @@
+import gzip
+import logging
+import os
+import pickle
+from time import time
+
+import utils.constants as constants
+from utils.tools import get_logger
+from utils.url import canonicalize_url
+
+# Weight of the latest run in the smoothed score
+SCORE_ALPHA = 0.5
+
+# A feed is low yield when it keeps less than one url in the results on average
+LOW_YIELD_SCORE = 1
+
+
+def get_info_url(info: str | dict) -> str:
+    """
+    Get the url of the subscribe info, an url or the dict info of the multicast and hotel sources
+    """
+    return info.get("url") if isinstance(info, dict) else info
+
+
+class SubscribeScore:
+    """
+    Yield score of the subscribe urls: how many of their urls are new, pass the speed test and land in the results
+    """
+
+    def __init__(self, skip_runs: int = 5, low_yield_limit: int = 3, whitelist: list[str] = None):
+        self.skip_runs = skip_runs
+        self.low_yield_limit = low_yield_limit
+        self.whitelist = set(whitelist or [])
+        self.scores: dict[str, dict] = self.load()
+        self.stats: dict[str, dict] = {}
+        self.url_feed: dict[str, str] = {}
+        self.skipped: list[str] = []
+
+    @staticmethod
+    def load() -> dict:
+        """
+        Load the scores: url -> runs, score, zero_runs, skipped_runs, last run counts
+        """
+        if os.path.exists(constants.subscribe_score_path):
+            try:
+                with gzip.open(constants.subscribe_score_path, "rb") as file:
+                    return pickle.load(file)
+            except Exception:
+                pass
+        return {}
+
+    def save(self):
+        """
+        Save the scores
+        """
+        os.makedirs(os.path.dirname(constants.subscribe_score_path), exist_ok=True)
+        with gzip.open(constants.subscribe_score_path, "wb") as file:
+            pickle.dump(self.scores, file)
+
+    def get_score(self, url: str) -> float:
+        """
+        Get the smoothed score of the url, unknown feeds go first so they get evaluated
+        """
+        entry = self.scores.get(url)
+        return entry["score"] if entry else float("inf")
+
+    def sort(self, urls: list[str | dict]) -> list[str | dict]:
+        """
+        Sort the urls (or the infos with an url) by the score, drop the chronically useless ones
+        """
+        result = []
+        for info in urls:
+            url = get_info_url(info)
+            if self.should_skip(url):
+                self.skipped.append(url)
+            else:
+                result.append(info)
+        return sorted(result, key=lambda info: self.get_score(get_info_url(info)), reverse=True)
+
+    def should_skip(self, url: str) -> bool:
+        """
+        Skip the url without results for skip_runs runs in a row, retry it after as many skipped runs
+        """
+        entry = self.scores.get(url)
+        if not self.skip_runs or not entry or url in self.whitelist:
+            return False
+        if entry["zero_runs"] >= self.skip_runs and entry["skipped_runs"] < self.skip_runs:
+            entry["skipped_runs"] += 1
+            return True
+        return False
+
+    def get_limit(self, url: str) -> int:
+        """
+        Get the candidate limit per channel of the url, 0 means no limit
+        """
+        entry = self.scores.get(url)
+        if (not entry or url in self.whitelist or entry["runs"] < 2
+                or entry["score"] >= LOW_YIELD_SCORE):
+            return 0
+        return self.low_yield_limit
+
+    def record_fetch(self, url: str, total: int, data: dict):
+        """
+        Record the urls fetched from the subscribe url, the urls not offered by the previous feeds are new
+        """
+        new = 0
+        for values in data.values():
+            for value in values:
+                key = canonicalize_url(value["url"])
+                if key not in self.url_feed:
+                    self.url_feed[key] = url
+                    new += 1
+        self.stats[url] = {"total": total, "new": new, "passed": None, "final": 0}
+
+    def record_passed(self, test_result: dict):
+        """
+        Count the urls of each feed that passed the speed test
+        """
+        if not test_result:
+            return
+        for stats in self.stats.values():
+            stats["passed"] = 0
+        for obj in test_result.values():
+            for values in obj.values():
+                for value in values:
+                    if value.get("delay", -1) == -1:
+                        continue
+                    feed = self.url_feed.get(canonicalize_url(value["url"]))
+                    if feed:
+                        self.stats[feed]["passed"] += 1
+
+    def record_final(self, channel_data: dict, urls_limit: int):
+        """
+        Count the urls of each feed kept in the results
+        """
+        for obj in channel_data.values():
+            for values in obj.values():
+                for value in values[:urls_limit]:
+                    feed = self.url_feed.get(canonicalize_url(value["url"]))
+                    if feed:
+                        self.stats[feed]["final"] += 1
+
+    def update(self):
+        """
+        Update the scores with the counts of this run
+        """
+        now = time()
+        for url, stats in self.stats.items():
+            entry = self.scores.get(url)
+            if entry:
+                entry["score"] = SCORE_ALPHA * stats["final"] + (1 - SCORE_ALPHA) * entry["score"]
+                entry["runs"] += 1
+            else:
+                entry = self.scores[url] = {"score": stats["final"], "runs": 1}
+            entry["zero_runs"] = 0 if stats["final"] else entry.get("zero_runs", 0) + 1
+            entry["skipped_runs"] = 0
+            entry["last"] = stats
+            entry["time"] = now
+
+    def write_log(self):
+        """
+        Write the yield report of the subscribe urls
+        """
+        logger = get_logger(constants.subscribe_log_path, level=logging.INFO, init=True)
+        for url in sorted(self.stats, key=self.get_score, reverse=True):
+            stats = self.stats[url]
+            entry = self.scores.get(url, {})
+            passed = "-" if stats["passed"] is None else stats["passed"]
+            logger.info(
+                f"URL: {url}, Total: {stats['total']}, New: {stats['new']}, Passed: {passed}, Final: {stats['final']}, Score: {entry.get('score', 0):.2f}, Zero runs: {entry.get('zero_runs', 0)}, Limit: {self.get_limit(url) or '-'}"
+            )
+        for url in self.skipped:
+            entry = self.scores[url]
+            logger.info(
+                f"URL: {url}, Skipped: {entry['skipped_runs']}/{self.skip_runs}, Score: {entry['score']:.2f}, Zero runs: {entry['zero_runs']}"
+            )
+        logger.handlers.clear()
@@ -7,15 +7,20 @@ import pickle
 import re
 from collections import defaultdict
 from logging import INFO
+from time import time
 
 from bs4 import NavigableString
 
 import utils.constants as constants
-from updates.epg.tools import write_to_xml, compress_to_gz
+from updates.epg.tools import write_to_xml
 from utils.alias import Alias
 from utils.config import config
 from utils.db import get_db_connection, return_db_connection
+from utils.hls_proxy import is_hls_url
 from utils.ip_checker import IPChecker
+from utils.matcher import KeywordMatcher
+from utils.metrics import speed_test_in_flight, speed_test_concurrency, speed_test_probe_seconds
+from utils.publish import Generation
 from utils.speed import (
     get_speed,
     get_speed_result,
@@ -38,9 +43,12 @@ from utils.tools import (
     get_ip_address,
     convert_to_m3u,
     custom_print,
-    get_name_uri_from_dir, get_resolution_value
+    get_name_uri_from_dir, get_resolution_value,
+    remove_duplicates_from_list,
+    write_file_atomic
 )
 from utils.types import ChannelData, OriginType, CategoryChannelData
+from utils.url import canonicalize_url
 
 channel_alias = Alias()
 ip_checker = IPChecker()
@@ -123,7 +131,7 @@ def get_channel_items() -> CategoryChannelData:
         hls_data = get_name_uri_from_dir(constants.hls_path)
     local_data = get_name_urls_from_file(config.local_file, format_name_flag=True)
     whitelist = get_name_urls_from_file(constants.whitelist_path)
-    whitelist_urls = get_urls_from_file(constants.whitelist_path)
+    whitelist_matcher = KeywordMatcher(get_urls_from_file(constants.whitelist_path))
     whitelist_len = len(list(whitelist.keys()))
     if whitelist_len:
         print(f"Found {whitelist_len} channel in whitelist")
@@ -160,8 +168,8 @@ def get_channel_items() -> CategoryChannelData:
                                                     resolution) < min_resolution_value):
                                                     frozen_channels.add(info["url"])
                                                     continue
-                                                if info["origin"] == "whitelist" and not any(
-                                                        url in info["url"] for url in whitelist_urls):
+                                                if info["origin"] == "whitelist" and not whitelist_matcher.match(
+                                                        info["url"]):
                                                     continue
                                             except:
                                                 pass
@@ -494,8 +502,8 @@ def append_data_to_info_data(
         data: list,
         origin: str = None,
         check: bool = True,
-        whitelist: list = None,
-        blacklist: list = None,
+        whitelist: KeywordMatcher = None,
+        blacklist: KeywordMatcher = None,
         ipv_type_data: dict = None
 ) -> None:
     """
@@ -508,14 +516,14 @@ def append_data_to_info_data(
         data: List of channel items to process
         origin: Default origin for items
         check: Whether to perform validation checks
-        whitelist: List of whitelist keywords
-        blacklist: List of blacklist keywords
+        whitelist: Matcher of whitelist keywords
+        blacklist: Matcher of blacklist keywords
         ipv_type_data: Dictionary to cache IP type information
     """
     init_info_data(info_data, category, name)
 
     channel_list = info_data[category][name]
-    existing_urls = {info["url"] for info in channel_list if "url" in info}
+    existing_urls = {canonicalize_url(info["url"]) for info in channel_list if "url" in info}
 
     for item in data:
         try:
@@ -536,7 +544,8 @@ def append_data_to_info_data(
 
             if not url_origin or not url:
                 continue
-            if url in frozen_channels or (url in existing_urls and (url_origin != "whitelist" and not headers)):
+            url_key = canonicalize_url(url)
+            if url in frozen_channels or (url_key in existing_urls and (url_origin != "whitelist" and not headers)):
                 continue
 
             if not ipv_type:
@@ -567,9 +576,8 @@ def append_data_to_info_data(
                     info_url = info["url"]
                     # Replace if new URL is shorter or has headers
                     if len(info_url) > len(url) or headers:
-                        if url in existing_urls:
-                            existing_urls.remove(url)
-                        existing_urls.add(info_url)
+                        existing_urls.discard(url_key)
+                        existing_urls.add(canonicalize_url(info_url))
                         info_data[category][name][idx] = {
                             "id": channel_id,
                             "url": info_url,
@@ -612,7 +620,7 @@ def append_data_to_info_data(
                     "catchup": catchup,
                     "extra_info": extra_info
                 })
-                existing_urls.add(url)
+                existing_urls.add(url_key)
 
         except Exception as e:
             print(f"Error processing channel data: {e}")
@@ -680,8 +688,8 @@ def append_total_data(
         ("subscribe", subscribe_result),
         ("online_search", online_search_result),
     ]
-    whitelist = get_urls_from_file(constants.whitelist_path)
-    blacklist = get_urls_from_file(constants.blacklist_path, pattern_search=False)
+    whitelist = KeywordMatcher(get_urls_from_file(constants.whitelist_path))
+    blacklist = KeywordMatcher(get_urls_from_file(constants.blacklist_path, pattern_search=False))
     url_hosts_ipv_type = {}
     open_history = config.open_history
     open_local = config.open_local
@@ -711,52 +719,175 @@ def append_total_data(
             print_channel_number(data, cate, name)
 
 
-async def test_speed(data, ipv6=False, callback=None):
+def get_source_candidates(
+        items,
+        result,
+        origin,
+        seen,
+        whitelist=None,
+        blacklist=None,
+        ipv_type_data=None,
+        filter_host=False,
+        ipv6_support=True
+) -> list:
+    """
+    Get the speed test candidates of a source, merged like append_total_data and deduplicated like process_nested_dict,
+    the old data of the channel items is used if the origin is None
+    """
+    data = {}
+    for cate, channel_obj in items:
+        for name, old_info_list in channel_obj.items():
+            values = old_info_list if origin is None else get_channel_results_by_name(name, result)
+            if values:
+                append_data_to_info_data(
+                    data, cate, name, values, origin=origin, whitelist=whitelist, blacklist=blacklist,
+                    ipv_type_data=ipv_type_data
+                )
+    candidates = []
+    for obj in data.values():
+        for values in obj.values():
+            candidates.extend(remove_duplicates_from_list(values, seen, filter_host, ipv6_support))
+    return candidates
+
+
+class SpeedTester:
     """
-    Test speed of channel data
+    Speed test queue shared by the candidates streamed from the sources and the final data,
+    each url (or host with filter_host) is only tested once
     """
-    ipv6_proxy_url = None if (not config.open_ipv6 or ipv6) else constants.ipv6_proxy
-    open_headers = config.open_headers
-    get_resolution = config.open_filter_resolution and check_ffmpeg_installed_status()
-    semaphore = asyncio.Semaphore(config.speed_test_limit)
 
-    async def limited_get_speed(channel_info):
+    def __init__(self, ipv6=False, filter_host=False, ipv6_support=True):
+        self.ipv6_proxy_url = None if (not config.open_ipv6 or ipv6) else constants.ipv6_proxy
+        self.open_headers = config.open_headers
+        self.get_resolution = config.open_filter_resolution and check_ffmpeg_installed_status()
+        self.semaphore = asyncio.Semaphore(config.speed_test_limit)
+        self.in_flight = 0
+        self.filter_host = filter_host
+        self.ipv6_support = ipv6_support
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.seen = set()
+        self.whitelist = None
+        self.blacklist = None
+        self.ipv_type_data = {}
+        self.lock = asyncio.Lock()
+
+    def get_key(self, info) -> str:
+        """
+        Get the key of the info, same as the dedup key of the speed test data
+        """
+        return info["host"] if self.filter_host else canonicalize_url(info["url"])
+
+    async def get_speed(self, info):
+        """
+        Get the speed of the info with rate limiting
+        """
+        async with self.semaphore:
+            headers = (self.open_headers and info.get("headers")) or None
+            self.in_flight += 1
+            speed_test_in_flight.inc()
+            speed_test_concurrency.observe(self.in_flight)
+            start_time = time()
+            result = {}
+            try:
+                result = await get_speed(
+                    info,
+                    headers=headers,
+                    ipv6_proxy=self.ipv6_proxy_url,
+                    filter_resolution=self.get_resolution,
+                )
+                return result
+            finally:
+                self.in_flight -= 1
+                speed_test_in_flight.dec()
+                speed_test_probe_seconds.observe(
+                    time() - start_time, result="ok" if result.get("delay", -1) != -1 else "fail"
+                )
+
+    def submit(self, info) -> asyncio.Task:
+        """
+        Start the speed test of the info, reuse the task of the same key
+        """
+        key = self.get_key(info)
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.create_task(self.get_speed(info))
+        return task
+
+    async def add_source(self, items, method=None, result=None) -> int:
         """
-        Wrapper for get_speed with rate limiting
+        Merge the result of the method (or the old data of the channel items) and start testing the new candidates,
+        return the number of candidates started
         """
-        async with semaphore:
-            headers = (open_headers and channel_info.get("headers")) or None
-            return await get_speed(
-                channel_info,
-                headers=headers,
-                ipv6_proxy=ipv6_proxy_url,
-                filter_resolution=get_resolution,
-                callback=callback,
+        if method:
+            origin = get_origin_method_name(method)
+            if not origin or not result:
+                return 0
+        else:
+            origin = None
+        async with self.lock:
+            if self.whitelist is None:
+                self.whitelist = KeywordMatcher(get_urls_from_file(constants.whitelist_path))
+                self.blacklist = KeywordMatcher(get_urls_from_file(constants.blacklist_path, pattern_search=False))
+            # The merge looks up the ip of each host, keep it off the event loop
+            candidates = await asyncio.to_thread(
+                get_source_candidates, list(items), result, origin, self.seen, self.whitelist, self.blacklist,
+                self.ipv_type_data, self.filter_host, self.ipv6_support
             )
+        for info in candidates:
+            self.submit(info)
+        return len(candidates)
 
-    tasks = []
-    channel_map = {}
+    @property
+    def started(self) -> int:
+        """
+        Number of the urls tested or in progress
+        """
+        return len(self.tasks)
 
-    for cate, channel_obj in data.items():
-        for name, info_list in channel_obj.items():
-            for info in info_list:
-                task = asyncio.create_task(limited_get_speed(info))
-                tasks.append(task)
-                channel_map[task] = (cate, name, info)
+    async def test(self, data, callback=None):
+        """
+        Test speed of channel data, the urls already tested or in progress are not tested again
+        """
+        tasks = []
+        channel_map = {}
+
+        for cate, channel_obj in data.items():
+            for name, info_list in channel_obj.items():
+                for info in info_list:
+                    task = self.submit(info)
+                    if callback:
+                        task.add_done_callback(lambda _: callback())
+                    tasks.append(task)
+                    channel_map[len(tasks) - 1] = (cate, name, info)
+
+        results = await asyncio.gather(*tasks)
 
-    results = await asyncio.gather(*tasks)
+        grouped_results = {}
 
-    grouped_results = {}
+        for index, result in enumerate(results):
+            cate, name, info = channel_map[index]
+            if cate not in grouped_results:
+                grouped_results[cate] = {}
+            if name not in grouped_results[cate]:
+                grouped_results[cate][name] = []
+            grouped_results[cate][name].append({**info, **result})
 
-    for task, result in zip(tasks, results):
-        cate, name, info = channel_map[task]
-        if cate not in grouped_results:
-            grouped_results[cate] = {}
-        if name not in grouped_results[cate]:
-            grouped_results[cate][name] = []
-        grouped_results[cate][name].append({**info, **result})
+        return grouped_results
 
-    return grouped_results
+    def cancel(self):
+        """
+        Cancel the speed tests in progress
+        """
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks = {}
+
+
+async def test_speed(data, ipv6=False, callback=None):
+    """
+    Test speed of channel data
+    """
+    return await SpeedTester(ipv6=ipv6).test(data, callback=callback)
 
 
 def sort_channel_result(channel_data, result=None, filter_host=False, ipv6_support=True):
@@ -794,8 +925,7 @@ def sort_channel_result(channel_data, result=None, filter_host=False, ipv6_suppo
     return channel_result
 
 
-def process_write_content(
-        path: str,
+def get_write_content(
         data: CategoryChannelData,
         live: bool = False,
         hls: bool = False,
@@ -804,12 +934,13 @@ def process_write_content(
         open_empty_category: bool = False,
         ipv_type_prefer: list[str] = None,
         origin_type_prefer: list[str] = None,
-        first_channel_name: str = None,
+        limit: int = None,
+        update_time: str = None,
+        proxy_url: str = None,
         enable_print: bool = False
-):
+) -> tuple[str, dict[str, list[ChannelData]]]:
     """
-    Get channel write content
-    :param path: write into path
+    Get channel write content and the written urls by the channel name
     :param live: all live channel url
     :param hls: all hls channel url
     :param live_url: live url
@@ -817,7 +948,9 @@ def process_write_content(
     :param open_empty_category: show empty category
     :param ipv_type_prefer: ipv type prefer
     :param origin_type_prefer: origin type prefer
-    :param first_channel_name: the first channel name
+    :param limit: the max number of urls per channel, the urls limit if None
+    :param update_time: the update time to show, now if None
+    :param proxy_url: hls proxy url, the hls urls point to it if given
     """
     content = ""
     no_result_name = []
@@ -835,7 +968,7 @@ def process_write_content(
         names_len = len(list(channel_obj_keys))
         for i, name in enumerate(channel_obj_keys):
             info_list = data.get(cate, {}).get(name, [])
-            channel_urls = get_total_urls(info_list, ipv_type_prefer, origin_type_prefer, rtmp_type)
+            channel_urls = get_total_urls(info_list, ipv_type_prefer, origin_type_prefer, rtmp_type)[:limit]
             result_data[name].extend(channel_urls)
             end_char = ", " if i < names_len - 1 else ""
             custom_print(f"{name}:", len(channel_urls), end=end_char)
@@ -853,7 +986,12 @@ def process_write_content(
                 item_url = item["url"]
                 if open_url_info and item["extra_info"]:
                     item_url = add_url_info(item_url, item["extra_info"])
-                total_item_url = f"{rtmp_url or item_rtmp_url}{item['id']}" if rtmp_url or item_rtmp_url else item_url
+                if rtmp_url or item_rtmp_url:
+                    total_item_url = f"{rtmp_url or item_rtmp_url}{item['id']}"
+                elif proxy_url and is_hls_url(item["url"]):
+                    total_item_url = f"{proxy_url}{item['id']}/index.m3u8"
+                else:
+                    total_item_url = item_url
                 content += f"\n{name},{total_item_url}"
         custom_print()
     if open_empty_category and no_result_name:
@@ -871,7 +1009,7 @@ def process_write_content(
              if (urls := get_total_urls(info_list, ipv_type_prefer, origin_type_prefer, rtmp_type))),
             {"id": "id", "url": "url"}
         )
-        now = get_datetime_now()
+        now = update_time or get_datetime_now()
         update_time_item_url = update_time_item["url"]
         if open_url_info and update_time_item["extra_info"]:
             update_time_item_url = add_url_info(update_time_item_url, update_time_item["extra_info"])
@@ -880,28 +1018,86 @@ def process_write_content(
             content = f"🕘️更新时间,#genre#\n{now},{value}\n\n{content}"
         else:
             content += f"\n\n🕘️更新时间,#genre#\n{now},{value}"
-    if rtmp_url:
-        conn = get_db_connection(constants.rtmp_data_path)
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "CREATE TABLE IF NOT EXISTS result_data (id TEXT PRIMARY KEY, url TEXT, headers TEXT)"
-            )
-            for data_list in result_data.values():
-                for item in data_list:
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO result_data (id, url, headers) VALUES (?, ?, ?)",
-                        (item["id"], item["url"], json.dumps(item.get("headers", None)))
-                    )
-            conn.commit()
-        finally:
-            return_db_connection(constants.rtmp_data_path, conn)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+    return content, result_data
+
+
+def process_write_content(
+        path: str,
+        data: CategoryChannelData,
+        live: bool = False,
+        hls: bool = False,
+        live_url: str = None,
+        hls_url: str = None,
+        open_empty_category: bool = False,
+        ipv_type_prefer: list[str] = None,
+        origin_type_prefer: list[str] = None,
+        first_channel_name: str = None,
+        update_time: str = None,
+        proxy_url: str = None,
+        enable_print: bool = False
+):
+    """
+    Write channel content to the path and its m3u file
+    :param path: write into path
+    :param first_channel_name: the first channel name
+    """
+    content, result_data = get_write_content(
+        data=data,
+        live=live,
+        hls=hls,
+        live_url=live_url,
+        hls_url=hls_url,
+        open_empty_category=open_empty_category,
+        ipv_type_prefer=ipv_type_prefer,
+        origin_type_prefer=origin_type_prefer,
+        update_time=update_time,
+        proxy_url=proxy_url,
+        enable_print=enable_print
+    )
+    write_file_atomic(path, content)
     convert_to_m3u(path, first_channel_name, data=result_data)
 
 
-def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None):
+def write_rtmp_data(data: CategoryChannelData):
+    """
+    Write the url and the headers of every channel item by id, for the live, hls and proxy urls
+    of the result files and of the playlists rendered by the service from the same data
+    """
+    conn = get_db_connection(constants.rtmp_data_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS result_data (id TEXT PRIMARY KEY, url TEXT, headers TEXT)"
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO result_data (id, url, headers) VALUES (?, ?, ?)",
+            (
+                (item["id"], item["url"], json.dumps(item.get("headers", None)))
+                for channel_obj in data.values()
+                for info_list in channel_obj.values()
+                for item in info_list
+                if item.get("id") is not None and item.get("url")
+            )
+        )
+        conn.commit()
+    finally:
+        return_db_connection(constants.rtmp_data_path, conn)
+
+
+def write_result_data(data, ipv6=False, first_channel_name=None, update_time=None, path=constants.result_data_path):
+    """
+    Write the sorted channel data for the result index of the service
+    """
+    result = {
+        "data": {cate: dict(channel_obj) for cate, channel_obj in data.items()},
+        "ipv6": ipv6,
+        "first_channel_name": first_channel_name,
+        "update_time": update_time,
+    }
+    write_file_atomic(path, gzip.compress(pickle.dumps(result), mtime=0))
+
+
+def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None, update_time=None, enable_print=True):
     """
     Write channel to file
     """
@@ -918,9 +1114,10 @@ def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None):
         ]
         for dir_name in dir_list:
             os.makedirs(dir_name, exist_ok=True)
+        generation = Generation()
+        stage = generation.stage
         if epg:
-            write_to_xml(epg, constants.epg_result_path)
-            compress_to_gz(constants.epg_result_path, constants.epg_gz_result_path)
+            write_to_xml(epg, stage(constants.epg_result_path), gz_path=stage(constants.epg_gz_result_path))
         open_empty_category = config.open_empty_category
         ipv_type_prefer = list(config.ipv_type_prefer)
         if any(pref in ipv_type_prefer for pref in ["自动", "auto"]):
@@ -929,6 +1126,17 @@ def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None):
         address = get_ip_address()
         live_url = f"{address}/live/"
         hls_url = f"{address}/hls/"
+        proxy_url = f"{address}/proxy/" if config.open_hls_proxy else None
+        update_time = update_time or get_datetime_now()
+        write_result_data(
+            data,
+            ipv6=ipv6,
+            first_channel_name=first_channel_name,
+            update_time=update_time,
+            path=stage(constants.result_data_path)
+        )
+        if config.open_rtmp or proxy_url:
+            write_rtmp_data(data)
         file_list = [
             {"path": config.final_file, "enable_log": True},
             {"path": constants.ipv4_result_path, "ipv_type_prefer": ["ipv4"]},
@@ -961,7 +1169,7 @@ def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None):
             ]
         for file in file_list:
             process_write_content(
-                path=file["path"],
+                path=stage(file["path"]),
                 data=data,
                 live=file.get("live", False),
                 hls=file.get("hls", False),
@@ -971,8 +1179,11 @@ def write_channel_to_file(data, epg=None, ipv6=False, first_channel_name=None):
                 ipv_type_prefer=file.get("ipv_type_prefer", ipv_type_prefer),
                 origin_type_prefer=origin_type_prefer,
                 first_channel_name=first_channel_name,
-                enable_print=file.get("enable_log", False),
+                update_time=update_time,
+                proxy_url=proxy_url,
+                enable_print=enable_print and file.get("enable_log", False),
             )
+        generation.publish(update_time=update_time)
         print("✅ Write channel to file success")
     except Exception as e:
         print(f"❌ Write channel to file failed: {e}")
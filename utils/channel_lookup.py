@@ -0,0 +1,69 @@
+import json
+import os
+import sqlite3
+from contextlib import closing
+from threading import Lock
+from time import time
+
+# Min seconds between two checks of the data file for changes
+CHECK_INTERVAL = 1
+
+
+class ChannelLookup:
+    """
+    In-memory table of the result channels by id: url and headers, loaded from the SQLite result data
+    and reloaded once the file changed, so a lookup is a dict access
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.key = None
+        self.checked_at = 0
+        self.channels: dict[str, dict] = {}
+        self.lock = Lock()
+
+    def load(self) -> dict[str, dict]:
+        """
+        Load the channels of the result data
+        """
+        with closing(sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=10)) as conn:
+            rows = conn.execute("SELECT id, url, headers FROM result_data").fetchall()
+        return {
+            str(channel_id): {'url': url, 'headers': json.loads(headers) if headers else None}
+            for channel_id, url, headers in rows
+        }
+
+    def refresh(self, force: bool = False):
+        """
+        Reload the table if the data file changed, checked at most once per interval unless forced
+        """
+        now = time()
+        if not force and now - self.checked_at < CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            key = None
+        if key == self.key:
+            return
+        with self.lock:
+            if key == self.key:
+                return
+            try:
+                self.channels = self.load() if key else {}
+            except sqlite3.Error as e:
+                print(f"❌ Error loading the channel data: {e}")
+            self.key = key
+
+    def get(self, channel_id: str) -> dict:
+        """
+        Get the url and the headers of the channel, empty if not found
+        """
+        self.refresh()
+        data = self.channels.get(channel_id)
+        if data is None:
+            self.refresh(force=True)
+            data = self.channels.get(channel_id)
+        return data or {}
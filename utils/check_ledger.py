@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from time import time
+
+
+class CheckLedger:
+    """
+    Persistent ledger of the stream check results, used to skip the urls checked recently
+    """
+
+    def __init__(self, path: str, healthy_ttl: int = 6 * 3600, dead_ttl: int = 3600,
+                 max_dead_ttl: int = 7 * 24 * 3600):
+        self.path = path
+        self.healthy_ttl = healthy_ttl
+        self.dead_ttl = dead_ttl
+        self.max_dead_ttl = max_dead_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ledger (
+                url TEXT PRIMARY KEY,
+                success INTEGER NOT NULL,
+                delay REAL,
+                width INTEGER,
+                height INTEGER,
+                checked_at REAL NOT NULL,
+                failures INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def get_ttl(self, success: bool, failures: int) -> float:
+        """
+        Get the ttl of the entry, the ttl of the dead url doubles with each consecutive failure
+        """
+        if success:
+            return self.healthy_ttl
+        return min(self.dead_ttl * 2 ** max(failures - 1, 0), self.max_dead_ttl)
+
+    def split(self, urls: list[str], now: float = None) -> tuple[dict[str, dict], list[str]]:
+        """
+        Split the urls into the fresh results from the ledger and the urls to check
+        """
+        now = now or time()
+        fresh = {}
+        stale = []
+        for url in urls:
+            row = self.conn.execute(
+                "SELECT success, delay, width, height, checked_at, failures FROM ledger WHERE url = ?", (url,)
+            ).fetchone()
+            if row:
+                success, delay, width, height, checked_at, failures = row
+                if now - checked_at < self.get_ttl(success, failures):
+                    fresh[url] = {"url": url, "success": bool(success), "delay": delay, "width": width,
+                                  "height": height, "error": None}
+                    continue
+            stale.append(url)
+        return fresh, stale
+
+    def update(self, results: list[dict], now: float = None):
+        """
+        Record the check results, count the consecutive failures of the dead urls
+        """
+        now = now or time()
+        self.conn.executemany(
+            """
+            INSERT INTO ledger (url, success, delay, width, height, checked_at, failures)
+            VALUES (:url, :success, :delay, :width, :height, :now, :failures)
+            ON CONFLICT(url) DO UPDATE SET
+                success = excluded.success,
+                delay = excluded.delay,
+                width = excluded.width,
+                height = excluded.height,
+                checked_at = excluded.checked_at,
+                failures = CASE WHEN excluded.success THEN 0 ELSE ledger.failures + 1 END
+            """,
+            [{**result, "success": int(result["success"]), "now": now, "failures": int(not result["success"])}
+             for result in results],
+        )
+        self.conn.commit()
+
+    def prune(self, max_age: float, now: float = None) -> int:
+        """
+        Remove the entries not checked within max_age seconds, return the number removed
+        """
+        now = now or time()
+        cursor = self.conn.execute("DELETE FROM ledger WHERE checked_at < ?", (now - max_age,))
+        self.conn.commit()
+        return cursor.rowcount
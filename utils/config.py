@@ -141,6 +141,22 @@ class ConfigManager:
     def subscribe_num(self):
         return self.config.getint("Settings", "subscribe_num", fallback=10)
 
+    @property
+    def subscribe_limit(self):
+        return self.config.getint("Settings", "subscribe_limit", fallback=10)
+
+    @property
+    def subscribe_low_yield_limit(self):
+        return self.config.getint("Settings", "subscribe_low_yield_limit", fallback=3)
+
+    @property
+    def subscribe_skip_runs(self):
+        return self.config.getint("Settings", "subscribe_skip_runs", fallback=5)
+
+    @property
+    def subscribe_ssl_verify(self):
+        return self.config.getboolean("Settings", "subscribe_ssl_verify", fallback=True)
+
     @property
     def online_search_num(self):
         return self.config.getint("Settings", "online_search_num", fallback=10)
@@ -184,6 +200,14 @@ class ConfigManager:
     def open_url_info(self):
         return self.config.getboolean("Settings", "open_url_info", fallback=True)
 
+    @property
+    def epg_past_days(self):
+        return self.config.getint("Settings", "epg_past_days", fallback=1)
+
+    @property
+    def epg_future_days(self):
+        return self.config.getint("Settings", "epg_future_days", fallback=3)
+
     @property
     def recent_days(self):
         return self.config.getint("Settings", "recent_days", fallback=30)
@@ -319,6 +343,14 @@ class ConfigManager:
     def app_port(self):
         return os.getenv("APP_PORT") or self.config.getint("Settings", "app_port", fallback=8000)
 
+    @property
+    def app_workers(self):
+        return int(os.getenv("APP_WORKERS") or self.config.getint("Settings", "app_workers", fallback=4))
+
+    @property
+    def app_keepalive(self):
+        return self.config.getint("Settings", "app_keepalive", fallback=5)
+
     @property
     def open_supply(self):
         return self.config.getboolean("Settings", "open_supply", fallback=True)
@@ -355,6 +387,46 @@ class ConfigManager:
     def open_rtmp(self):
         return not os.getenv("GITHUB_ACTIONS") and self.config.getboolean("Settings", "open_rtmp", fallback=True)
 
+    @property
+    def open_hls_proxy(self):
+        return not os.getenv("GITHUB_ACTIONS") and self.config.getboolean("Settings", "open_hls_proxy", fallback=False)
+
+    @property
+    def hls_proxy_cache_size(self):
+        return self.config.getint("Settings", "hls_proxy_cache_size", fallback=256)
+
+    @property
+    def publish_generations(self):
+        return self.config.getint("Settings", "publish_generations", fallback=3)
+
+    @property
+    def open_revalidate(self):
+        return self.config.getboolean("Settings", "open_revalidate", fallback=False)
+
+    @property
+    def revalidate_concurrency(self):
+        return max(self.config.getint("Settings", "revalidate_concurrency", fallback=2), 1)
+
+    @property
+    def revalidate_interval(self):
+        return self.config.getint("Settings", "revalidate_interval", fallback=10)
+
+    @property
+    def rtmp_idle_timeout(self):
+        return self.config.getint("Settings", "rtmp_idle_timeout", fallback=60)
+
+    @property
+    def rtmp_max_streams(self):
+        return self.config.getint("Settings", "rtmp_max_streams", fallback=10)
+
+    @property
+    def rtmp_prewarm_num(self):
+        return self.config.getint("Settings", "rtmp_prewarm_num", fallback=0)
+
+    @property
+    def rtmp_stat_url(self):
+        return self.config.get("Settings", "rtmp_stat_url", fallback="http://localhost:8080/stat")
+
     @property
     def open_headers(self):
         return self.config.getboolean("Settings", "open_headers", fallback=False)
@@ -43,8 +43,38 @@ hls_ipv6_result_path = os.path.join(output_dir, "ipv6/hls.txt")
 
 cache_path = os.path.join(output_dir, "data/cache.pkl.gz")
 
+subscribe_cache_path = os.path.join(output_dir, "data/subscribe_cache.pkl.gz")
+
+subscribe_score_path = os.path.join(output_dir, "data/subscribe_score.pkl.gz")
+
+epg_cache_path = os.path.join(output_dir, "data/epg_cache.pkl.gz")
+
+streams_path = os.path.join(output_dir, "data/streams.db")
+
+result_data_path = os.path.join(output_dir, "data/result.pkl.gz")
+
+play_reports_path = os.path.join(output_dir, "data/play_reports.db")
+
+metrics_path = os.path.join(output_dir, "data/metrics")
+
+manifest_path = os.path.join(output_dir, "data/manifest.json")
+
+generations_path = os.path.join(output_dir, "data/generations")
+
+update_done_path = os.path.join(output_dir, "data/update_done")
+
+service_lock_path = os.path.join(output_dir, "data/service.lock")
+
+secret_key_path = os.path.join(output_dir, "data/secret.key")
+
 result_log_path = os.path.join(output_dir, "log/result.log")
 
+subscribe_log_path = os.path.join(output_dir, "log/subscribe.log")
+
+log_chunk_size = 4 * 1024 * 1024
+
+log_backup_count = 50
+
 log_path = os.path.join(output_dir, "log/log.log")
 
 url_host_pattern = re.compile(r"((https?|rtmp|rtsp)://)?([^:@/]+(:[^:@/]*)?@)?(\[[0-9a-fA-F:]+]|([\w-]+\.)+[\w-]+)")
@@ -0,0 +1,190 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from threading import Lock
+
+import pytz
+
+# The space left of a positive offset after the time, the "+" of an unencoded query is decoded as a space
+offset_space_pattern = re.compile(r"(:\d{2}(?:\.\d+)?|^\d{14}) (\d{2}:?\d{2})$")
+
+
+def parse_xmltv_time(value: str) -> float:
+    """
+    Parse the xmltv time, e.g. 20240101120000 +0800, to a timestamp
+    """
+    return datetime.strptime(value.replace(" ", ""), "%Y%m%d%H%M%S%z").timestamp()
+
+
+def parse_query_time(value: str, time_zone: str) -> float:
+    """
+    Parse the time of a query to a timestamp: unix timestamp, ISO 8601 or xmltv format,
+    the time without offset is in the time zone
+    """
+    if value.isdigit() and len(value) != 14:
+        return float(value)
+    value = offset_space_pattern.sub(r"\1+\2", value)
+    try:
+        return parse_xmltv_time(value)
+    except ValueError:
+        pass
+    if value.isdigit():
+        date = datetime.strptime(value, "%Y%m%d%H%M%S")
+    else:
+        date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = pytz.timezone(time_zone).localize(date)
+    return date.timestamp()
+
+
+def format_timestamp(value: float) -> str:
+    """
+    Format the timestamp as ISO 8601 in UTC
+    """
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+class ChannelProgrammes:
+    """
+    Programmes of a channel sorted by the start time
+    """
+
+    def __init__(self, items: list[tuple[float, float, str]]):
+        items.sort()
+        self.starts = [item[0] for item in items]
+        self.stops = [item[1] for item in items]
+        self.titles = [item[2] for item in items]
+        # Running max of the stops, monotonic even if the programmes overlap
+        self.max_stops = []
+        max_stop = float("-inf")
+        for stop in self.stops:
+            max_stop = max(max_stop, stop)
+            self.max_stops.append(max_stop)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_item(self, index: int) -> dict:
+        """
+        Get the programme at the index
+        """
+        return {
+            "title": self.titles[index],
+            "start": format_timestamp(self.starts[index]),
+            "stop": format_timestamp(self.stops[index]),
+        }
+
+    def now_next(self, at: float) -> dict:
+        """
+        Get the programme playing at the time and the next one
+        """
+        index = bisect_right(self.starts, at)
+        now = index - 1 if index and self.stops[index - 1] > at else None
+        return {
+            "now": self.get_item(now) if now is not None else None,
+            "next": self.get_item(index) if index < len(self) else None,
+        }
+
+    def between(self, start: float, end: float) -> list[dict]:
+        """
+        Get the programmes overlapping the time range
+        """
+        first = bisect_right(self.max_stops, start)
+        last = bisect_left(self.starts, end)
+        return [self.get_item(index) for index in range(first, last) if self.stops[index] > start]
+
+
+class EpgIndex:
+    """
+    In-memory index of the epg result, reloaded when the file changes
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.channels: dict[str, ChannelProgrammes] = {}
+        self.lookup: dict[str, str] = {}
+        self.lock = Lock()
+
+    def load(self):
+        """
+        Load the epg result file into the index
+        """
+        programmes: dict[str, list] = {}
+        context = ET.iterparse(self.path, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event != "end":
+                continue
+            if elem.tag == "channel":
+                programmes.setdefault(elem.get("id"), [])
+                root.clear()
+            elif elem.tag == "programme":
+                try:
+                    item = (parse_xmltv_time(elem.get("start")), parse_xmltv_time(elem.get("stop")),
+                            elem.findtext("title") or "")
+                except (AttributeError, ValueError):
+                    item = None
+                if item:
+                    programmes.setdefault(elem.get("channel"), []).append(item)
+                root.clear()
+        channels = {name: ChannelProgrammes(items) for name, items in programmes.items()}
+        self.channels = channels
+        self.lookup = {name.lower(): name for name in channels}
+
+    def refresh(self):
+        """
+        Reload the index if the epg result file changed
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            if mtime is None:
+                self.channels, self.lookup = {}, {}
+            else:
+                try:
+                    self.load()
+                except (ET.ParseError, OSError) as e:
+                    print(f"❌ Error loading the epg index: {e}")
+                    return
+            self.mtime = mtime
+
+    def get_channel(self, name: str) -> ChannelProgrammes | None:
+        """
+        Get the programmes of the channel, the name is case-insensitive
+        """
+        channel = self.channels.get(name)
+        if channel is None:
+            key = self.lookup.get(name.lower())
+            channel = self.channels.get(key) if key else None
+        return channel
+
+    def now_next(self, names: list[str], at: float) -> dict:
+        """
+        Get the now and next programmes of the channels, None for the unknown channels
+        """
+        self.refresh()
+        result = {}
+        for name in names:
+            channel = self.get_channel(name)
+            result[name] = channel.now_next(at) if channel else None
+        return result
+
+    def between(self, names: list[str], start: float, end: float) -> dict:
+        """
+        Get the programmes of the channels overlapping the time range, None for the unknown channels
+        """
+        self.refresh()
+        result = {}
+        for name in names:
+            channel = self.get_channel(name)
+            result[name] = channel.between(start, end) if channel else None
+        return result
@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from threading import Event, Lock
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+from utils.metrics import count_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+# The levels past these spend several times the cpu for a few percent smaller bodies
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class CachedFile:
+    """
+    Content of a file with its precompressed variants and validators
+    """
+
+    def __init__(self, path: str, stat: os.stat_result, data: bytes):
+        self.path = path
+        self.key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        self.data = data
+        self.etag = hashlib.md5(data).hexdigest()
+        self.mtime = stat.st_mtime
+        self.last_modified = http_date(stat.st_mtime)
+        self.variants = {}
+        if len(data) >= COMPRESS_MIN_SIZE and not path.endswith(".gz"):
+            self.variants["gzip"] = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+            if brotli:
+                self.variants["br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+class FileCache:
+    """
+    In-memory cache of the result files, an entry is replaced as a whole once the file changes on disk
+    """
+
+    def __init__(self):
+        self.entries: dict[str, CachedFile] = {}
+        self.pending: dict[str, Event] = {}
+        self.lock = Lock()
+
+    def get(self, path: str, source: str = None) -> CachedFile | None:
+        """
+        Get the cached file, reload it if the file changed, None if it does not exist,
+        the content is read from the source file if given, as the published file of the path.
+        A path is loaded by one thread at a time, outside the lock so the other paths are still served
+        """
+        source = source or path
+        try:
+            stat = os.stat(source)
+        except OSError:
+            self.entries.pop(path, None)
+            return None
+        entry = self.entries.get(path)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if entry and entry.key == key:
+            count_cache("result_file", True)
+            return entry
+        count_cache("result_file", False)
+        while True:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry and entry.key == key:
+                    return entry
+                event = self.pending.get(path)
+                if event is None:
+                    event = self.pending[path] = Event()
+                    break
+            event.wait()
+        try:
+            with open(source, "rb") as file:
+                data = file.read()
+            entry = self.entries[path] = CachedFile(path, stat, data)
+            return entry
+        except OSError:
+            return None
+        finally:
+            with self.lock:
+                self.pending.pop(path, None)
+            event.set()
+
+    def clear(self):
+        """
+        Drop all the entries, they are reloaded on the next request
+        """
+        self.entries = {}
+
+
+def get_accept_encoding(entry: CachedFile) -> str | None:
+    """
+    Choose the content encoding of the response by the Accept-Encoding of the request
+    """
+    best, best_quality = None, 0
+    for encoding in ("br", "gzip"):
+        quality = request.accept_encodings[encoding]
+        if encoding in entry.variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def make_file_response(entry: CachedFile, mimetype: str = "text/plain", as_attachment: bool = False) -> Response:
+    """
+    Make the response of the cached file, honoring the conditional request and the Accept-Encoding
+    """
+    encoding = get_accept_encoding(entry)
+    etag = f"{entry.etag}-{encoding}" if encoding else entry.etag
+    if as_attachment:
+        mimetype = mimetypes.guess_type(entry.path)[0] or "application/octet-stream"
+    not_modified = (
+        request.if_none_match.contains(etag) if request.if_none_match
+        else bool(request.if_modified_since) and request.if_modified_since.timestamp() >= int(entry.mtime)
+    )
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(entry.variants[encoding] if encoding else entry.data, mimetype=mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if as_attachment:
+            response.headers["Content-Disposition"] = f"attachment; filename={os.path.basename(entry.path)}"
+    response.set_etag(etag)
+    response.headers["Last-Modified"] = entry.last_modified
+    response.headers["Cache-Control"] = "no-cache"
+    if entry.variants:
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+result_file_cache = FileCache()
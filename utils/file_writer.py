@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+
+# Lines holding the run time, left out of the comparison with TIME_LINE_PATTERN so a new run time alone
+# does not rewrite the file
+TIME_LINE_PATTERN = r"\d{8} \d{2}:\d{2}:\d{2}|^\d{8}-\d{6}$|^CheckTime："
+
+# Bytes read at once when hashing a file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class WriteStats:
+    """
+    Files and bytes written or skipped as unchanged in the run
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.written = 0
+        self.written_bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+
+    def add(self, written: bool, size: int):
+        if written:
+            self.written += 1
+            self.written_bytes += size
+        else:
+            self.skipped += 1
+            self.skipped_bytes += size
+
+    def report(self):
+        print(
+            f"📝 Output files written: {self.written} ({self.written_bytes} bytes), "
+            f"skipped unchanged: {self.skipped} ({self.skipped_bytes} bytes)"
+        )
+
+
+write_stats = WriteStats()
+
+
+def get_content_hash(data: bytes, ignore: str = None) -> str:
+    """
+    Get the hash of the content, without the lines matching the ignore pattern
+    """
+    if ignore:
+        pattern = re.compile(ignore.encode("utf-8"))
+        data = b"\n".join(line for line in data.split(b"\n") if not pattern.search(line.rstrip(b"\r")))
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_file_hash(path: str, ignore: str = None) -> str | None:
+    """
+    Get the hash of the file content, None if it does not exist
+    """
+    try:
+        if ignore:
+            with open(path, "rb") as f:
+                return get_content_hash(f.read(), ignore)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                digest.update(block)
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def write_if_changed(path: str, content: str | bytes, ignore: str = None, compare_path: str = None) -> bool:
+    """
+    Write the content through a temp file unless the file (or the compare path) already holds it,
+    the lines matching the ignore pattern are not compared, return whether the file was written
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    compare_path = compare_path or path
+    unchanged = False
+    if os.path.exists(compare_path):
+        if ignore:
+            unchanged = get_file_hash(compare_path, ignore) == get_content_hash(data, ignore)
+        else:
+            unchanged = os.path.getsize(compare_path) == len(data) and \
+                        get_file_hash(compare_path) == get_content_hash(data)
+    if not unchanged:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    write_stats.add(not unchanged, len(data))
+    return not unchanged
+
+
+def write_lines_if_changed(path: str, lines: list[str], ignore: str = None, compare_path: str = None) -> bool:
+    """
+    Write the lines, each followed by a newline, unless unchanged
+    """
+    return write_if_changed(path, "".join(f"{line}\n" for line in lines), ignore, compare_path)
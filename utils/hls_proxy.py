@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+from collections import OrderedDict
+from threading import Lock, Event
+from time import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+from utils.config import config
+from utils.metrics import count_cache
+
+# Seconds an upstream playlist is shared by the viewers before it is fetched again
+PLAYLIST_TTL = 1
+
+uri_attr_pattern = re.compile(r'URI="([^"]*)"')
+
+
+def is_hls_url(url: str) -> bool:
+    """
+    Check if the url is a hls playlist by its path
+    """
+    return urlsplit(url.partition("$")[0]).path.lower().endswith(".m3u8")
+
+
+class ByteLRU:
+    """
+    LRU cache bounded by the total size of the values in bytes
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.items: OrderedDict[str, tuple[bytes, tuple, float]] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: str) -> tuple[bytes, tuple, float] | None:
+        """
+        Get the value, its meta and the time it was set
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item:
+                self.items.move_to_end(key)
+            return item
+
+    def set(self, key: str, data: bytes, meta: tuple):
+        """
+        Set the value, the least recently used values are evicted, a value bigger than the cache is not kept
+        """
+        if len(data) > self.max_size:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old:
+                self.size -= len(old[0])
+            self.items[key] = (data, meta, time())
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, (evicted, _, _) = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class HlsProxy:
+    """
+    Caching relay of the hls channels: the playlists are rewritten to point to the proxy and each upstream
+    playlist or segment is fetched once for all the concurrent viewers of the service process
+    """
+
+    def __init__(self, get_channel_data, max_size: int, key: bytes = None):
+        self.get_channel_data = get_channel_data
+        self.cache = ByteLRU(max_size)
+        self.pending: dict[str, Event] = {}
+        self.lock = Lock()
+        # The key is shared by the workers, a playlist and its segments may be served by different ones
+        self.key = key or os.urandom(16)
+        self.session = requests.Session()
+
+    def sign(self, url: str) -> str:
+        """
+        Encode the upstream url as a token, signed so the proxy only fetches the urls of the playlists it served
+        """
+        data = base64.urlsafe_b64encode(url.encode("utf-8")).decode().rstrip("=")
+        digest = hmac.new(self.key, url.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+        return f"{digest}{data}"
+
+    def verify(self, token: str) -> str | None:
+        """
+        Decode the upstream url of the token without the extension, None if it is not signed by this proxy
+        """
+        digest, data = token[:16], token[16:]
+        try:
+            url = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)).decode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            return None
+        expected = hmac.new(self.key, url.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+        return url if hmac.compare_digest(digest, expected) else None
+
+    def fetch(self, key: str, url: str, headers: dict = None, ttl: float = None) -> tuple[bytes, str, str]:
+        """
+        Get the upstream resource from the cache or fetch it, the concurrent requests of the same key
+        wait for a single fetch, return the content, the content type and the final url
+        """
+        while True:
+            item = self.cache.get(key)
+            if item and (ttl is None or time() - item[2] < ttl):
+                count_cache("hls_proxy", True)
+                return item[0], *item[1]
+            with self.lock:
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = Event()
+                    break
+            event.wait(config.request_timeout)
+        count_cache("hls_proxy", False)
+        try:
+            response = self.session.get(url, headers=headers, timeout=config.request_timeout)
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip() or \
+                           mimetypes.guess_type(urlsplit(url).path)[0] or "application/octet-stream"
+            self.cache.set(key, response.content, (content_type, response.url))
+            return response.content, content_type, response.url
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+            event.set()
+
+    def rewrite(self, content: str, base_url: str) -> str:
+        """
+        Rewrite the uris of the playlist to the proxy, the uris following a stream info are playlists
+        """
+        lines = []
+        next_is_playlist = False
+
+        def proxy_uri(uri: str, playlist: bool = False) -> str:
+            target = urljoin(base_url, uri)
+            suffix = ".m3u8" if playlist else os.path.splitext(urlsplit(target).path)[1][:8]
+            return f"{self.sign(target)}{suffix}"
+
+        for line in content.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                lines.append(line)
+            elif stripped.startswith("#"):
+                if stripped.startswith("#EXT-X-STREAM-INF"):
+                    next_is_playlist = True
+                playlist_tag = stripped.startswith(("#EXT-X-MEDIA", "#EXT-X-I-FRAME-STREAM-INF"))
+                lines.append(uri_attr_pattern.sub(
+                    lambda m: f'URI="{proxy_uri(m.group(1), playlist_tag)}"', line
+                ))
+            else:
+                lines.append(proxy_uri(stripped, next_is_playlist or is_hls_url(stripped)))
+                next_is_playlist = False
+        return "\n".join(lines) + "\n"
+
+    def get_channel(self, channel_id: str) -> tuple[str | None, dict | None]:
+        """
+        Get the upstream url and the headers of the channel
+        """
+        data = self.get_channel_data(channel_id)
+        url = data.get("url", "")
+        return url.partition("$")[0] if url else None, data.get("headers")
+
+    def get_playlist(self, channel_id: str, token: str = None) -> str | None:
+        """
+        Get the rewritten playlist of the channel, or the nested playlist of the token
+        """
+        url, headers = self.get_channel(channel_id)
+        if token:
+            url = self.verify(token)
+        if not url:
+            return None
+        content, _, final_url = self.fetch(f"playlist:{url}", url, headers, ttl=PLAYLIST_TTL)
+        return self.rewrite(content.decode("utf-8", errors="replace"), final_url)
+
+    def get_segment(self, channel_id: str, token: str) -> tuple[bytes, str] | None:
+        """
+        Get the segment of the token, shared by all the viewers
+        """
+        url = self.verify(token)
+        if not url:
+            return None
+        _, headers = self.get_channel(channel_id)
+        content, content_type, _ = self.fetch(f"segment:{url}", url, headers)
+        return content, content_type
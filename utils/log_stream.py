@@ -0,0 +1,127 @@
+import os
+import zlib
+
+from flask import Response, request
+
+import utils.constants as constants
+from utils.file_cache import COMPRESS_MIN_SIZE
+
+# Bytes read at once when streaming or tailing the log
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def get_log_files(path: str) -> list[str]:
+    """
+    Get the rotated chunks of the log and the live file, the oldest first
+    """
+    chunks = [f"{path}.{i}" for i in range(constants.log_backup_count, 0, -1)]
+    return [file for file in chunks + [path] if os.path.exists(file)]
+
+
+class LogView:
+    """
+    The chunks of the log opened at once and read as a single file, the rotation during a read
+    does not move the content under it
+    """
+
+    def __init__(self, path: str):
+        self.files = []
+        for file in get_log_files(path):
+            try:
+                self.files.append(open(file, "rb"))
+            except OSError:
+                continue
+        self.sizes = [os.fstat(file.fileno()).st_size for file in self.files]
+        self.size = sum(self.sizes)
+
+    def close(self):
+        for file in self.files:
+            file.close()
+        self.files = []
+
+    def iter_range(self, start: int = 0, end: int = None):
+        """
+        Yield the blocks of the bytes from the start to the end (exclusive)
+        """
+        end = self.size if end is None else min(end, self.size)
+        offset = 0
+        for file, size in zip(self.files, self.sizes):
+            if offset + size > start and offset < end:
+                file.seek(max(start - offset, 0))
+                remaining = min(end - offset, size) - max(start - offset, 0)
+                while remaining > 0:
+                    block = file.read(min(READ_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    yield block
+            offset += size
+
+    def tail(self, lines: int) -> bytes:
+        """
+        Get the last lines, read by blocks backward from the end
+        """
+        blocks = []
+        count = 0
+        for file, size in zip(reversed(self.files), reversed(self.sizes)):
+            position = size
+            while position > 0 and count <= lines:
+                read_size = min(READ_BLOCK_SIZE, position)
+                position -= read_size
+                file.seek(position)
+                block = file.read(read_size)
+                blocks.append(block)
+                count += block.count(b"\n")
+            if count > lines:
+                break
+        data = b"".join(reversed(blocks))
+        return b"".join(data.splitlines(keepends=True)[-lines:]) if lines else b""
+
+
+def gzip_stream(blocks):
+    """
+    Compress the blocks as a gzip stream
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def make_log_response(path: str, tail: int = None) -> Response:
+    """
+    Make the streamed response of the log, the last lines if tail, honoring the Range
+    and the Accept-Encoding of the request
+    """
+    view = LogView(path)
+    if not view.files:
+        view.close()
+        return Response(constants.waiting_tip, mimetype="text/plain")
+    status = 200
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    if tail is not None:
+        data = view.tail(tail)
+        view.close()
+        blocks, length = [data], len(data)
+    else:
+        start, end = 0, view.size
+        if request.range and request.range.units == "bytes":
+            ranges = request.range.range_for_length(view.size)
+            if ranges is None:
+                view.close()
+                return Response(status=416, headers={"Content-Range": f"bytes */{view.size}"})
+            start, end = ranges
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{view.size}"
+        blocks, length = view.iter_range(start, end), end - start
+    if status == 200 and length >= COMPRESS_MIN_SIZE and request.accept_encodings["gzip"]:
+        blocks = gzip_stream(blocks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    else:
+        headers["Content-Length"] = str(length)
+    response = Response(blocks, status=status, headers=headers, mimetype="text/plain", direct_passthrough=True)
+    response.call_on_close(view.close)
+    return response
@@ -0,0 +1,107 @@
+from array import array
+from typing import Iterable
+
+# Transition keys pack the state and the character code into one int,
+# code points need at most 21 bits
+CHAR_BITS = 21
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton that answers whether any keyword occurs in a text,
+    built once per keyword list and matched in time linear in the text length
+    """
+
+    def __init__(self, keywords: Iterable[str] = None):
+        self.goto: dict[int, int] = {}
+        self.fail = array("l", [0])
+        self.output = bytearray(1)
+        self.match_all = False
+        self.size = 0
+        if keywords:
+            self._build(keywords)
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def _build(self, keywords: Iterable[str]):
+        """
+        Build the automaton from the keywords
+        """
+        goto = self.goto
+        output = self.output
+        parent = array("l", [0])
+        chars = array("l", [0])
+        depth = array("l", [0])
+        for keyword in keywords:
+            if keyword is None:
+                continue
+            self.size += 1
+            if not keyword:
+                self.match_all = True
+                continue
+            state = 0
+            for char in keyword:
+                if output[state]:
+                    # A shorter keyword is a prefix of this one, the rest can never change the answer
+                    break
+                code = ord(char)
+                next_state = goto.get(state << CHAR_BITS | code)
+                if next_state is None:
+                    next_state = len(output)
+                    goto[state << CHAR_BITS | code] = next_state
+                    output.append(0)
+                    parent.append(state)
+                    chars.append(code)
+                    depth.append(depth[state] + 1)
+                state = next_state
+            else:
+                output[state] = 1
+
+        fail = array("l", bytes(len(output) * array("l").itemsize))
+        for state in sorted(range(1, len(output)), key=depth.__getitem__):
+            prev = parent[state]
+            if prev == 0:
+                continue
+            code = chars[state]
+            fallback = fail[prev]
+            while True:
+                next_state = goto.get(fallback << CHAR_BITS | code)
+                if next_state is not None:
+                    fail[state] = next_state
+                    break
+                if fallback == 0:
+                    break
+                fallback = fail[fallback]
+            if output[fail[state]]:
+                output[state] = 1
+        self.fail = fail
+
+    def match(self, text: str) -> bool:
+        """
+        Check if any keyword occurs in the text
+        """
+        if self.match_all:
+            return True
+        if not text:
+            return False
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for char in text:
+            code = ord(char)
+            while True:
+                next_state = goto.get(state << CHAR_BITS | code)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            if output[state]:
+                return True
+        return False
@@ -0,0 +1,296 @@
+import json
+import math
+import os
+from bisect import bisect_left
+from threading import Lock
+from time import time, sleep
+
+import utils.constants as constants
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds after which the snapshot of a process that stopped dumping is ignored
+SNAPSHOT_TTL = 60
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    items = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+    return f"{{{items}}}"
+
+
+class Metric:
+    """
+    In-process metric with its values by the label values, a local metric is set at scrape time
+    and left out of the snapshot shared with the other processes
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), local: bool = False):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.local = local
+        self.values: dict[tuple, object] = {}
+        self.lock = Lock()
+
+    def get_key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def merge(self, values: dict, samples: list):
+        """
+        Add the samples of a snapshot to the values
+        """
+        for key, value in samples:
+            key = tuple(key)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values: dict) -> list[str]:
+        lines = []
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(dict(zip(self.labels, key)))} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels, local=False)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0, "count": 0}
+            entry["counts"][bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return [[list(key), {**entry, "counts": list(entry["counts"])}] for key, entry in self.values.items()]
+
+    def merge(self, values: dict, samples: list):
+        for key, entry in samples:
+            key = tuple(key)
+            current = values.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0, "count": 0})
+            current["counts"] = [a + b for a, b in zip(current["counts"], entry["counts"])]
+            current["sum"] += entry["sum"]
+            current["count"] += entry["count"]
+
+    def render(self, values: dict) -> list[str]:
+        lines = []
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bucket, count in zip(self.buckets, entry["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': format_value(bucket)})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {entry['count']}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the process, exposed in the text format together with the snapshots dumped by the other
+    processes (the update and the other service workers), the values of the same labels are summed
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors = []
+        self.dump_names = set()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Add a callback run before rendering, to set the gauges read at scrape time
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self, shared: bool = False) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items() if not (shared and metric.local)}
+
+    def dump(self, name: str):
+        """
+        Write the snapshot of the metrics for the processes serving the metrics
+        """
+        self.dump_names.add(name)
+        os.makedirs(constants.metrics_path, exist_ok=True)
+        path = os.path.join(constants.metrics_path, f"{name}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(shared=True), f)
+        os.replace(temp_path, path)
+
+    def run_dump(self, name: str, interval: float = 15):
+        """
+        Keep dumping the snapshot in the background
+        """
+        while True:
+            try:
+                self.dump(name)
+            except OSError as e:
+                print(f"❌ Metrics dump error: {e}")
+            sleep(interval)
+
+    def remove_dump(self, name: str):
+        self.dump_names.discard(name)
+        try:
+            os.remove(os.path.join(constants.metrics_path, f"{name}.json"))
+        except OSError:
+            pass
+
+    def load_snapshots(self) -> list[dict]:
+        """
+        Load the snapshots of the other processes, the ones not updated for a while are ignored,
+        except the update one which stays until the next update
+        """
+        snapshots = []
+        try:
+            names = os.listdir(constants.metrics_path)
+        except OSError:
+            return snapshots
+        now = time()
+        for file_name in names:
+            name, ext = os.path.splitext(file_name)
+            if ext != ".json" or name in self.dump_names:
+                continue
+            path = os.path.join(constants.metrics_path, file_name)
+            try:
+                if name != "update" and now - os.path.getmtime(path) > SNAPSHOT_TTL:
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format
+        """
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"❌ Metrics collector error: {e}")
+        snapshots = [self.snapshot()] + self.load_snapshots()
+        lines = []
+        for name, metric in self.metrics.items():
+            values = {}
+            for snapshot in snapshots:
+                metric.merge(values, snapshot.get(name, []))
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+update_stage_seconds = registry.register(Gauge(
+    "iptv_update_stage_seconds", "Duration of each stage of the last update", ("stage",)
+))
+update_urls = registry.register(Gauge(
+    "iptv_update_urls", "Urls fetched, tested and kept by origin in the last update", ("origin", "state")
+))
+update_timestamp = registry.register(Gauge(
+    "iptv_update_timestamp_seconds", "Time the last update completed"
+))
+speed_test_in_flight = registry.register(Gauge(
+    "iptv_speed_test_in_flight", "Speed test probes running"
+))
+speed_test_concurrency = registry.register(Histogram(
+    "iptv_speed_test_concurrency", "Speed test probes running when a probe starts",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+))
+speed_test_probe_seconds = registry.register(Histogram(
+    "iptv_speed_test_probe_seconds", "Duration of the speed test probes", ("result",),
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20)
+))
+cache_requests = registry.register(Counter(
+    "iptv_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")
+))
+stream_relays = registry.register(Gauge(
+    "iptv_stream_relays", "Ffmpeg relays running by kind", ("kind",), local=True
+))
+stream_viewers = registry.register(Gauge(
+    "iptv_stream_viewers", "Viewers of the running relays by kind", ("kind",), local=True
+))
+http_requests = registry.register(Counter(
+    "iptv_http_requests_total", "Service requests by route, method and status", ("route", "method", "status")
+))
+http_request_seconds = registry.register(Histogram(
+    "iptv_http_request_seconds", "Duration of the service requests by route", ("route",)
+))
+
+
+def count_cache(cache: str, hit: bool):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def count_urls(data, state: str):
+    """
+    Set the number of the urls of the channel data by origin for the state of the update
+    """
+    counts = {}
+    for channel_obj in data.values():
+        for info_list in channel_obj.values():
+            for info in info_list:
+                origin = info.get("origin") or "unknown"
+                counts[origin] = counts.get(origin, 0) + 1
+    for origin, count in counts.items():
+        update_urls.set(count, origin=origin, state=state)
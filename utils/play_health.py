@@ -0,0 +1,193 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from threading import Lock
+from time import time, sleep
+
+import requests
+
+from utils.config import config
+from utils.result_index import ResultIndex
+from utils.tools import get_total_urls
+from utils.types import ChannelData
+
+# Weight of the latest check in the smoothed health score
+HEALTH_ALPHA = 0.5
+
+# Seconds a url marked bad is skipped by the redirect
+BAD_COOLDOWN = 300
+
+# Seconds a channel keeps being checked after it was played
+PLAY_ACTIVE_TIME = 600
+
+# Candidates of each played channel checked in a round
+CHECK_CANDIDATES = 3
+
+
+def check_url(url: str, headers: dict = None, timeout: int = 5) -> bool | None:
+    """
+    Check if the url responds with content, None if the protocol can not be checked
+    """
+    url = url.partition("$")[0]
+    if not url.startswith(("http://", "https://")):
+        return None
+    try:
+        with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code >= 400:
+                return False
+            return bool(next(response.iter_content(1024), b""))
+    except requests.RequestException:
+        return False
+
+
+class PlayHealth:
+    """
+    In-memory health table of the result urls by channel, the redirect of a channel goes to its healthiest url,
+    the urls marked bad by a check or a client report are skipped for a while. The reports are shared
+    with the other service workers through SQLite, the redirects never read the disk
+    """
+
+    def __init__(self, result_index: ResultIndex, path: str):
+        self.result_index = result_index
+        self.path = path
+        self.key = None
+        self.channels: dict[str, list[ChannelData]] = {}
+        self.lookup: dict[str, str] = {}
+        self.health: dict[str, dict] = {}
+        self.played: dict[str, float] = {}
+        self.last_report = 0
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY, url TEXT NOT NULL, time REAL NOT NULL)")
+            self.last_report = conn.execute("SELECT COALESCE(MAX(id), 0) FROM reports").fetchone()[0]
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def refresh(self):
+        """
+        Rebuild the candidates of the channels once the result changed, keep the health of the remaining urls
+        """
+        self.result_index.refresh()
+        if self.result_index.key == self.key:
+            return
+        with self.lock:
+            if self.result_index.key == self.key:
+                return
+            ipv_type_prefer = self.result_index.get_ipv_type_prefer()
+            origin_type_prefer = config.origin_type_prefer
+            channels = {}
+            for channel_obj in self.result_index.result.get("data", {}).values():
+                for name, info_list in channel_obj.items():
+                    urls = [info for info in get_total_urls(info_list, ipv_type_prefer, origin_type_prefer)
+                            if info["origin"] not in ["live", "hls"]]
+                    if urls and name not in channels:
+                        channels[name] = urls
+            urls = {info["url"] for info_list in channels.values() for info in info_list}
+            self.health = {url: entry for url, entry in self.health.items() if url in urls}
+            self.channels = channels
+            self.lookup = {name.lower(): name for name in channels}
+            self.key = self.result_index.key
+
+    def get_name(self, channel: str) -> str | None:
+        """
+        Get the channel name, case-insensitive
+        """
+        return channel if channel in self.channels else self.lookup.get(channel.lower())
+
+    def get_health(self, url: str) -> dict:
+        return self.health.get(url) or {"score": 1.0, "bad_until": 0, "checked_at": None}
+
+    def get_candidates(self, name: str) -> list[ChannelData]:
+        """
+        Get the urls of the channel, the healthy ones first, then by the result order
+        """
+        now = time()
+        urls = self.channels.get(name, [])
+
+        def key(item):
+            rank, info = item
+            health = self.get_health(info["url"])
+            return health["bad_until"] > now, -health["score"], rank
+
+        return [info for _, info in sorted(enumerate(urls), key=key)]
+
+    def get_best(self, channel: str) -> ChannelData | None:
+        """
+        Get the url to play for the channel
+        """
+        name = self.get_name(channel)
+        if not name:
+            return None
+        self.played[name] = time()
+        candidates = self.get_candidates(name)
+        return candidates[0] if candidates else None
+
+    def update(self, url: str, ok: bool):
+        """
+        Update the health of the url with a check result, a failed url is marked bad
+        """
+        entry = self.health.setdefault(url, self.get_health(url))
+        entry["score"] = HEALTH_ALPHA * ok + (1 - HEALTH_ALPHA) * entry["score"]
+        entry["checked_at"] = time()
+        entry["bad_until"] = 0 if ok else time() + BAD_COOLDOWN
+
+    def mark_bad(self, url: str, at: float):
+        entry = self.health.setdefault(url, self.get_health(url))
+        entry["bad_until"] = max(entry["bad_until"], at + BAD_COOLDOWN)
+
+    def report(self, url: str):
+        """
+        Report the url bad by a client, shared with the other workers
+        """
+        self.update(url, False)
+        with closing(self.connect()) as conn:
+            conn.execute("INSERT INTO reports (url, time) VALUES (?, ?)", (url, time()))
+
+    def sync_reports(self):
+        """
+        Apply the reports received by the other workers, forget the expired ones
+        """
+        with closing(self.connect()) as conn:
+            rows = conn.execute("SELECT id, url, time FROM reports WHERE id > ? ORDER BY id",
+                                (self.last_report,)).fetchall()
+            conn.execute("DELETE FROM reports WHERE time < ?", (time() - BAD_COOLDOWN,))
+        for report_id, url, at in rows:
+            self.mark_bad(url, at)
+            self.last_report = report_id
+
+    def check(self, max_workers: int = 4):
+        """
+        Check the first candidates of the recently played channels
+        """
+        now = time()
+        items = {}
+        for name, played_at in list(self.played.items()):
+            if now - played_at > PLAY_ACTIVE_TIME:
+                self.played.pop(name, None)
+                continue
+            for info in self.get_candidates(name)[:CHECK_CANDIDATES]:
+                items[info["url"]] = info.get("headers")
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda item: (item[0], check_url(*item, timeout=config.speed_test_timeout)),
+                                   items.items())
+            for url, ok in results:
+                if ok is not None:
+                    self.update(url, ok)
+
+    def run(self, interval: float = 30):
+        """
+        Keep the health table up to date in the background
+        """
+        while True:
+            try:
+                self.refresh()
+                self.sync_reports()
+                self.check()
+            except Exception as e:
+                print(f"❌ Play health check error: {e}")
+            sleep(interval)
@@ -0,0 +1,203 @@
+import re
+from typing import Iterable, Iterator
+
+import utils.constants as constants
+from utils.tools import format_name_url
+
+url_host_line_pattern = re.compile(constants.url_host_pattern.pattern)
+
+# The user info part can only match with an @, skip it for the common case
+url_host_line_no_user_pattern = re.compile(
+    constants.url_host_pattern.pattern.replace(r"([^:@/]+(:[^:@/]*)?@)?", "", 1))
+
+whitespace_pattern = re.compile(r"\s")
+
+extinf_prefix = "#EXTINF:-1"
+extvlcopt_prefix = "#EXTVLCOPT:"
+
+
+def decode_line(line: str | bytes) -> tuple[str, bool]:
+    """
+    Decode the line, return the text without the newline and whether it ends with a newline
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    if line.endswith("\n"):
+        return line[:-1], True
+    return line, False
+
+
+def find_comma(text: str, start: int = 0) -> int:
+    """
+    Find the first ASCII or fullwidth comma in the text
+    """
+    comma = text.find(",", start)
+    if "，" in text:
+        fullwidth = text.find("，", start)
+        if fullwidth != -1 and (comma == -1 or fullwidth < comma):
+            return fullwidth
+    return comma
+
+
+def match_url(text: str) -> str | None:
+    """
+    Match the URL at the start of a single line, same as constants.url_pattern
+    """
+    match = (url_host_line_pattern if "@" in text else url_host_line_no_user_pattern).match(text)
+    if not match:
+        return None
+    pos = match.end()
+    length = len(text)
+    whitespace = whitespace_pattern.search(text, pos)
+    end = whitespace.start() if whitespace else length
+    # \S*? stops before "?$", before a trailing "?" or at the end of the line
+    info = text.find("?$", pos, end)
+    if info != -1:
+        return text[:info]
+    if end == length:
+        return text[:length - 1] if length > pos and text[-1] == "?" else text
+    # [^\s?]*
+    question = text.find("?", pos, end)
+    return text[:question if question != -1 else end]
+
+
+def parse_txt(lines: Iterable[str | bytes], open_headers: bool) -> Iterator[dict]:
+    """
+    Parse the txt lines: name,url
+    """
+    # Lines without a comma become part of the name of the next item, as with the multiline pattern
+    pending = []
+    for line in lines:
+        text, newline = decode_line(line)
+        comma = find_comma(text)
+        if comma == -1:
+            if not newline:
+                return
+            pending.append(text)
+            continue
+        if pending:
+            pending.append(text[:comma])
+            name = "\n".join(pending)
+            pending = []
+        else:
+            name = text[:comma]
+        rest = text[comma + 1:]
+        if name and not rest.startswith("#genre#"):
+            url = match_url(rest)
+            if url:
+                data = format_name_url(name, url, open_headers=open_headers)
+                if data:
+                    yield data
+
+
+class LineBuffer:
+    """
+    Lookahead buffer over the lines of a stream, each line is kept as (text, ends with newline)
+    """
+
+    def __init__(self, lines: Iterable[str | bytes]):
+        self.lines = iter(lines)
+        self.buffer: list[tuple[str, bool]] = []
+        self.start = 0
+
+    def peek(self, index: int) -> tuple[str, bool] | None:
+        """
+        Get the line at the index ahead of the current line, None if the stream is exhausted
+        """
+        index += self.start
+        buffer = self.buffer
+        while len(buffer) <= index:
+            line = next(self.lines, None)
+            if line is None:
+                return None
+            buffer.append(decode_line(line))
+        return buffer[index]
+
+    def skip(self, count: int):
+        """
+        Drop the lines before the index
+        """
+        self.start += count
+        if self.start >= 1024:
+            del self.buffer[:self.start]
+            self.start = 0
+
+
+def parse_m3u_item(peek, open_headers: bool) -> tuple[dict | None, int] | None:
+    """
+    Parse the m3u item starting at the current #EXTINF line, return the data and the number of lines consumed
+    """
+    text, newline = peek(0)
+    if len(text) > len(extinf_prefix):
+        separator = text[len(extinf_prefix)]
+        if not (separator.isspace() or separator in "+,，"):
+            return None
+        index, column = 0, len(extinf_prefix) + 1
+    elif newline:
+        index, column = 1, 0
+    else:
+        return None
+    # The attributes run to the first comma, across lines if needed
+    parts = []
+    while True:
+        line = peek(index)
+        if line is None:
+            return None
+        text, newline = line
+        comma = find_comma(text, column)
+        if comma != -1:
+            parts.append(text[column:comma])
+            break
+        if not newline:
+            return None
+        parts.append(text[column:])
+        index += 1
+        column = 0
+    attributes = parts[0] if len(parts) == 1 else "\n".join(parts)
+    if not attributes or not newline:
+        return None
+    name = text[comma + 1:]
+    options = []
+    index += 1
+    while True:
+        line = peek(index)
+        if line is None:
+            return None
+        text, newline = line
+        url = match_url(text)
+        if url:
+            return format_name_url(name, url, attributes, "".join(options), open_headers), index + 1
+        if not newline or not text.startswith(extvlcopt_prefix):
+            return None
+        options.append(text + "\n")
+        index += 1
+
+
+def parse_m3u(lines: Iterable[str | bytes], open_headers: bool) -> Iterator[dict]:
+    """
+    Parse the m3u lines: #EXTINF:-1 attributes,name [#EXTVLCOPT:options] url
+    """
+    buffer = LineBuffer(lines)
+    peek = buffer.peek
+    skip = buffer.skip
+    while (line := peek(0)) is not None:
+        if line[0].startswith(extinf_prefix):
+            result = parse_m3u_item(peek, open_headers)
+            if result is not None:
+                data, consumed = result
+                if data:
+                    yield data
+                skip(consumed)
+                continue
+        skip(1)
+
+
+def parse_playlist(lines: Iterable[str | bytes], m3u_type: bool, open_headers: bool = False) -> Iterator[dict]:
+    """
+    Parse the playlist line by line, yield the name, url, headers and catchup of each item,
+    same results as get_name_url with constants.multiline_m3u_pattern / multiline_txt_pattern,
+    except that a URL never spans lines (the patterns allow user info across lines)
+    """
+    if m3u_type:
+        return parse_m3u(lines, open_headers)
+    return parse_txt(lines, open_headers)
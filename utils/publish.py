@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager, suppress
+from threading import Lock
+from time import time
+
+import utils.constants as constants
+from utils.config import config
+from utils.file_writer import get_file_hash, write_stats
+
+# Name of the manifest file in a generation directory
+MANIFEST_NAME = "manifest.json"
+
+# Lock file of the generations directory, held while a generation is numbered and published
+LOCK_NAME = ".lock"
+
+# Prefix of the staging directories, unique to each update until it is published
+STAGING_PREFIX = ".staging-"
+
+# Seconds after which a staging directory is left by a failed update
+STAGING_MAX_AGE = 3600
+
+
+def get_key(path: str) -> str:
+    """
+    Get the manifest key of the output path, relative to the working directory if it is inside
+    """
+    path = os.path.abspath(path)
+    try:
+        key = os.path.relpath(path)
+    except ValueError:
+        return path
+    return path if key.startswith("..") else os.path.normpath(key)
+
+
+def write_json_atomic(path: str, data: dict):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def read_manifest(path: str = None) -> dict | None:
+    try:
+        with open(path or constants.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_generation_dir(number: int) -> str:
+    return os.path.join(constants.generations_path, str(number))
+
+
+def get_generations() -> list[int]:
+    """
+    Get the numbers of the kept generations, the oldest first
+    """
+    try:
+        names = os.listdir(constants.generations_path)
+    except OSError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+@contextmanager
+def publish_lock():
+    """
+    Hold the lock of the generations directory, shared by the processes publishing or rolling back
+    """
+    os.makedirs(constants.generations_path, exist_ok=True)
+    with open(os.path.join(constants.generations_path, LOCK_NAME), "a+") as file:
+        if sys.platform == "win32":
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+
+def link_file(source: str, path: str):
+    """
+    Swap the file in at the path, as a hard link of the generation file if the file system supports it
+    """
+    with suppress(OSError):
+        if os.path.samefile(source, path):
+            return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with suppress(FileNotFoundError):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copy2(source, temp_path)
+    os.replace(temp_path, path)
+
+
+def link_generation(manifest: dict):
+    """
+    Point the output paths to the files of the generation
+    """
+    generation_dir = get_generation_dir(manifest["generation"])
+    for key, name in manifest["files"].items():
+        link_file(os.path.join(generation_dir, name), key)
+
+
+class Generation:
+    """
+    The output files of one update, written into a staging directory of its own and published as a whole:
+    the generation is numbered under the lock, its directory is renamed into place, then the manifest is swapped to it
+    """
+
+    def __init__(self):
+        os.makedirs(constants.generations_path, exist_ok=True)
+        self.staging_dir = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=constants.generations_path)
+        self.number = None
+        self.dirs: dict[str, str] = {}
+
+    def stage(self, path: str) -> str:
+        """
+        Get the staging path to write the output file of the path, the files written next to it are published too
+        """
+        key = get_key(path)
+        key_dir = os.path.dirname(key)
+        if os.path.isabs(key):
+            name_dir = os.path.join("_external", hashlib.md5(key_dir.encode("utf-8")).hexdigest()[:8])
+        else:
+            name_dir = key_dir or "."
+        self.dirs[os.path.normpath(name_dir)] = key_dir
+        staged_dir = os.path.join(self.staging_dir, name_dir)
+        os.makedirs(staged_dir, exist_ok=True)
+        return os.path.join(staged_dir, os.path.basename(key))
+
+    def get_files(self) -> dict[str, str]:
+        """
+        Get the staged files by their output path
+        """
+        files = {}
+        for root, _, names in os.walk(self.staging_dir):
+            name_dir = os.path.normpath(os.path.relpath(root, self.staging_dir))
+            key_dir = self.dirs.get(name_dir, name_dir)
+            for name in names:
+                files[os.path.join(key_dir, name) if key_dir else name] = os.path.normpath(os.path.join(name_dir, name))
+        return files
+
+    def publish(self, update_time: str = None):
+        """
+        Publish the staged files as the new generation, the files of the previous generation not written
+        by this update are carried over and the unchanged ones are shared with it, so their output paths
+        are left untouched, then the old generations beyond the kept number are removed
+        """
+        with publish_lock():
+            self.number = self.publish_locked(update_time)
+        prune_generations(self.number)
+
+    def publish_locked(self, update_time: str = None) -> int:
+        """
+        Number and publish the generation, while holding the lock so a concurrent update or revalidation
+        neither takes the same number nor swaps the manifest in between
+        """
+        current = read_manifest()
+        generations = get_generations()
+        number = max(generations[-1] if generations else 0, current["generation"] if current else 0) + 1
+        generation_dir = get_generation_dir(number)
+        files = self.get_files()
+        previous = current["files"] if current else {}
+        previous_dir = get_generation_dir(current["generation"]) if current else None
+        for key, name in files.items():
+            staged = os.path.join(self.staging_dir, name)
+            size = os.path.getsize(staged)
+            source = os.path.join(previous_dir, previous[key]) if key in previous else None
+            unchanged = source and os.path.exists(source) and os.path.getsize(source) == size and \
+                        get_file_hash(source) == get_file_hash(staged)
+            if unchanged:
+                link_file(source, staged)
+            write_stats.add(not unchanged, size)
+        for key, name in previous.items():
+            source = os.path.join(previous_dir, name)
+            if key not in files and os.path.exists(source):
+                target = os.path.join(self.staging_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                link_file(source, target)
+                files[key] = name
+        manifest = {"generation": number, "time": time(), "update_time": update_time, "files": files}
+        write_json_atomic(os.path.join(self.staging_dir, MANIFEST_NAME), manifest)
+        os.replace(self.staging_dir, generation_dir)
+        write_json_atomic(constants.manifest_path, manifest)
+        link_generation(manifest)
+        return number
+
+
+def prune_generations(current: int):
+    """
+    Remove the generations beyond the kept number and the staging directories left by a failed update,
+    the ones still being written by a concurrent update are recent
+    """
+    keep = max(config.publish_generations, 1)
+    with publish_lock():
+        generations = get_generations()
+        manifest = read_manifest()
+        published = manifest["generation"] if manifest else None
+        for number in generations[:-keep]:
+            if number not in (current, published):
+                shutil.rmtree(get_generation_dir(number), ignore_errors=True)
+    now = time()
+    for name in os.listdir(constants.generations_path):
+        path = os.path.join(constants.generations_path, name)
+        with suppress(OSError):
+            if name.startswith(STAGING_PREFIX) and now - os.path.getmtime(path) > STAGING_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def rollback(number: int = None) -> int | None:
+    """
+    Publish a kept generation again, the one before the current if None, return its number
+    """
+    with publish_lock():
+        return rollback_locked(number)
+
+
+def rollback_locked(number: int = None) -> int | None:
+    """
+    Publish a kept generation again, while holding the lock
+    """
+    manifest = read_manifest()
+    generations = get_generations()
+    if number is None:
+        current = manifest["generation"] if manifest else None
+        previous = [n for n in generations if current is None or n < current]
+        number = previous[-1] if previous else None
+    if number not in generations:
+        return None
+    target = read_manifest(os.path.join(get_generation_dir(number), MANIFEST_NAME))
+    if not target:
+        return None
+    write_json_atomic(constants.manifest_path, target)
+    link_generation(target)
+    return number
+
+
+class Manifest:
+    """
+    The published manifest, reloaded once it is swapped, resolves the output paths to the files of the current
+    generation so all the files of an update are served together
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.key = None
+        self.generation = None
+        self.files: dict[str, str] = {}
+        self.lock = Lock()
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            key = None
+        if key == self.key:
+            return
+        with self.lock:
+            if key == self.key:
+                return
+            manifest = read_manifest(self.path) if key else None
+            if manifest:
+                generation_dir = get_generation_dir(manifest["generation"])
+                self.files = {key: os.path.join(generation_dir, name) for key, name in manifest["files"].items()}
+                self.generation = manifest["generation"]
+            else:
+                self.files, self.generation = {}, None
+            self.key = key
+
+    def resolve(self, path: str) -> str:
+        """
+        Get the file of the output path in the current generation, the path itself if it is not published
+        """
+        self.refresh()
+        return self.files.get(get_key(path), path)
+
+
+published_manifest = Manifest(constants.manifest_path)
+
+
+if __name__ == "__main__":
+    result = rollback(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print(f"✅ Rolled back to the generation {result}" if result else "❌ No generation to roll back to")
@@ -0,0 +1,137 @@
+import gzip
+import os
+import pickle
+from collections import OrderedDict
+from threading import Lock
+
+from utils.channel import get_write_content
+from utils.config import config
+from utils.file_cache import CachedFile
+from utils.metrics import count_cache
+from utils.tools import get_m3u_content, get_resolution_value, get_ip_address
+
+# Max number of the rendered parameter sets kept in memory
+RENDER_CACHE_SIZE = 64
+
+
+class ResultIndex:
+    """
+    In-memory index of the sorted channel data, reloaded when the data file changes,
+    the playlists filtered by the query are rendered on the fly and cached by the parameter set
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stat = None
+        self.key = None
+        self.result = {}
+        self.cache: OrderedDict[tuple, CachedFile] = OrderedDict()
+        self.lock = Lock()
+
+    def refresh(self) -> bool:
+        """
+        Reload the index if the data file changed, return whether the data is available
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino) if stat else None
+        if key != self.key:
+            with self.lock:
+                if key != self.key:
+                    result = {}
+                    if stat:
+                        try:
+                            with gzip.open(self.path, "rb") as file:
+                                result = pickle.load(file)
+                        except Exception as e:
+                            print(f"❌ Error loading the result index: {e}")
+                            return bool(self.result)
+                    self.result, self.stat, self.key = result, stat, key
+                    self.cache.clear()
+        return bool(self.result)
+
+    @property
+    def categories(self) -> list[str]:
+        return list(self.result.get("data", {}))
+
+    def get_ipv_type_prefer(self, ipv_type: list[str] = None) -> list[str]:
+        """
+        Get the ipv type prefer of the query, the configured one if None
+        """
+        ipv_type_prefer = list(config.ipv_type_prefer) if ipv_type is None else ipv_type
+        if any(pref in ipv_type_prefer for pref in ["自动", "auto"]):
+            ipv_type_prefer = ["ipv6", "ipv4"] if self.result.get("ipv6") else ["ipv4", "ipv6"]
+        return [pref for pref in ipv_type_prefer if pref not in ["all", "全部"]]
+
+    def filter_data(self, categories: list[str] = None, min_resolution: int = None) -> dict:
+        """
+        Get the channel data of the categories, without the urls below the min resolution
+        """
+        data = self.result.get("data", {})
+        if categories:
+            data = {cate: data[cate] for cate in data if cate in categories}
+        if not min_resolution:
+            return data
+        return {
+            cate: {
+                name: [
+                    info for info in info_list
+                    if not (info.get("resolution") and get_resolution_value(info["resolution"]) < min_resolution)
+                ]
+                for name, info_list in channel_obj.items()
+            }
+            for cate, channel_obj in data.items()
+        }
+
+    def render(
+            self,
+            ipv_type: list[str] = None,
+            categories: list[str] = None,
+            origins: list[str] = None,
+            limit: int = None,
+            min_resolution: int = None,
+            file_type: str = "txt",
+            rtmp: str = None
+    ) -> CachedFile | None:
+        """
+        Render the playlist of the query, None if the data is not available yet
+        """
+        if not self.refresh():
+            return None
+        cache_key = (
+            tuple(ipv_type) if ipv_type is not None else None,
+            tuple(categories or ()),
+            tuple(origins) if origins is not None else None,
+            limit,
+            min_resolution,
+            file_type,
+            rtmp,
+        )
+        with self.lock:
+            entry = self.cache.get(cache_key)
+            count_cache("playlist", entry is not None)
+            if entry:
+                self.cache.move_to_end(cache_key)
+                return entry
+            address = get_ip_address()
+            content, result_data = get_write_content(
+                data=self.filter_data(categories, min_resolution),
+                live=rtmp == "live",
+                hls=rtmp == "hls",
+                live_url=f"{address}/live/",
+                hls_url=f"{address}/hls/",
+                open_empty_category=config.open_empty_category,
+                ipv_type_prefer=self.get_ipv_type_prefer(ipv_type),
+                origin_type_prefer=config.origin_type_prefer if origins is None else origins,
+                limit=limit,
+                update_time=self.result.get("update_time"),
+                proxy_url=f"{address}/proxy/" if config.open_hls_proxy else None,
+            )
+            if file_type == "m3u":
+                content = get_m3u_content(content, self.result.get("first_channel_name"), result_data)
+            entry = self.cache[cache_key] = CachedFile(f"result.{file_type}", self.stat, content.encode("utf-8"))
+            if len(self.cache) > RENDER_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return entry
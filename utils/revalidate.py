@@ -0,0 +1,155 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep
+
+from utils.channel import write_channel_to_file
+from utils.config import config
+from utils.play_health import check_url
+from utils.result_index import ResultIndex
+from utils.tools import get_total_urls
+
+# Consecutive failed checks before a published url is demoted
+DEMOTE_FAILS = 2
+
+# Backups checked to replace a demoted url
+PROMOTE_CHECKS = 3
+
+# Min seconds between two republishes of the result files
+PUBLISH_INTERVAL = 300
+
+# The origins never moved by the revalidation
+FIXED_ORIGINS = ["whitelist", "live", "hls"]
+
+
+class Revalidator:
+    """
+    Rolling re-check of the published urls between the updates: the dead urls are moved to the end of
+    the candidates of their channel, replaced by a healthy backup, and the result files are republished
+    """
+
+    def __init__(self, path: str):
+        self.index = ResultIndex(path)
+        self.key = None
+        self.queue: deque[tuple[str, str, str]] = deque()
+        self.fails: dict[str, int] = {}
+        self.changed = False
+        self.published_at = time()
+
+    def get_published(self, info_list: list) -> list:
+        """
+        Get the urls of the channel written in the result files
+        """
+        return get_total_urls(info_list, self.index.get_ipv_type_prefer(), config.origin_type_prefer)
+
+    def refresh(self) -> bool:
+        """
+        Reload the result once updated, the pending changes are dropped for the new result
+        """
+        if not self.index.refresh():
+            return False
+        if self.index.key != self.key:
+            self.key = self.index.key
+            self.queue.clear()
+            self.fails = {}
+            self.changed = False
+        return True
+
+    def fill_queue(self):
+        """
+        Queue all the published urls for a new round
+        """
+        for cate, channel_obj in self.index.result["data"].items():
+            for name, info_list in channel_obj.items():
+                for info in self.get_published(info_list):
+                    if info["origin"] not in FIXED_ORIGINS:
+                        self.queue.append((cate, name, info["url"]))
+
+    def demote(self, cate: str, name: str, url: str):
+        """
+        Move the dead url to the end of the candidates, a healthy backup takes its place
+        """
+        info_list = self.index.result["data"][cate][name]
+        index = next((i for i, info in enumerate(info_list) if info["url"] == url), None)
+        if index is None:
+            return
+        published = {info["url"] for info in self.get_published(info_list)}
+        backups = [
+            info for info in info_list
+            if info["url"] not in published and info["origin"] not in FIXED_ORIGINS and self.fails.get(info["url"], 0) == 0
+        ]
+        dead = info_list.pop(index)
+        for backup in backups[:PROMOTE_CHECKS]:
+            if check_url(backup["url"], backup.get("headers"), timeout=config.speed_test_timeout) is not False:
+                info_list.remove(backup)
+                info_list.insert(index, backup)
+                print(f"🔁 Revalidate {name}: {dead['url']} -> {backup['url']}")
+                break
+            self.fails[backup["url"]] = DEMOTE_FAILS
+        info_list.append(dead)
+        self.changed = True
+
+    def check(self):
+        """
+        Check the next batch of the published urls
+        """
+        if not self.queue:
+            self.fill_queue()
+        batch = [self.queue.popleft() for _ in range(min(config.revalidate_concurrency, len(self.queue)))]
+        if not batch:
+            return
+        data = self.index.result["data"]
+        headers = {
+            url: next((info.get("headers") for info in data[cate][name] if info["url"] == url), None)
+            for cate, name, url in batch
+        }
+        with ThreadPoolExecutor(max_workers=len(batch)) as executor:
+            results = list(executor.map(
+                lambda item: check_url(item[2], headers[item[2]], timeout=config.speed_test_timeout), batch
+            ))
+        for (cate, name, url), ok in zip(batch, results):
+            if ok is None:
+                continue
+            if ok:
+                self.fails.pop(url, None)
+                continue
+            self.fails[url] = self.fails.get(url, 0) + 1
+            if self.fails[url] == DEMOTE_FAILS:
+                self.demote(cate, name, url)
+
+    def publish(self):
+        """
+        Rewrite the result files with the new order, unless a full update replaced the result meanwhile
+        """
+        try:
+            stat = os.stat(self.index.path)
+        except OSError:
+            return
+        if (stat.st_mtime_ns, stat.st_size, stat.st_ino) != self.key:
+            return
+        result = self.index.result
+        write_channel_to_file(
+            result["data"],
+            ipv6=result.get("ipv6", False),
+            first_channel_name=result.get("first_channel_name"),
+            update_time=result.get("update_time"),
+            enable_print=False
+        )
+        self.changed = False
+        self.published_at = time()
+        if self.index.refresh():
+            self.key = self.index.key
+
+    def run(self):
+        """
+        Keep checking the published urls at a low pace
+        """
+        while True:
+            try:
+                if self.refresh():
+                    self.check()
+                    if self.changed and time() - self.published_at >= PUBLISH_INTERVAL:
+                        self.publish()
+            except Exception as e:
+                print(f"❌ Revalidate error: {e}")
+            sleep(config.revalidate_interval)
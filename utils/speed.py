@@ -12,6 +12,7 @@ from multidict import CIMultiDictProxy
 
 import utils.constants as constants
 from utils.config import config
+from utils.metrics import count_cache
 from utils.tools import get_resolution_value
 from utils.types import TestResult, ChannelTestResult, TestResultCacheData
 
@@ -347,6 +348,8 @@ async def get_speed(data, headers=None, ipv6_proxy=None, filter_resolution=open_
     result: TestResult = {'speed': 0, 'delay': -1, 'resolution': resolution}
     try:
         cache_key = data['host'] if speed_test_filter_host else url
+        if cache_key:
+            count_cache("speed_test", cache_key in cache)
         if cache_key and cache_key in cache:
             result = get_avg_result(cache[cache_key])
         else:
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import random
+import socket
+from collections import defaultdict
+from time import time
+from urllib.parse import urlparse
+
+from aiohttp import ClientConnectionError, ClientSession, ClientTimeout, TCPConnector
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36",
+]
+
+# Bodies up to this size are drained so the connection goes back to the pool
+POOL_BODY_LIMIT = 64 * 1024
+
+# Errors telling the host could not be reached, the only ones counted by the circuit breaker
+CONNECT_ERRORS = (asyncio.TimeoutError, ClientConnectionError, ConnectionError, socket.gaierror)
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Resolve the future with the first datagram received
+    """
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class StreamChecker:
+    """
+    Asyncio stream checker shared by the blacklist scripts, supports http(s), rtmp/rtsp, rtp/udp and p3p
+    """
+
+    def __init__(self, concurrency: int = 500, timeout: int = 6, ffprobe_concurrency: int = 8,
+                 ffprobe_timeout: int = 8, limit_per_host: int = 16, resolution: bool = True,
+                 host_failure_limit: int = 5, half_open_after: float | None = 30):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.ffprobe_concurrency = ffprobe_concurrency
+        self.ffprobe_timeout = ffprobe_timeout
+        self.limit_per_host = limit_per_host
+        self.resolution = resolution
+        self.ffprobe_semaphore = asyncio.Semaphore(ffprobe_concurrency)
+        self.session: ClientSession | None = None
+        self.host_failure_limit = host_failure_limit
+        self.half_open_after = half_open_after
+        self.host_failures: defaultdict[str, int] = defaultdict(int)
+        self.host_opened_at: dict[str, float] = {}
+        self.host_probing: set[str] = set()
+
+    async def __aenter__(self):
+        self.session = ClientSession(
+            connector=TCPConnector(
+                ssl=False,
+                limit=self.concurrency,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300,
+            ),
+            timeout=ClientTimeout(total=self.timeout),
+            trust_env=True,
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def check_http(self, url: str) -> bool:
+        """
+        Check the http url by the response status, the url is requested as given,
+        aiohttp only encodes the characters that are not valid in a url
+        """
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        async with self.session.get(url, headers=headers) as response:
+            if response.content_length is not None and response.content_length <= POOL_BODY_LIMIT:
+                await response.read()
+            return response.status == 200
+
+    async def check_rtp(self, url: str) -> bool:
+        """
+        Check the rtp/udp url by waiting for the first datagram
+        """
+        parsed_url = urlparse(url)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramProtocol(future),
+            remote_addr=(parsed_url.hostname, parsed_url.port),
+        )
+        try:
+            transport.sendto(b"")
+            await asyncio.wait_for(future, self.timeout)
+            return True
+        finally:
+            transport.close()
+
+    async def check_p3p(self, url: str) -> bool:
+        """
+        Check the p3p url by the protocol handshake
+        """
+        parsed_url = urlparse(url)
+        host, port, path = parsed_url.hostname, parsed_url.port, parsed_url.path
+        if not host or not port or not path:
+            return False
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        try:
+            writer.write(f"GET {path} P3P/1.0\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(1024), self.timeout)
+            return b"P3P" in response
+        finally:
+            writer.close()
+
+    async def probe(self, url: str, timeout: int) -> tuple[bool, int | None, int | None]:
+        """
+        Probe the url by ffprobe, return the status and the video resolution
+        """
+        async with self.ffprobe_semaphore:
+            proc = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=width,height", "-of", "json", url,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise
+        width = height = None
+        try:
+            stream = json.loads(out)["streams"][0]
+            width, height = stream["width"], stream["height"]
+        except (ValueError, KeyError, IndexError):
+            pass
+        return proc.returncode == 0, width, height
+
+    def is_host_open(self, host: str) -> bool:
+        """
+        Check if the circuit of the host is open, let a single check through once half open
+        """
+        opened_at = self.host_opened_at.get(host)
+        if opened_at is None:
+            return False
+        if self.half_open_after is None or host in self.host_probing or time() - opened_at < self.half_open_after:
+            return True
+        self.host_probing.add(host)
+        return False
+
+    def record_host_result(self, host: str, reachable: bool | None):
+        """
+        Count the consecutive connect failures of the host, open the circuit when it reaches the limit,
+        a result telling nothing about the reachability (None) leaves the count as it is
+        """
+        self.host_probing.discard(host)
+        if reachable is None:
+            return
+        if reachable:
+            self.host_failures.pop(host, None)
+            self.host_opened_at.pop(host, None)
+            return
+        self.host_failures[host] += 1
+        if self.host_failure_limit and self.host_failures[host] >= self.host_failure_limit:
+            self.host_opened_at[host] = time()
+
+    async def check(self, url: str, resolution: bool = None) -> dict:
+        """
+        Check the url, return the status, the delay (ms), the resolution and the error type,
+        the resolution of the http urls is probed after the check if resolution (default self.resolution)
+        """
+        result = {"url": url, "success": False, "delay": None, "width": None, "height": None, "error": None}
+        host = urlparse(url).netloc
+        if self.is_host_open(host):
+            result["error"] = "CircuitOpen"
+            return result
+        reachable = await self._check(url, result)
+        if result["error"] != "UnsupportedProtocol":
+            self.record_host_result(host, reachable)
+        if self.resolution if resolution is None else resolution:
+            await self.probe_resolution(result)
+        return result
+
+    async def _check(self, url: str, result: dict) -> bool | None:
+        """
+        Check the url by its protocol, return whether the host was reachable, None if unknown
+        """
+        start_time = time()
+        try:
+            width = height = None
+            if url.startswith("http"):
+                success = await self.check_http(url)
+                reachable = True
+            elif url.startswith(("rtmp", "rtsp")):
+                success, width, height = await self.probe(url, self.timeout)
+                reachable = True if success else None
+            elif url.startswith(("rtp", "udp")):
+                success = reachable = await self.check_rtp(url)
+            elif url.startswith("p3p"):
+                success = await self.check_p3p(url)
+                reachable = True
+            else:
+                result["error"] = "UnsupportedProtocol"
+                return None
+            result["delay"] = (time() - start_time) * 1000
+            result["success"] = success
+            result["width"], result["height"] = width, height
+            return reachable
+        except Exception as e:
+            result["error"] = type(e).__name__
+            return False if isinstance(e, CONNECT_ERRORS) else None
+
+    def needs_resolution(self, result: dict) -> bool:
+        return result["success"] and result["width"] is None and result["url"].startswith("http")
+
+    async def probe_resolution(self, result: dict):
+        """
+        Probe the resolution of the checked http url
+        """
+        if not self.needs_resolution(result):
+            return
+        try:
+            _, result["width"], result["height"] = await self.probe(result["url"], self.ffprobe_timeout)
+        except Exception:
+            pass
+
+    async def check_urls(self, urls: list[str], callback=None) -> list[dict]:
+        """
+        Check the urls with a fixed number of workers, the results keep the order of the urls.
+        The resolution probes are queued to their own workers, so a slow ffprobe does not hold
+        a check worker and the checks keep running at the full concurrency
+        """
+        results = [None] * len(urls)
+        pending = iter(enumerate(urls))
+        probes = asyncio.Queue()
+
+        def finish(index: int, result: dict):
+            results[index] = result
+            if callback:
+                callback(result)
+
+        async def worker():
+            for index, url in pending:
+                result = await self.check(url, resolution=False)
+                if self.resolution and self.needs_resolution(result):
+                    probes.put_nowait((index, result))
+                else:
+                    finish(index, result)
+
+        async def probe_worker():
+            while True:
+                index, result = await probes.get()
+                try:
+                    await self.probe_resolution(result)
+                finally:
+                    finish(index, result)
+                    probes.task_done()
+
+        probe_workers = [asyncio.create_task(probe_worker()) for _ in range(self.ffprobe_concurrency)]
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(urls)))))
+            await probes.join()
+        finally:
+            for task in probe_workers:
+                task.cancel()
+        return results
+
+
+def check_urls(urls: list[str], callback=None, **kwargs) -> list[dict]:
+    """
+    Check the urls in a new event loop, kwargs are passed to StreamChecker
+    """
+
+    async def run():
+        async with StreamChecker(**kwargs) as checker:
+            return await checker.check_urls(urls, callback)
+
+    return asyncio.run(run())
@@ -0,0 +1,251 @@
+import os
+import signal
+import subprocess
+import threading
+import xml.etree.ElementTree as ET
+from time import time, sleep
+
+import requests
+
+from utils.config import config
+from utils.stream_registry import StreamRegistry, is_pid_alive
+
+STREAM_KINDS = ("live", "hls")
+
+
+class StreamLimitError(Exception):
+    """
+    All the running relays have viewers, no one can be stopped for a new channel
+    """
+
+
+def get_stream_cmd(kind: str, channel_id: str, url: str, headers: dict = None) -> list[str]:
+    """
+    Get the ffmpeg command relaying the url to the nginx-rtmp application of the kind
+    """
+    cmd = [
+        'ffmpeg',
+        '-loglevel', 'error',
+        '-re',
+        '-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) if headers else '',
+    ]
+    if kind == "hls":
+        cmd += ['-stream_loop', '-1']
+    return cmd + [
+        '-i', url.partition('$')[0],
+        '-c:v', 'copy',
+        '-c:a', 'copy',
+        '-f', 'flv',
+        '-flvflags', 'no_duration_filesize',
+        f'rtmp://localhost:1935/{kind}/{channel_id}'
+    ]
+
+
+def parse_rtmp_stat(content: bytes) -> dict[str, dict[str, tuple[int, int]]]:
+    """
+    Parse the nginx-rtmp stat page: application -> stream name -> (viewers, bandwidth in bit/s),
+    the viewers are the clients other than the publisher
+    """
+    result = {}
+    root = ET.fromstring(content)
+    for application in root.iter("application"):
+        streams = result.setdefault(application.findtext("name", ""), {})
+        for stream in application.iter("stream"):
+            viewers = sum(1 for client in stream.iter("client") if client.find("publishing") is None)
+            streams[stream.findtext("name", "")] = (viewers, int(stream.findtext("bw_in") or 0))
+    return result
+
+
+class StreamManager:
+    """
+    Shared ffmpeg relays of the live and hls channels: one relay per channel for all the viewers,
+    stopped once it has no viewer for the idle timeout, the most requested channels can be kept warm
+    """
+
+    def __init__(self, path: str):
+        self.registries = {kind: StreamRegistry(path, kind) for kind in STREAM_KINDS}
+        self.touched: dict[tuple[str, str], float] = {}
+
+    def __getitem__(self, kind: str) -> StreamRegistry:
+        return self.registries[kind]
+
+    def start(self, kind: str, channel_id: str, url: str, headers: dict = None) -> bool:
+        """
+        Start the relay of the channel unless a worker already runs it, return whether it was started
+        """
+        registry = self.registries[kind]
+        if channel_id not in registry:
+            self.make_room()
+
+        def start():
+            process = subprocess.Popen(
+                get_stream_cmd(kind, channel_id, url, headers),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                stdin=subprocess.DEVNULL
+            )
+            threading.Thread(target=self.monitor, args=(registry, process, channel_id), daemon=True).start()
+            return process.pid
+
+        return registry.claim(channel_id, start)[1]
+
+    @staticmethod
+    def monitor(registry: StreamRegistry, process: subprocess.Popen, channel_id: str):
+        """
+        Wait for the relay to exit and forget it
+        """
+        process.wait()
+        registry.remove(channel_id, process.pid)
+
+    @staticmethod
+    def stop(registry: StreamRegistry, channel_id: str, pid: int, process_start: str = None):
+        """
+        Terminate the relay of the channel, only if the pid still is the relay started at process_start
+        """
+        if is_pid_alive(pid, process_start):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        registry.remove(channel_id, pid)
+
+    def clear(self):
+        """
+        Stop the relays left by a previous run of the service and empty the registries
+        """
+        for kind, registry in self.registries.items():
+            for row in registry.clear():
+                print(f"🛑 Stop the {kind} stream of the previous run: {row['channel_id']}")
+                self.stop(registry, row["channel_id"], row["pid"], row["process_start"])
+
+    def touch(self, kind: str, channel_id: str, interval: float = 5):
+        """
+        Mark the relay as watched, at most once per interval for each channel of this worker
+        """
+        now = time()
+        key = (kind, channel_id)
+        if now - self.touched.get(key, 0) >= interval:
+            self.touched[key] = now
+            self.registries[kind].touch(channel_id)
+
+    def is_idle(self, kind: str, row: dict, now: float) -> bool:
+        """
+        The hls relays are watched through the service so their activity is known, the live relays are idle
+        only if their viewers are known, from the stat page or the play hooks
+        """
+        if now - (row["last_active"] or row["started_at"]) < config.rtmp_idle_timeout:
+            return False
+        return kind == "hls" or row["viewers"] == 0
+
+    def make_room(self):
+        """
+        Stop the relay without viewers idle for the longest time if the limit is reached
+        """
+        rows = [(kind_, row) for kind_, registry in self.registries.items() for row in registry.rows()]
+        need = len(rows) - config.rtmp_max_streams + 1
+        if need <= 0:
+            return
+        prewarm = self.get_prewarm()
+        candidates = sorted(
+            ((kind_, row) for kind_, row in rows
+             if (kind_, row["channel_id"]) not in prewarm and (kind_ == "hls" or not row["viewers"])),
+            key=lambda item: item[1]["last_active"] or item[1]["started_at"]
+        )
+        for kind_, row in candidates[:need]:
+            self.stop(self.registries[kind_], row["channel_id"], row["pid"], row["process_start"])
+        if len(candidates) < need:
+            raise StreamLimitError(f"Max streams ({config.rtmp_max_streams}) reached")
+
+    def get_prewarm(self) -> set[tuple[str, str]]:
+        """
+        Get the most requested channels to keep running
+        """
+        return {(kind, channel_id) for kind, registry in self.registries.items()
+                for channel_id in registry.top_requested(config.rtmp_prewarm_num)}
+
+    def poll_stat(self) -> bool:
+        """
+        Update the viewers and the bandwidth of the relays from the nginx-rtmp stat page
+        """
+        if not config.rtmp_stat_url:
+            return False
+        try:
+            response = requests.get(config.rtmp_stat_url, timeout=3)
+            response.raise_for_status()
+            stat = parse_rtmp_stat(response.content)
+        except (requests.RequestException, ET.ParseError):
+            return False
+        for kind, registry in self.registries.items():
+            registry.update_stats(stat.get(kind, {}))
+        return True
+
+    def reap(self):
+        """
+        Stop the idle relays, except the prewarmed ones
+        """
+        now = time()
+        prewarm = self.get_prewarm()
+        for kind, registry in self.registries.items():
+            for row in registry.rows():
+                if (kind, row["channel_id"]) not in prewarm and self.is_idle(kind, row, now):
+                    print(f"🛑 Stop the idle {kind} stream: {row['channel_id']}")
+                    self.stop(registry, row["channel_id"], row["pid"], row["process_start"])
+
+    def prewarm(self, get_channel_data):
+        """
+        Start the most requested channels that are not running, get_channel_data(channel_id) -> {url, headers}
+        """
+        for kind, channel_id in self.get_prewarm():
+            registry = self.registries[kind]
+            if channel_id in registry:
+                continue
+            data = get_channel_data(channel_id)
+            if not data.get("url"):
+                registry.forget_requests([channel_id])
+                continue
+            try:
+                if self.start(kind, channel_id, data["url"], data.get("headers")):
+                    print(f"🔥 Prewarm the {kind} stream: {channel_id}")
+            except Exception as e:
+                print(f"❌ Prewarm the {kind} stream {channel_id} failed: {e}")
+
+    def run(self, get_channel_data, interval: float = 10):
+        """
+        Keep the relays in shape: update the viewers, stop the idle relays and prewarm the popular channels
+        """
+        while True:
+            try:
+                self.poll_stat()
+                self.reap()
+                if config.rtmp_prewarm_num > 0:
+                    self.prewarm(get_channel_data)
+            except Exception as e:
+                print(f"❌ Stream manager error: {e}")
+            sleep(interval)
+
+    def get_streams(self) -> dict:
+        """
+        Get the running relays with their viewers and bandwidth
+        """
+        now = time()
+        prewarm = self.get_prewarm()
+        streams = []
+        for kind, registry in self.registries.items():
+            for row in registry.rows():
+                streams.append({
+                    "kind": kind,
+                    "channel_id": row["channel_id"],
+                    "pid": row["pid"],
+                    "uptime": round(now - row["started_at"]),
+                    "idle": round(now - (row["last_active"] or row["started_at"])),
+                    "viewers": row["viewers"],
+                    "bandwidth": row["bandwidth"],
+                    "requests": row["requests"],
+                    "prewarm": (kind, row["channel_id"]) in prewarm,
+                })
+        return {
+            "count": len(streams),
+            "max": config.rtmp_max_streams,
+            "bandwidth": sum(stream["bandwidth"] or 0 for stream in streams),
+            "streams": streams,
+        }
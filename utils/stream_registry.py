@@ -0,0 +1,256 @@
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from time import time
+
+
+def get_process_start(pid: int) -> str | None:
+    """
+    Get the start time of the process in clock ticks since boot, which tells a reused pid apart,
+    None if it is not known on this platform
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            return file.read().rpartition(b")")[2].split()[19].decode()
+    except (OSError, IndexError):
+        return None
+
+
+def is_pid_alive(pid: int, process_start: str = None) -> bool:
+    """
+    Check if the process is still running, and is still the process started at process_start if given
+    """
+    if sys.platform == "win32":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # A zombie is dead, the orphaned relays of a reloaded worker may never be reaped
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            fields = file.read().rpartition(b")")[2].split()
+    except OSError:
+        return True
+    if fields and fields[0] == b"Z":
+        return False
+    # The pid was reused by another process once the relay exited
+    return not process_start or len(fields) <= 19 or fields[19].decode() == process_start
+
+
+class StreamRegistry:
+    """
+    Registry of the running ffmpeg relays by channel id, stored in SQLite so it is shared by the service workers
+    and survives a worker reload, with the viewer activity and the request counts of the channels
+    """
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS streams (
+                    kind TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    started_at REAL NOT NULL,
+                    PRIMARY KEY (kind, channel_id)
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(streams)")}
+            for column, column_type in (("last_active", "REAL"), ("viewers", "INTEGER"), ("bandwidth", "INTEGER"),
+                                        ("process_start", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE streams ADD COLUMN {column} {column_type}")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stream_requests (
+                    kind TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    last_request REAL NOT NULL,
+                    PRIMARY KEY (kind, channel_id)
+                )
+                """
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a connection in autocommit mode, the transactions are explicit
+        """
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def get(self, channel_id: str) -> int | None:
+        """
+        Get the pid of the running relay of the channel, the dead entry is removed
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT pid, process_start FROM streams WHERE kind = ? AND channel_id = ?",
+                               (self.kind, channel_id)).fetchone()
+            if not row:
+                return None
+            if is_pid_alive(*row):
+                return row[0]
+            conn.execute("DELETE FROM streams WHERE kind = ? AND channel_id = ? AND pid = ?",
+                         (self.kind, channel_id, row[0]))
+        return None
+
+    def claim(self, channel_id: str, start) -> tuple[int, bool]:
+        """
+        Get the running relay of the channel or start it with start() -> pid while holding the write lock,
+        so two workers never start the same channel, return the pid and whether it was started
+        """
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT pid, process_start FROM streams WHERE kind = ? AND channel_id = ?",
+                               (self.kind, channel_id)).fetchone()
+            if row and is_pid_alive(*row):
+                conn.execute("COMMIT")
+                return row[0], False
+            pid = start()
+            now = time()
+            conn.execute(
+                "INSERT OR REPLACE INTO streams "
+                "(kind, channel_id, pid, started_at, last_active, viewers, bandwidth, process_start) "
+                "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?)",
+                (self.kind, channel_id, pid, now, now, get_process_start(pid))
+            )
+            conn.execute("COMMIT")
+            return pid, True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def remove(self, channel_id: str, pid: int = None):
+        """
+        Remove the entry of the channel, only if it still belongs to the pid if given
+        """
+        with closing(self.connect()) as conn:
+            if pid is None:
+                conn.execute("DELETE FROM streams WHERE kind = ? AND channel_id = ?", (self.kind, channel_id))
+            else:
+                conn.execute("DELETE FROM streams WHERE kind = ? AND channel_id = ? AND pid = ?",
+                             (self.kind, channel_id, pid))
+
+    def touch(self, channel_id: str):
+        """
+        Mark the relay of the channel as active now
+        """
+        with closing(self.connect()) as conn:
+            conn.execute("UPDATE streams SET last_active = ? WHERE kind = ? AND channel_id = ?",
+                         (time(), self.kind, channel_id))
+
+    def add_viewer(self, channel_id: str, delta: int):
+        """
+        Count a viewer joining (1) or leaving (-1) the relay of the channel
+        """
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE streams SET viewers = MAX(COALESCE(viewers, 0) + ?, 0), last_active = ? "
+                "WHERE kind = ? AND channel_id = ?",
+                (delta, time(), self.kind, channel_id)
+            )
+
+    def update_stats(self, stats: dict[str, tuple[int, int]]):
+        """
+        Set the viewers and the bandwidth of the relays, the relays missing from the stats have no viewer
+        """
+        now = time()
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE streams SET viewers = 0, bandwidth = 0 WHERE kind = ?", (self.kind,))
+            conn.executemany(
+                "UPDATE streams SET viewers = ?, bandwidth = ?, "
+                "last_active = CASE WHEN ? > 0 THEN ? ELSE last_active END WHERE kind = ? AND channel_id = ?",
+                [(viewers, bandwidth, viewers, now, self.kind, channel_id)
+                 for channel_id, (viewers, bandwidth) in stats.items()]
+            )
+            conn.execute("COMMIT")
+
+    def record_request(self, channel_id: str):
+        """
+        Count a request of the channel
+        """
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "INSERT INTO stream_requests (kind, channel_id, count, last_request) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (kind, channel_id) DO UPDATE SET count = count + 1, last_request = excluded.last_request",
+                (self.kind, channel_id, time())
+            )
+
+    def top_requested(self, limit: int) -> list[str]:
+        """
+        Get the most requested channel ids
+        """
+        if limit <= 0:
+            return []
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT channel_id FROM stream_requests WHERE kind = ? ORDER BY count DESC, last_request DESC LIMIT ?",
+                (self.kind, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def forget_requests(self, channel_ids: list[str]):
+        """
+        Drop the request counts of the channels, e.g. no longer in the result
+        """
+        with closing(self.connect()) as conn:
+            conn.executemany("DELETE FROM stream_requests WHERE kind = ? AND channel_id = ?",
+                             [(self.kind, channel_id) for channel_id in channel_ids])
+
+    def rows(self) -> list[dict]:
+        """
+        Get the running relays, oldest first, the dead entries are removed
+        """
+        with closing(self.connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = [dict(row) for row in conn.execute(
+                "SELECT s.channel_id, s.pid, s.process_start, s.started_at, s.last_active, s.viewers, s.bandwidth, "
+                "COALESCE(r.count, 0) AS requests FROM streams s LEFT JOIN stream_requests r "
+                "ON r.kind = s.kind AND r.channel_id = s.channel_id WHERE s.kind = ? ORDER BY s.started_at",
+                (self.kind,)
+            )]
+            dead = [row for row in rows if not is_pid_alive(row["pid"], row["process_start"])]
+            conn.executemany("DELETE FROM streams WHERE kind = ? AND channel_id = ? AND pid = ?",
+                             [(self.kind, row["channel_id"], row["pid"]) for row in dead])
+        return [row for row in rows if row not in dead]
+
+    def clear(self) -> list[dict]:
+        """
+        Remove all the entries, return the ones still running, e.g. at the service start when no worker owns them
+        """
+        rows = self.rows()
+        with closing(self.connect()) as conn:
+            conn.execute("DELETE FROM streams WHERE kind = ?", (self.kind,))
+        return rows
+
+    def items(self) -> list[tuple[str, int]]:
+        """
+        Get the running relays (channel id, pid), oldest first, the dead entries are removed
+        """
+        return [(row["channel_id"], row["pid"]) for row in self.rows()]
+
+    def __contains__(self, channel_id: str) -> bool:
+        return self.get(channel_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.rows())
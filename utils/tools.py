@@ -12,11 +12,15 @@ from time import time
 import pytz
 import requests
 from bs4 import BeautifulSoup
-from flask import send_file, make_response
+from flask import make_response
 from opencc import OpenCC
 
 import utils.constants as constants
 from utils.config import config, resource_path
+from utils.file_cache import result_file_cache, make_file_response
+from utils.matcher import KeywordMatcher
+from utils.publish import published_manifest
+from utils.url import canonicalize_url
 from utils.types import ChannelData
 
 opencc_t2s = OpenCC("t2s")
@@ -28,9 +32,13 @@ def get_logger(path, level=logging.ERROR, init=False):
     """
     os.makedirs(os.path.dirname(path), exist_ok=True)
     os.makedirs(constants.output_dir, exist_ok=True)
-    if init and os.path.exists(path):
-        os.remove(path)
-    handler = RotatingFileHandler(path, encoding="utf-8")
+    if init:
+        for file in [path] + [f"{path}.{i}" for i in range(1, constants.log_backup_count + 1)]:
+            if os.path.exists(file):
+                os.remove(file)
+    handler = RotatingFileHandler(
+        path, maxBytes=constants.log_chunk_size, backupCount=constants.log_backup_count, encoding="utf-8"
+    )
     logger = logging.getLogger(path)
     logger.addHandler(handler)
     logger.setLevel(level)
@@ -270,14 +278,14 @@ def check_ipv_type_match(ipv_type: str) -> bool:
     )
 
 
-def check_url_by_keywords(url, keywords=None):
+def check_url_by_keywords(url, keywords: KeywordMatcher = None):
     """
     Check by URL keywords
     """
     if not keywords:
         return True
     else:
-        return any(keyword in url for keyword in keywords)
+        return keywords.match(url)
 
 
 def merge_objects(*objects, match_key=None):
@@ -341,84 +349,116 @@ def get_epg_url():
         return f"{get_ip_address()}/epg/epg.gz"
 
 
+def get_m3u_content(content, first_channel_name=None, data=None):
+    """
+    Convert the result txt content to m3u format
+    """
+    m3u_output = f'#EXTM3U x-tvg-url="{get_epg_url()}"\n'
+    current_group = None
+    for line in content.split("\n"):
+        trimmed_line = line.strip()
+        if trimmed_line != "":
+            if "#genre#" in trimmed_line:
+                current_group = trimmed_line.replace(",#genre#", "").strip()
+            else:
+                try:
+                    original_channel_name, _, channel_link = map(
+                        str.strip, trimmed_line.partition(",")
+                    )
+                except:
+                    continue
+                processed_channel_name = re.sub(
+                    r"(CCTV|CETV)-(\d+)(\+.*)?",
+                    lambda m: f"{m.group(1)}{m.group(2)}"
+                              + ("+" if m.group(3) else ""),
+                    first_channel_name if current_group == "🕘️更新时间" else original_channel_name,
+                )
+                m3u_output += f'#EXTINF:-1 tvg-name="{processed_channel_name}" tvg-logo="{join_url(config.cdn_url, f'https://raw.githubusercontent.com/fanmingming/live/main/tv/{processed_channel_name}.png')}"'
+                if current_group:
+                    m3u_output += f' group-title="{current_group}"'
+                item_data = {}
+                if data:
+                    item_list = data.get(original_channel_name, [])
+                    for item in item_list:
+                        if item["url"] == channel_link:
+                            item_data = item
+                            break
+                if item_data:
+                    catchup = item_data.get("catchup")
+                    if catchup:
+                        for key, value in catchup.items():
+                            m3u_output += f' {key}="{value}"'
+                m3u_output += f",{original_channel_name}\n"
+                if item_data and config.open_headers:
+                    headers = item_data.get("headers")
+                    if headers:
+                        for key, value in headers.items():
+                            m3u_output += f"#EXTVLCOPT:http-{key.lower()}={value}\n"
+                m3u_output += f"{channel_link}\n"
+    return m3u_output
+
+
 def convert_to_m3u(path=None, first_channel_name=None, data=None):
     """
     Convert result txt to m3u format
     """
     if os.path.exists(path):
         with open(path, "r", encoding="utf-8") as file:
-            m3u_output = f'#EXTM3U x-tvg-url="{get_epg_url()}"\n'
-            current_group = None
-            for line in file:
-                trimmed_line = line.strip()
-                if trimmed_line != "":
-                    if "#genre#" in trimmed_line:
-                        current_group = trimmed_line.replace(",#genre#", "").strip()
-                    else:
-                        try:
-                            original_channel_name, _, channel_link = map(
-                                str.strip, trimmed_line.partition(",")
-                            )
-                        except:
-                            continue
-                        processed_channel_name = re.sub(
-                            r"(CCTV|CETV)-(\d+)(\+.*)?",
-                            lambda m: f"{m.group(1)}{m.group(2)}"
-                                      + ("+" if m.group(3) else ""),
-                            first_channel_name if current_group == "🕘️更新时间" else original_channel_name,
-                        )
-                        m3u_output += f'#EXTINF:-1 tvg-name="{processed_channel_name}" tvg-logo="{join_url(config.cdn_url, f'https://raw.githubusercontent.com/fanmingming/live/main/tv/{processed_channel_name}.png')}"'
-                        if current_group:
-                            m3u_output += f' group-title="{current_group}"'
-                        item_data = {}
-                        if data:
-                            item_list = data.get(original_channel_name, [])
-                            for item in item_list:
-                                if item["url"] == channel_link:
-                                    item_data = item
-                                    break
-                        if item_data:
-                            catchup = item_data.get("catchup")
-                            if catchup:
-                                for key, value in catchup.items():
-                                    m3u_output += f' {key}="{value}"'
-                        m3u_output += f",{original_channel_name}\n"
-                        if item_data and config.open_headers:
-                            headers = item_data.get("headers")
-                            if headers:
-                                for key, value in headers.items():
-                                    m3u_output += f"#EXTVLCOPT:http-{key.lower()}={value}\n"
-                        m3u_output += f"{channel_link}\n"
-            m3u_file_path = os.path.splitext(path)[0] + ".m3u"
-            with open(m3u_file_path, "w", encoding="utf-8") as m3u_file:
-                m3u_file.write(m3u_output)
-            # print(f"✅ M3U result file generated at: {m3u_file_path}")
+            m3u_output = get_m3u_content(file.read(), first_channel_name, data)
+        m3u_file_path = os.path.splitext(path)[0] + ".m3u"
+        write_file_atomic(m3u_file_path, m3u_output)
+        # print(f"✅ M3U result file generated at: {m3u_file_path}")
 
 
-def get_result_file_content(path=None, show_content=False, file_type=None):
+def get_result_file_entry(path=None, show_content=False, file_type=None):
     """
-    Get the content of the result file
+    Get the cached entry of the result file and whether it is downloaded as an attachment, None if it does not exist
     """
     result_file = (
         os.path.splitext(path)[0] + f".{file_type}"
         if file_type
         else path
     )
-    if os.path.exists(result_file):
-        if config.open_m3u_result:
-            if file_type == "m3u" or not file_type:
-                result_file = os.path.splitext(path)[0] + ".m3u"
-            if file_type != "txt" and show_content == False:
-                return send_file(resource_path(result_file), as_attachment=True)
-        with open(result_file, "r", encoding="utf-8") as file:
-            content = file.read()
-    else:
-        content = constants.waiting_tip
-    response = make_response(content)
+    if not os.path.exists(result_file):
+        return None
+    # The m3u result and the files without a type (epg) are downloaded as attachments
+    as_attachment = show_content == False and (not file_type or (config.open_m3u_result and file_type != "txt"))
+    path = resource_path(result_file) if as_attachment else result_file
+    entry = result_file_cache.get(path, published_manifest.resolve(path)) or result_file_cache.get(path)
+    return (entry, as_attachment) if entry else None
+
+
+def get_result_file_content(path=None, show_content=False, file_type=None):
+    """
+    Get the content of the result file, served from the in-memory cache with conditional and compressed responses
+    """
+    result = get_result_file_entry(path, show_content, file_type)
+    if result:
+        entry, as_attachment = result
+        return make_file_response(entry, as_attachment=as_attachment)
+    response = make_response(constants.waiting_tip)
     response.mimetype = 'text/plain'
     return response
 
 
+def preload_result_files():
+    """
+    Load the served result files of the current generation into the cache of this process,
+    so the first requests after a start or a reload do not wait for the compression
+    """
+    paths = [
+        config.final_file, constants.ipv4_result_path, constants.ipv6_result_path,
+        constants.live_result_path, constants.live_ipv4_result_path, constants.live_ipv6_result_path,
+        constants.hls_result_path, constants.hls_ipv4_result_path, constants.hls_ipv6_result_path,
+    ]
+    for path in paths:
+        for file_type in ("txt", "m3u"):
+            for show_content in (False, True):
+                get_result_file_entry(path, show_content, file_type)
+    for path in (constants.epg_result_path, constants.epg_gz_result_path):
+        get_result_file_entry(path)
+
+
 def remove_duplicates_from_list(data_list, seen, filter_host=False, ipv6_support=True):
     """
     Remove duplicates from data list
@@ -429,7 +469,7 @@ def remove_duplicates_from_list(data_list, seen, filter_host=False, ipv6_support
             continue
         if not ipv6_support and item["ipv_type"] == "ipv6":
             continue
-        part = item["host"] if filter_host else item["url"]
+        part = item["host"] if filter_host else canonicalize_url(item["url"])
         if part not in seen:
             seen.add(part)
             unique_list.append(item)
@@ -518,6 +558,42 @@ def write_content_into_txt(content, path=None, position=None, callback=None):
         callback()
 
 
+def write_file_atomic(path, content: str | bytes):
+    """
+    Write the content into a temp file and move it over the path, the readers never see a partial file
+    """
+    temp_path = f"{path}.tmp"
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def get_secret_key(path, size=32) -> bytes:
+    """
+    Get the secret key shared by the service processes, created once and linked into place
+    so the processes starting together all read the same key
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(os.urandom(size))
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
 def format_name(name: str) -> str:
     """
     Format the  name with sub and replace and lower
@@ -536,6 +612,8 @@ def get_headers_key_value(content: str) -> dict:
     Get the headers key value from content
     """
     key_value = {}
+    if not content or "=" not in content:
+        return key_value
     for match in constants.key_value_pattern.finditer(content):
         key = match.group("key").strip().replace("http-", "").replace("-", "").lower()
         if "refer" in key:
@@ -546,6 +624,51 @@ def get_headers_key_value(content: str) -> dict:
     return key_value
 
 
+def has_headers_key(content: str) -> bool:
+    """
+    Check if the content may contain a key used by the headers or catchup
+    """
+    if not content or "=" not in content:
+        return False
+    content = content.lower()
+    return "useragent" in content or "refer" in content or "origin" in content or "catchup" in content
+
+
+def format_name_url(name, url, attributes="", options="", open_headers=False, check_url=True):
+    """
+    Format the name, URL, headers and catchup of a playlist item, return None if it should be skipped
+    """
+    name = (name or "").strip()
+    url = (url or "").strip()
+    if not name or (check_url and not url):
+        return None
+    data = {"name": name, "url": url}
+    if not has_headers_key(attributes) and not has_headers_key(options):
+        if open_headers:
+            data["headers"] = {}
+        data["catchup"] = {}
+        return data
+    attributes = {**get_headers_key_value(attributes),
+                  **get_headers_key_value(options)}
+    headers = {
+        "User-Agent": attributes.get("useragent", ""),
+        "Referer": attributes.get("referer", ""),
+        "Origin": attributes.get("origin", "")
+    }
+    catchup = {
+        "catchup": attributes.get("catchup", ""),
+        "catchup-source": attributes.get("catchupsource", ""),
+    }
+    headers = {k: v for k, v in headers.items() if v}
+    catchup = {k: v for k, v in catchup.items() if v}
+    if not open_headers and headers:
+        return None
+    if open_headers:
+        data["headers"] = headers
+    data["catchup"] = catchup
+    return data
+
+
 def get_name_url(content, pattern, open_headers=False, check_url=True):
     """
     Extract name and URL from content using a regex pattern.
@@ -557,30 +680,16 @@ def get_name_url(content, pattern, open_headers=False, check_url=True):
     result = []
     for match in pattern.finditer(content):
         group_dict = match.groupdict()
-        name = (group_dict.get("name", "") or "").strip()
-        url = (group_dict.get("url", "") or "").strip()
-        if not name or (check_url and not url):
-            continue
-        data = {"name": name, "url": url}
-        attributes = {**get_headers_key_value(group_dict.get("attributes", "")),
-                      **get_headers_key_value(group_dict.get("options", ""))}
-        headers = {
-            "User-Agent": attributes.get("useragent", ""),
-            "Referer": attributes.get("referer", ""),
-            "Origin": attributes.get("origin", "")
-        }
-        catchup = {
-            "catchup": attributes.get("catchup", ""),
-            "catchup-source": attributes.get("catchupsource", ""),
-        }
-        headers = {k: v for k, v in headers.items() if v}
-        catchup = {k: v for k, v in catchup.items() if v}
-        if not open_headers and headers:
-            continue
-        if open_headers:
-            data["headers"] = headers
-        data["catchup"] = catchup
-        result.append(data)
+        data = format_name_url(
+            group_dict.get("name", ""),
+            group_dict.get("url", ""),
+            group_dict.get("attributes", ""),
+            group_dict.get("options", ""),
+            open_headers,
+            check_url
+        )
+        if data:
+            result.append(data)
     return result
 
 
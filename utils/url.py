@@ -0,0 +1,45 @@
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {
+    "http": 80,
+    "https": 443,
+    "rtmp": 1935,
+    "rtsp": 554,
+}
+
+
+def strip_url_info(url: str) -> str:
+    """
+    Remove the $info suffix of the url
+    """
+    return url.partition("$")[0].strip()
+
+
+@lru_cache(maxsize=262144)
+def canonicalize_url(url: str) -> str:
+    """
+    Get the canonical form of the url, used as the dedup key:
+    no $info suffix or fragment, lowercase scheme and host, no default port,
+    no trailing slash and sorted query parameters
+    """
+    url = strip_url_info(url)
+    try:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = parts.hostname or ""
+        port = parts.port
+    except ValueError:
+        return url
+    if not scheme or not host:
+        return url
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    path = parts.path.rstrip("/")
+    query = "&".join(sorted(param for param in parts.query.split("&") if param))
+    return urlunsplit((scheme, netloc, path, query, ""))
+